@@ -1,8 +1,9 @@
 from django import forms
 from .models import CustomUser
 from django.contrib.auth.forms import UserCreationForm
+from projects.uploads import UploadLimitsMixin
 
-class RegisterForm(UserCreationForm):
+class RegisterForm(UploadLimitsMixin, UserCreationForm):
     email = forms.EmailField(required=True)
     phone_number = forms.CharField(required=True)
     birthdate = forms.DateField(widget=forms.DateInput(attrs={'type': 'date'}))
@@ -19,7 +20,7 @@ class RegisterForm(UserCreationForm):
             'password1', 'password2'
         ]
 
-class EditProfileForm(forms.ModelForm):
+class EditProfileForm(UploadLimitsMixin, forms.ModelForm):
     class Meta:
         model = CustomUser
         fields = [
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:15
+
+import projects.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_alter_customuser_is_active_activationtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='profile_picture_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='customuser',
+            name='profile_picture',
+            field=projects.images.ResponsiveImageField(blank=True, null=True, upload_to='profile_pics/', variants_field='profile_picture_variants'),
+        ),
+    ]
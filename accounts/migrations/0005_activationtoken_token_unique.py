@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:42
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activationtoken',
+            name='token',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
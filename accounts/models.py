@@ -5,18 +5,21 @@ from django.utils import timezone
 from datetime import timedelta
 import uuid
 
+from projects.images import ResponsiveImageField
+
 class CustomUser(AbstractUser):
     phone_number = models.CharField(max_length=15, unique=True, null=True, blank=True)
     birthdate = models.DateField(null=True, blank=True)
     gender = models.CharField(max_length=10, choices=[('Male', 'Male'), ('Female', 'Female')])
     country = models.CharField(max_length=50)
-    profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    profile_picture = ResponsiveImageField(upload_to='profile_pics/', blank=True, null=True, variants_field='profile_picture_variants')
+    profile_picture_variants = models.JSONField(default=dict, blank=True, editable=False)
     bio = models.TextField(blank=True,null=True)
     is_active = models.BooleanField(default=False)  # Users must activate their account via email
 
 class ActivationToken(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
-    token = models.UUIDField(default=uuid.uuid4, editable=False)
+    token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def is_expired(self):
@@ -10,7 +10,11 @@ from django.utils.html import strip_tags
 from django.conf import settings
 from .models import CustomUser, ActivationToken
 from django.http import Http404
-from django.db.models import Q
+from projects.pagination import paginate
+from projects.rails import get_home_rails
+from projects.routing import read_replica
+from projects.search import search_projects
+from projects.uploads import rejected_uploads
 
 def landing_view(request):
     """Landing page - first page users see"""
@@ -19,57 +23,27 @@ def landing_view(request):
     return render(request, 'landing.html')
 
 @login_required
+@read_replica
 def home_view(request):
     """Home page for authenticated users"""
     search_query = request.GET.get('search', '').strip()
-    projects = Project.objects.all()
+    projects = Project.objects.with_card_stats()
     
     if search_query:
-        # Enhanced search with multiple fields
-        projects = projects.filter(
-            Q(title__icontains=search_query) |
-            Q(tags__icontains=search_query) |
-            Q(details__icontains=search_query) |
-            Q(category__name__icontains=search_query) |
-            Q(owner__first_name__icontains=search_query) |
-            Q(owner__last_name__icontains=search_query)
-        ).distinct()
-        
-        # Order results by relevance
-        from django.db.models import Case, When, IntegerField
-        projects = projects.annotate(
-            relevance=Case(
-                When(title__icontains=search_query, then=3),
-                When(tags__icontains=search_query, then=2),
-                When(details__icontains=search_query, then=1),
-                default=0,
-                output_field=IntegerField(),
-            )
-        ).order_by('-relevance', '-start_time')
-    
-    # Get featured and top projects for non-search results
-    featured_projects = None
-    top_projects = None
-    latest_projects = None
-    
-    if not search_query:
-        featured_projects = Project.objects.filter(featured=True, status='active').order_by('-start_time')[:6]
-        latest_projects = Project.objects.filter(status='active').order_by('-start_time')[:6]
-        
-        # Get top rated projects
-        from django.db.models import Avg
-        top_projects = Project.objects.filter(status='active').annotate(
-            avg_rating=Avg('projectrating__rating')
-        ).filter(avg_rating__isnull=False).order_by('-avg_rating')[:6]
+        # Full-text search, ordered by relevance
+        projects = search_projects(projects, search_query).order_by('-relevance', '-start_time')
     
     context = {
         'projects': projects,
         'search_query': search_query,
         'search_results_count': projects.count() if search_query else None,
-        'featured_projects': featured_projects,
-        'top_projects': top_projects,
-        'latest_projects': latest_projects,
+        'featured_projects': None,
+        'top_projects': None,
+        'latest_projects': None,
     }
+    # Featured, latest and top rated rails for non-search results
+    if not search_query:
+        context.update(get_home_rails())
     return render(request, 'home.html', context)
 
 @login_required
@@ -77,8 +51,9 @@ def profile_view(request):
     user = request.user
     # Get user's projects
     from projects.models import Project
-    projects = Project.objects.filter(owner=user).order_by('-start_time')
-    return render(request, 'profile.html', {'user': user, 'projects': projects})
+    projects = Project.objects.filter(owner=user).with_card_stats()
+    page = paginate(request, projects, ['-start_time', 'id'])
+    return render(request, 'profile.html', {'user': user, 'projects': page.object_list, 'page': page})
 
 def send_activation_email(request, user, activation_token):
     """Send activation email to user"""
@@ -105,7 +80,7 @@ def send_activation_email(request, user, activation_token):
 
 def register_view(request):
     if request.method == 'POST':
-        form = RegisterForm(request.POST, request.FILES)
+        form = RegisterForm(request.POST, request.FILES, upload_errors=rejected_uploads(request))
         if form.is_valid():
             # Create user but don't save yet
             user = form.save(commit=False)
@@ -160,35 +135,10 @@ def activate_account(request, token):
         return render(request, 'activation_invalid.html')
 
 @login_required
+@read_replica
 def home_view(request):
-    # Get top 5 highest-rated active projects
-    from projects.models import Project
-    from django.db.models import Avg
-    
-    top_projects = Project.objects.filter(
-        status='active'
-    ).annotate(
-        avg_rating=Avg('projectrating__rating')
-    ).filter(
-        avg_rating__isnull=False
-    ).order_by('-avg_rating')[:5]
-    
-    # Get latest 5 projects
-    latest_projects = Project.objects.filter(
-        status='active'
-    ).order_by('-start_time')[:5]
-    
-    # Get featured projects (admin-selected)
-    featured_projects = Project.objects.filter(
-        status='active',
-        featured=True
-    ).order_by('-start_time')[:5]
-    
-    return render(request, 'home.html', {
-        'top_projects': top_projects,
-        'latest_projects': latest_projects,
-        'featured_projects': featured_projects
-    })
+    # Top 5 highest-rated, latest 5 and admin-featured projects, served from the rails cache
+    return render(request, 'home.html', get_home_rails(limit=5))
 
 def login_view(request):
     if request.user.is_authenticated:
@@ -231,7 +181,8 @@ from .forms import EditProfileForm
 @login_required
 def edit_profile_view(request):
     if request.method == 'POST':
-        form = EditProfileForm(request.POST, request.FILES, instance=request.user)
+        form = EditProfileForm(request.POST, request.FILES, instance=request.user,
+                               upload_errors=rejected_uploads(request))
         if form.is_valid():
             form.save()
             return redirect('profile')
@@ -241,8 +192,9 @@ def edit_profile_view(request):
 
 @login_required
 def my_donations_view(request):
-    donations = Donation.objects.filter(user=request.user)
-    return render(request, 'my_donations.html', {'donations':donations})
+    donations = Donation.objects.filter(user=request.user).select_related('project')
+    page = paginate(request, donations, ['-timestamp', 'id'])
+    return render(request, 'my_donations.html', {'donations': page.object_list, 'page': page})
 
 @login_required
 def delete_account_view(request):
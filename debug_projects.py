@@ -27,7 +27,7 @@ def debug_projects():
         print(f"  ID: {project.id}")
         print(f"  Title: '{project.title}'")
         print(f"  Details: '{project.details[:100]}...'")
-        print(f"  Tags: '{project.tags}'")
+        print(f"  Tags: '{' '.join(tag.name for tag in project.tags.all())}'")
         print(f"  Category: '{project.category.name if project.category else 'None'}'")
         print(f"  Owner: '{project.owner.first_name} {project.owner.last_name}'")
         print(f"  Status: '{project.status}'")
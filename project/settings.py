@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +44,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so they measure every other middleware too
+    'projects.metrics.MetricsMiddleware',
+    'projects.querystats.SQLAccountingMiddleware',
+    'projects.slowqueries.SlowQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Outermost after security, so it sees the session and login writes
+    'projects.routing.ReplicaRoutingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -52,6 +59,30 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Query count and SQL time of each request in X-SQL-* response headers; see projects.querystats
+SQL_ACCOUNTING = {
+    'ENABLED': DEBUG,
+}
+
+# Per-view latency, SQL and template time, scraped in Prometheus format from
+# /internal/metrics/ with "Authorization: Bearer <TOKEN>" or from ALLOWED_IPS;
+# closed until one is set. Behind a proxy, ALLOWED_IPS is matched against the
+# address in CLIENT_IP_HEADER (e.g. 'HTTP_X_REAL_IP'); see projects.metrics
+METRICS = {
+    'ENABLED': True,
+    'ALLOWED_IPS': [],
+    'CLIENT_IP_HEADER': None,
+    'TOKEN': None,
+}
+
+# Opt-in: record queries slower than THRESHOLD seconds with their plan, listed
+# at /admin/slow-queries/; see projects.slowqueries
+SLOW_QUERIES = {
+    'ENABLED': False,
+    'THRESHOLD': 0.1,
+    'BUFFER_SIZE': 100,
+}
+
 # Authentication settings
 LOGIN_REDIRECT_URL = 'home'
 LOGOUT_REDIRECT_URL = 'login'
@@ -60,7 +91,8 @@ ROOT_URLCONF = 'project.urls'
 import os
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's backend, timing renders for projects.metrics
+        'BACKEND': 'projects.metrics.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,9 +115,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Wait for the write lock instead of failing at once, take it when a
+            # transaction starts so two readers can't deadlock upgrading to
+            # writers, and let readers proceed during writes (WAL)
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL',
+        },
     }
 }
 
+# Reads of the views marked @read_replica go to REPLICAS; see projects.routing.
+# To try it locally, copy db.sqlite3 to replica.sqlite3 (or use a local Postgres) and add
+#   DATABASES['replica'] = {**DATABASES['default'], 'NAME': BASE_DIR / 'replica.sqlite3',
+#                           'TEST': {'MIRROR': 'default'}}
+# then list 'replica' below
+DATABASE_ROUTERS = ['projects.routing.ReplicaRouter']
+DATABASE_ROUTING = {
+    'REPLICAS': [],
+    'STICKY_SECONDS': 5,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,11 +173,34 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 # Media files (User uploaded files)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media is served by projects.serving; OFFLOAD hands transfers to the proxy
+# ('x-sendfile', or 'x-accel-redirect' with an internal nginx location at ACCEL_PREFIX)
+MEDIA_SERVING = {
+    'OFFLOAD': None,
+    'ACCEL_PREFIX': '/protected-media/',
+    'MAX_AGE': 60 * 60,
+}
+
+# Uploads are stored once per distinct content and reference counted; see projects.storage.
+# Outside DEBUG, collectstatic writes hashed, precompressed bundles; see projects.staticfiles
+STORAGES = {
+    'default': {
+        'BACKEND': 'projects.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'projects.staticfiles.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -148,3 +222,36 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # EMAIL_HOST_USER = 'your-email@gmail.com'  # Replace with your email
 # EMAIL_HOST_PASSWORD = 'your-app-password'  # Replace with your app password
 # DEFAULT_FROM_EMAIL = 'your-email@gmail.com'  # Replace with your email
+
+# Project search
+# SQLite FTS5 index; use 'projects.search.BasicSearchBackend' on databases without FTS5
+PROJECT_SEARCH_BACKEND = 'projects.search.SqliteFTS5SearchBackend'
+
+# Similar projects
+# Neighbours per project and the score given to a shared category; see projects.similarity
+PROJECT_SIMILARITY = {
+    'TOP_K': 4,
+    'CATEGORY_WEIGHT': 0.3,
+}
+
+# Donations
+# BUFFERED batches concurrent donations into one write transaction; see projects.donations
+PROJECT_DONATIONS = {
+    'BUFFERED': False,
+}
+
+# Uploads
+# Streamed to disk and rejected by size, type or daily quota while arriving; see projects.uploads
+FILE_UPLOAD_HANDLERS = ['projects.uploads.StreamingUploadHandler']
+UPLOAD_LIMITS = {
+    'MAX_SIZE': 10 * 1024 * 1024,
+    'ALLOWED_TYPES': ['jpeg', 'png', 'gif', 'webp'],
+    'DAILY_QUOTA': 200 * 1024 * 1024,
+}
+
+# Image processing
+# Uploads are resized in a pool of WORKERS processes (None: one per core); see projects.images
+IMAGE_PROCESSING = {
+    'BACKGROUND': True,
+    'WORKERS': None,
+}
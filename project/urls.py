@@ -17,12 +17,21 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
 from django.shortcuts import redirect
+from projects.metrics import metrics_view
+from projects.slowqueries import slow_queries_view
+from projects.serving import serve_media, serve_static
 
 urlpatterns = [
+    path('admin/slow-queries/', admin.site.admin_view(slow_queries_view), name='slow_queries'),
     path('admin/', admin.site.urls),
     path('', lambda request: redirect('landing'), name='root'),
     path('accounts/', include('accounts.urls')),
     path('projects/', include('projects.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Prometheus scrape endpoint, for internal addresses only
+    path('internal/metrics/', metrics_view, name='metrics'),
+    # Served in production too; set MEDIA_SERVING['OFFLOAD'] to let the proxy send the bytes
+    path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", serve_media, name='media'),
+    # Collected bundles when nothing in front serves STATIC_ROOT; runserver serves them under DEBUG
+    path(f"{settings.STATIC_URL.strip('/')}/<path:path>", serve_static, name='static'),
+]
\ No newline at end of file
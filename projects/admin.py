@@ -1,18 +1,29 @@
 from django.contrib import admin
-from .models import Category, Project, Comment, Donation, ProjectReport, CommentReport, ProjectRating, ProjectImage
+from .models import Category, Project, Comment, Donation, ProjectReport, CommentReport, ProjectRating, ProjectImage, Tag, ProjectTag
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name']
     search_fields = ['name']
 
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ['name']
+    search_fields = ['name']
+
+class ProjectTagInline(admin.TabularInline):
+    model = ProjectTag
+    autocomplete_fields = ['tag']
+    extra = 1
+
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
     list_display = ['title', 'owner', 'category', 'total_target', 'status', 'featured', 'start_time', 'end_time']
     list_filter = ['status', 'category', 'featured', 'start_time', 'end_time']
     search_fields = ['title', 'details', 'owner__username']
-    readonly_fields = ['get_donation_percentage']
+    readonly_fields = ['get_donation_percentage', 'donation_total', 'donation_count', 'rating_sum', 'rating_count']
     list_editable = ['featured']
+    inlines = [ProjectTagInline]
     actions = ['mark_as_featured', 'unmark_as_featured']
     
     def mark_as_featured(self, request, queryset):
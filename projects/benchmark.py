@@ -0,0 +1,227 @@
+"""
+HTTP benchmark of the main routes.
+
+``run_benchmark`` sends every route in ``ROUTES`` a number of requests from
+concurrent workers, either through the Django test client in this process
+(no server or network needed) or to a server already running on this
+machine, e.g. ``runserver`` or gunicorn on 127.0.0.1. Routes are measured
+one at a time: latency percentiles, throughput and SQL queries per request,
+counted in process with ``projects.querystats`` or read from the
+``X-SQL-Queries`` header a server sends with ``SQL_ACCOUNTING['ENABLED']``.
+
+Results can be saved as a JSON baseline that later runs are compared with:
+a route regresses when its p95 latency grows by more than the tolerance or
+it runs more queries per request. ``manage.py bench`` is the command line.
+
+The donate and comment routes write: every run adds donations and comments
+by the benchmark user, so run it against a local database such as one
+filled by ``seed_scale``.
+"""
+import math
+import threading
+import time
+import uuid
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.db import connections
+from django.middleware.csrf import CSRF_ALLOWED_CHARS, CSRF_SECRET_LENGTH
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from .querystats import log_queries
+
+# Percentiles reported per route
+PERCENTILES = (50, 95, 99)
+
+# p95 changes smaller than this many milliseconds are noise, whatever the percentage
+MIN_REGRESSION_MS = 1.0
+
+
+class Route:
+    def __init__(self, name, path, method='GET', data=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        # Called for every request, so each POST can carry fresh values
+        self.data = data or (lambda: None)
+
+
+# Names of the routes build_routes() returns
+ROUTES = ['home', 'all_projects', 'all_projects_search', 'project_detail', 'search_suggestions', 'donate', 'comment']
+
+
+def build_routes(project, term):
+    """The benchmarked routes, against ``project`` and searching for ``term``"""
+    return [
+        Route('home', reverse('home')),
+        Route('all_projects', reverse('all_projects')),
+        Route('all_projects_search', f'{reverse("all_projects")}?{urlencode({"search": term})}'),
+        Route('project_detail', reverse('project_detail', args=[project.pk])),
+        Route('search_suggestions', f'{reverse("search_suggestions")}?{urlencode({"q": term})}'),
+        Route('donate', reverse('donate', args=[project.pk]), 'POST',
+              lambda: {'amount': '10', 'idempotency_key': uuid.uuid4().hex}),
+        Route('comment', reverse('add_comment', args=[project.pk]), 'POST',
+              lambda: {'content': 'Benchmark comment'}),
+    ]
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+class RouteResult:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.queries = []
+        self.statuses = []
+        self.elapsed = 0.0
+
+    def record(self, status, latency, queries):
+        # list.append is atomic, so workers share the lists without a lock
+        self.latencies.append(latency)
+        self.statuses.append(status)
+        if queries is not None:
+            self.queries.append(queries)
+
+    @property
+    def errors(self):
+        return sum(1 for status in self.statuses if status >= 400)
+
+    def summary(self):
+        """Milliseconds, requests per second and queries per request, as saved in baselines"""
+        summary = {'requests': len(self.latencies), 'errors': self.errors}
+        for percent in PERCENTILES:
+            summary[f'p{percent}'] = round(percentile(self.latencies, percent) * 1000, 2) if self.latencies else None
+        summary['rps'] = round(len(self.latencies) / self.elapsed, 1) if self.elapsed else None
+        summary['queries'] = round(sum(self.queries) / len(self.queries), 1) if self.queries else None
+        return summary
+
+
+class InProcessDriver:
+    """Requests through the Django test client, logged in as ``user``"""
+
+    def __init__(self, user):
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+        # A failing view counts as an error instead of ending the run
+        self.client = Client(SERVER_NAME=host, raise_request_exception=False)
+        self.client.force_login(user)
+
+    def request(self, route):
+        with log_queries(detail=False) as queries:
+            if route.method == 'POST':
+                response = self.client.post(route.path, route.data())
+            else:
+                response = self.client.get(route.path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response.status_code, queries.count
+
+
+class NoRedirects(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        # The redirect is the response being measured, not the page it leads to
+        return None
+
+
+class ServerDriver:
+    """
+    Requests to a running server. It must use this database: the session is
+    created here, and the CSRF cookie and header carry the same secret.
+    """
+
+    def __init__(self, base_url, user):
+        self.base_url = base_url.rstrip('/')
+        client = Client()
+        client.force_login(user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.csrf = get_random_string(CSRF_SECRET_LENGTH, CSRF_ALLOWED_CHARS)
+        self.cookie = f'{settings.SESSION_COOKIE_NAME}={session}; {settings.CSRF_COOKIE_NAME}={self.csrf}'
+        self.opener = build_opener(NoRedirects)
+
+    def request(self, route):
+        headers = {'Cookie': self.cookie}
+        body = None
+        if route.method == 'POST':
+            body = urlencode(route.data()).encode()
+            headers.update({'Content-Type': 'application/x-www-form-urlencoded', 'X-CSRFToken': self.csrf})
+        request = Request(self.base_url + route.path, data=body, headers=headers, method=route.method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                status, sent = response.status, response.headers
+        except HTTPError as e:
+            # Raised for redirects too, since they aren't followed
+            e.read()
+            status, sent = e.code, e.headers
+        queries = sent.get('X-SQL-Queries')
+        return status, int(queries) if queries is not None else None
+
+
+def run_route(route, drivers, requests, warmup=0):
+    """Send ``requests`` requests to ``route``, one worker per driver"""
+    for _ in range(warmup):
+        drivers[0].request(route)
+    result = RouteResult(route.name)
+    remaining = iter(range(requests))
+    lock = threading.Lock()
+
+    def work(driver):
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            start = time.perf_counter()
+            status, queries = driver.request(route)
+            result.record(status, time.perf_counter() - start, queries)
+
+    def worker(driver):
+        try:
+            work(driver)
+        finally:
+            # Connections opened by this thread would otherwise stay open
+            connections.close_all()
+
+    start = time.perf_counter()
+    if len(drivers) == 1:
+        # In this thread, which also lets tests see their own transaction
+        work(drivers[0])
+    else:
+        threads = [threading.Thread(target=worker, args=(driver,)) for driver in drivers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def run_benchmark(routes, drivers, requests, warmup=0):
+    return [run_route(route, drivers, requests, warmup) for route in routes]
+
+
+def compare(summaries, baseline, tolerance):
+    """Messages for the routes that regressed against a saved baseline"""
+    regressions = []
+    for name, summary in summaries.items():
+        before = baseline.get('routes', {}).get(name)
+        if not before:
+            continue
+        if summary['p95'] is not None and before.get('p95'):
+            limit = max(before['p95'] * (1 + tolerance), before['p95'] + MIN_REGRESSION_MS)
+            if summary['p95'] > limit:
+                change = (summary['p95'] / before['p95'] - 1) * 100
+                regressions.append(f'{name}: p95 {summary["p95"]:.1f}ms, was {before["p95"]:.1f}ms (+{change:.0f}%)')
+        if summary['queries'] is not None and before.get('queries') is not None:
+            # Averages over repeated requests; half a query more is a new query on most of them
+            if summary['queries'] > before['queries'] + 0.5:
+                regressions.append(f'{name}: {summary["queries"]:g} queries per request, was {before["queries"]:g}')
+        if summary['errors'] > before.get('errors', 0):
+            regressions.append(f'{name}: {summary["errors"]} errors, was {before.get("errors", 0)}')
+    return regressions
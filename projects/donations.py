@@ -0,0 +1,256 @@
+"""
+The donation write path.
+
+``donate`` validates the amount as a Decimal, records the donation and its
+counter updates in one transaction, and makes retries safe: a client that
+resubmits with the same idempotency key (a double-click, a retried request)
+gets the original donation back instead of a second one.
+
+SQLite allows one writer at a time, so a burst of donations queues on the
+database lock. Writes that still fail with "database is locked" are retried
+with backoff. With ``PROJECT_DONATIONS['BUFFERED']`` enabled, requests instead
+hand their donation to a single writer thread that commits whatever has
+queued up in one transaction (group commit) and wakes the requests once it
+is durable.
+"""
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, close_old_connections, connection, transaction
+from django.db.models.signals import post_save
+
+from .models import Donation
+
+DEFAULTS = {
+    'BUFFERED': False,
+    # Most donations committed by the writer thread in one transaction
+    'BATCH_SIZE': 200,
+    # Seconds the writer waits for more donations before committing a batch
+    'FLUSH_INTERVAL': 0.01,
+    # Seconds a request waits for the writer before giving up
+    'TIMEOUT': 10,
+}
+
+CENT = Decimal('0.01')
+MIN_DONATION = Decimal('1.00')
+# Donation.amount has max_digits=10, decimal_places=2
+MAX_DONATION = Decimal('99999999.99')
+MAX_KEY_LENGTH = 64
+
+LOCK_RETRIES = 6
+LOCK_RETRY_DELAY = 0.05
+
+
+class DonationError(ValueError):
+    """A donation that can't be accepted; the message is shown to the donor"""
+
+
+def get_donation_settings():
+    return {**DEFAULTS, **getattr(settings, 'PROJECT_DONATIONS', {})}
+
+
+def parse_amount(value):
+    """Validate a submitted amount and return it as a Decimal with two places"""
+    try:
+        amount = Decimal(str(value).strip())
+    except (InvalidOperation, TypeError):
+        raise DonationError('Enter a valid amount.')
+    if not amount.is_finite():
+        raise DonationError('Enter a valid amount.')
+    # Range first: quantizing a huge value like 1e30 overflows the Decimal context
+    if amount < MIN_DONATION:
+        raise DonationError(f'The minimum donation is ${MIN_DONATION}.')
+    if amount > MAX_DONATION:
+        raise DonationError(f'The maximum donation is ${MAX_DONATION}.')
+    if amount != amount.quantize(CENT):
+        raise DonationError('Amounts can have at most two decimal places.')
+    return amount.quantize(CENT)
+
+
+def clean_idempotency_key(key):
+    key = (key or '').strip()
+    if len(key) > MAX_KEY_LENGTH:
+        raise DonationError('Invalid donation request.')
+    return key or None
+
+
+def donate(user, project, amount, idempotency_key=None):
+    """
+    Record a donation and return ``(donation, created)``.
+
+    ``created`` is False when ``idempotency_key`` was already used by this
+    user, in which case the earlier donation is returned unchanged.
+    """
+    amount = parse_amount(amount)
+    idempotency_key = clean_idempotency_key(idempotency_key)
+    if project.is_cancelled():
+        raise DonationError('This project is no longer accepting donations.')
+    config = get_donation_settings()
+    if config['BUFFERED'] and not connection.in_atomic_block:
+        future = get_donation_buffer().submit(user.pk, project.pk, amount, idempotency_key)
+        try:
+            return future.result(timeout=config['TIMEOUT'])
+        except Exception as exc:
+            # The writer timed out or failed; a retry with the same key can't donate twice
+            raise DonationError('Your donation could not be recorded right now. Please try again.') from exc
+    return retry_if_locked(create_donation, user.pk, project.pk, amount, idempotency_key)
+
+
+def retry_if_locked(func, *args):
+    """Call ``func``, retrying with backoff while SQLite reports the database locked"""
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return func(*args)
+        except OperationalError as exc:
+            # Inside an outer transaction the whole transaction has to be retried, not us
+            if 'locked' not in str(exc) or connection.in_atomic_block or attempt == LOCK_RETRIES - 1:
+                raise
+            time.sleep(LOCK_RETRY_DELAY * 2 ** attempt * random.random())
+
+
+def create_donation(user_id, project_id, amount, idempotency_key=None):
+    with transaction.atomic():
+        if idempotency_key:
+            existing = Donation.objects.filter(user_id=user_id, idempotency_key=idempotency_key).first()
+            if existing:
+                return existing, False
+        try:
+            with transaction.atomic():
+                # The project counters are bumped by a post_save receiver in this same transaction
+                donation = Donation.objects.create(
+                    user_id=user_id,
+                    project_id=project_id,
+                    amount=amount,
+                    idempotency_key=idempotency_key,
+                )
+        except IntegrityError:
+            if not idempotency_key:
+                raise
+            # A concurrent request with the same key committed first
+            return Donation.objects.get(user_id=user_id, idempotency_key=idempotency_key), False
+        return donation, True
+
+
+class PendingDonation:
+    def __init__(self, user_id, project_id, amount, idempotency_key):
+        self.user_id = user_id
+        self.project_id = project_id
+        self.amount = amount
+        self.idempotency_key = idempotency_key
+        self.future = Future()
+
+
+class DonationBuffer:
+    """
+    Group commit for donations.
+
+    ``submit`` queues a donation and returns a Future. One daemon thread takes
+    everything that arrives within ``flush_interval`` (up to ``batch_size``),
+    inserts it in a single transaction and resolves the futures with
+    ``(donation, created)`` once it has committed.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        config = get_donation_settings()
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.flush_interval = flush_interval if flush_interval is not None else config['FLUSH_INTERVAL']
+        self.queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, user_id, project_id, amount, idempotency_key=None):
+        pending = PendingDonation(user_id, project_id, amount, idempotency_key)
+        self.queue.put(pending)
+        self._start()
+        return pending.future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='donation-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                self.flush(batch)
+            finally:
+                close_old_connections()
+
+    def flush(self, batch):
+        try:
+            results = retry_if_locked(self._write, batch)
+        except IntegrityError:
+            # Another process used one of the keys in the meantime; fall back to one by one
+            results = []
+            for pending in batch:
+                try:
+                    results.append(retry_if_locked(
+                        create_donation, pending.user_id, pending.project_id,
+                        pending.amount, pending.idempotency_key,
+                    ))
+                except Exception as exc:
+                    results.append(exc)
+        except Exception as exc:
+            results = [exc] * len(batch)
+        for pending, result in zip(batch, results):
+            if isinstance(result, Exception):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+    def _write(self, batch):
+        with transaction.atomic():
+            keys = {p.idempotency_key for p in batch if p.idempotency_key}
+            seen = {
+                (d.user_id, d.idempotency_key): d
+                for d in Donation.objects.filter(idempotency_key__in=keys)
+            }
+            results = []
+            new = []
+            for pending in batch:
+                key = (pending.user_id, pending.idempotency_key)
+                if pending.idempotency_key and key in seen:
+                    # Already stored, or submitted twice within this batch
+                    results.append((seen[key], False))
+                    continue
+                donation = Donation(
+                    user_id=pending.user_id,
+                    project_id=pending.project_id,
+                    amount=pending.amount,
+                    idempotency_key=pending.idempotency_key,
+                )
+                if pending.idempotency_key:
+                    seen[key] = donation
+                new.append(donation)
+                results.append((donation, True))
+            Donation.objects.bulk_create(new)
+            # bulk_create skips signals; send post_save so counters and caches stay in step
+            for donation in new:
+                post_save.send(sender=Donation, instance=donation, created=True, raw=False,
+                               using=connection.alias, update_fields=None)
+            return results
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_donation_buffer():
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = DonationBuffer()
+        return _buffer
@@ -1,7 +1,8 @@
 from django import forms
-from .models import Project, ProjectImage
+from .models import Project, ProjectImage, Tag
+from .uploads import UploadLimitsMixin
 
-class ProjectForm(forms.ModelForm):
+class ProjectForm(UploadLimitsMixin, forms.ModelForm):
     start_time = forms.DateTimeField(widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}))
     end_time = forms.DateTimeField(widget=forms.DateTimeInput(attrs={'type': 'datetime-local'}))
     
@@ -10,14 +11,37 @@ class ProjectForm(forms.ModelForm):
         required=True,
         help_text="Upload an image for your project (required)"
     )
+    
+    # Free-text input, stored as Tag rows by _save_m2m() rather than the model field
+    tags = forms.CharField(
+        required=False,
+        help_text="Separate tags with spaces or commas"
+    )
+
+    field_order = [
+        'title', 'details', 'category', 'total_target',
+        'tags', 'start_time', 'end_time', 'image'
+    ]
 
     class Meta:
         model = Project
         fields = [
             'title', 'details', 'category', 'total_target',
-            'tags', 'start_time', 'end_time', 'image'
+            'start_time', 'end_time', 'image'
         ]
         
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk and not self.is_bound:
+            self.initial['tags'] = ' '.join(tag.name for tag in self.instance.tags.all())
+    
+    def clean_tags(self):
+        return Tag.parse(self.cleaned_data.get('tags'))
+    
+    def _save_m2m(self):
+        super()._save_m2m()
+        self.instance.set_tags(self.cleaned_data['tags'])
+    
     def clean(self):
         cleaned_data = super().clean()
         start_time = cleaned_data.get('start_time')
@@ -28,7 +52,38 @@ class ProjectForm(forms.ModelForm):
         
         return cleaned_data
 
-class ProjectImageForm(forms.ModelForm):
+class MultipleFileInput(forms.ClearableFileInput):
+    allow_multiple_selected = True
+
+
+class MultipleImageField(forms.ImageField):
+    """ImageField that takes a list of files, each validated as an image"""
+    widget = MultipleFileInput
+
+    def clean(self, data, initial=None):
+        if not isinstance(data, (list, tuple)):
+            data = [data] if data else []
+        if not data and self.required:
+            raise forms.ValidationError(self.error_messages['required'], code='required')
+        cleaned = []
+        for file in data:
+            cleaned.append(super().clean(file, initial))
+        return cleaned
+
+
+class GalleryUploadForm(UploadLimitsMixin, forms.Form):
+    MAX_IMAGES = 30
+
+    images = MultipleImageField(help_text=f"Select up to {MAX_IMAGES} images")
+
+    def clean_images(self):
+        images = self.cleaned_data['images']
+        if len(images) > self.MAX_IMAGES:
+            raise forms.ValidationError(f"You can upload at most {self.MAX_IMAGES} images at once.")
+        return images
+
+
+class ProjectImageForm(UploadLimitsMixin, forms.ModelForm):
     class Meta:
         model = ProjectImage
         fields = ['image', 'caption', 'is_primary']
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""
+Resized image derivatives.
+
+Uploads are often multi-megabyte photos and screenshots while a project card
+shows them a few hundred pixels wide. ``ResponsiveImageField`` is an
+``ImageField`` that, after the model is saved, writes a WebP and a JPEG copy
+of the image at each of ``SIZES`` and records them in a JSON field on the same
+model. Templates render them with the ``{% picture %}`` tag from the
+``images`` tag library, which emits a ``srcset`` so browsers download the
+smallest copy that fits. ``generate_image_variants`` backfills existing media.
+
+Decoding and resizing is CPU bound, so by default it doesn't happen in the
+request: the upload is saved as is, its record is marked ``processing`` and
+the bytes are handed to a pool of worker processes (``projects.imaging``).
+When a worker is done its derivatives and EXIF-free original are written to
+storage and the record becomes ``ready``, or ``failed`` if the image could
+not be decoded. The original is served until then.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, models, transaction
+from django.db.models.fields.files import ImageFieldFile
+from django.db.models.signals import post_delete, post_save
+
+from .imaging import FORMATS, process_image
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Process uploads in the worker pool; False processes them inline
+    'BACKGROUND': True,
+    # Worker processes; None uses one per CPU core
+    'WORKERS': None,
+}
+
+# Largest width of each derivative; images are never upscaled
+SIZES = {
+    'card': 480,
+    'gallery': 960,
+    'full': 1920,
+}
+
+DERIVATIVES_DIR = 'derivatives'
+
+PROCESSING = 'processing'
+READY = 'ready'
+FAILED = 'failed'
+
+
+def get_image_settings():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_PROCESSING', {})}
+
+
+def derivative_name(source_name, size, fmt):
+    """Storage name of one derivative, e.g. derivatives/project_images/photo/card.webp"""
+    root = os.path.splitext(source_name)[0]
+    return f'{DERIVATIVES_DIR}/{root}/{size}.{fmt}'
+
+
+def store_variants(storage, source_name, result):
+    """
+    Write what ``process_image`` rendered and return the description that is
+    stored on the model::
+
+        {'source': name, 'status': 'ready', 'width': w, 'height': h,
+         'sizes': {'card': {'width': w, 'height': h, 'webp': name, 'jpeg': name}, ...}}
+
+    ``source`` differs from ``source_name`` when the original was re-saved
+    without its EXIF data; the caller points the model at it.
+    """
+    source = source_name
+    if result['original'] is not None:
+        source = storage.save(source_name, ContentFile(result['original']))
+    sizes = {}
+    for size, entry in result['sizes'].items():
+        if 'same_as' in entry:
+            continue
+        stored = {'width': entry['width'], 'height': entry['height']}
+        for fmt in FORMATS:
+            if fmt not in entry:
+                continue
+            stored[fmt] = storage.save(derivative_name(source_name, size, fmt), ContentFile(entry[fmt]))
+        sizes[size] = stored
+    for size, entry in result['sizes'].items():
+        if 'same_as' in entry:
+            sizes[size] = sizes[entry['same_as']]
+    return {
+        'source': source,
+        'status': READY,
+        'width': result['width'],
+        'height': result['height'],
+        'sizes': sizes,
+    }
+
+
+def variant_names(variants):
+    """Storage names of the derivatives in a record, each once"""
+    return {
+        name
+        for entry in (variants or {}).get('sizes', {}).values()
+        for fmt, name in entry.items() if fmt in FORMATS
+    }
+
+
+def failed_variants(source_name):
+    # Remembering the failure stops every save from retrying it; the original is served
+    return {'source': source_name, 'status': FAILED, 'sizes': {}}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = set()
+
+
+def get_pool():
+    """The shared worker pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = get_image_settings()['WORKERS'] or os.cpu_count() or 1
+            # spawn: forking a process with open database connections and threads is unsafe
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool whose worker died (e.g. killed while decoding) so the next upload starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def wait_for_image_processing(timeout=None):
+    """Block until the images handed to the pool so far are stored; used by commands and tests"""
+    wait(list(_pending), timeout)
+
+
+class ResponsiveFieldFile(ImageFieldFile):
+    @property
+    def variants(self):
+        """The stored derivatives of this file, or {} if they are missing, stale or not ready yet"""
+        if not self.name or not self.field.variants_field:
+            return {}
+        variants = getattr(self.instance, self.field.variants_field, None) or {}
+        if variants.get('source') != self.name or variants.get('status', READY) != READY:
+            return {}
+        return variants
+
+    @property
+    def processing(self):
+        if not self.name or not self.field.variants_field:
+            return False
+        variants = getattr(self.instance, self.field.variants_field, None) or {}
+        return variants.get('source') == self.name and variants.get('status') == PROCESSING
+
+    def variant_url(self, size, fmt='webp'):
+        """URL of one derivative, falling back to the original file"""
+        entry = self.variants.get('sizes', {}).get(size)
+        if entry:
+            name = entry.get(fmt) or entry.get('jpeg')
+            if name:
+                return self.storage.url(name)
+        return self.url
+
+
+class ResponsiveImageField(models.ImageField):
+    """
+    ImageField that keeps resized derivatives of its image.
+
+    ``variants_field`` names a JSONField on the same model where the
+    derivatives are recorded.
+    """
+    attr_class = ResponsiveFieldFile
+
+    def __init__(self, *args, variants_field=None, **kwargs):
+        self.variants_field = variants_field
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.variants_field:
+            kwargs['variants_field'] = self.variants_field
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if cls._meta.abstract:
+            return
+        if self.variants_field:
+            post_save.connect(self.update_variants, sender=cls)
+        post_delete.connect(self.release_files, sender=cls)
+
+    def variants_are_current(self, instance):
+        file = getattr(instance, self.attname)
+        stored = getattr(instance, self.variants_field) or {}
+        if not file:
+            return not stored
+        return stored.get('source') == file.name
+
+    def update_variants(self, instance, raw=False, force=False, **kwargs):
+        """Regenerate the derivatives if the image changed since they were made"""
+        if raw or (not force and self.variants_are_current(instance)):
+            return
+        superseded = self.refresh_variants(instance)
+        self.save_variants(instance, getattr(instance, self.variants_field))
+        for name in superseded:
+            self.storage.delete(name)
+
+    def update_variants_bulk(self, instances):
+        """update_variants for rows inserted with bulk_create, written with one bulk_update"""
+        superseded = [name for instance in instances for name in self.refresh_variants(instance)]
+        if instances:
+            type(instances[0])._default_manager.bulk_update(instances, [self.name, self.variants_field])
+        for name in superseded:
+            self.storage.delete(name)
+
+    def refresh_variants(self, instance):
+        """
+        Build (or queue) the derivatives of ``instance`` and set its fields
+        without saving them. Returns the names of files the caller releases
+        once the instance is saved.
+        """
+        file = getattr(instance, self.attname)
+        model, pk = type(instance), instance.pk
+        previous = getattr(instance, self.variants_field) or {}
+        # The derivatives of the previous file (or of this one, when forced) are replaced
+        self.release(previous, keep=file.name)
+        if not file:
+            setattr(instance, self.variants_field, {})
+            return []
+        source_name = file.name
+        if get_image_settings()['BACKGROUND']:
+            setattr(instance, self.variants_field, {'source': source_name, 'status': PROCESSING, 'sizes': {}})
+            # The worker must not see the file before the upload is committed
+            transaction.on_commit(lambda: self.submit(model, pk, source_name))
+            return []
+        try:
+            with file.storage.open(source_name, 'rb') as source:
+                result = process_image(source.read(), SIZES)
+            variants = store_variants(file.storage, source_name, result)
+        except Exception:
+            logger.exception('Could not build derivatives of %s', source_name)
+            variants = failed_variants(source_name)
+        setattr(instance, self.variants_field, variants)
+        if variants['source'] == source_name:
+            return []
+        setattr(instance, self.attname, variants['source'])
+        return [source_name]
+
+    def save_variants(self, instance, variants):
+        setattr(instance, self.variants_field, variants)
+        fields = {self.variants_field: variants}
+        file = getattr(instance, self.attname)
+        if file:
+            # The original may have been re-saved under a new name
+            fields[self.name] = file.name
+        type(instance)._default_manager.filter(pk=instance.pk).update(**fields)
+
+    def release(self, variants, keep=None):
+        """
+        Delete the derivatives of a record that is being replaced. With a
+        reference-counted storage the superseded original is released too;
+        other storages keep it, as Django does for replaced files.
+        """
+        for name in variant_names(variants):
+            self.storage.delete(name)
+        source = (variants or {}).get('source')
+        if source and source != keep and getattr(self.storage, 'reference_counted', False):
+            self.storage.delete(source)
+
+    def release_files(self, instance, **kwargs):
+        """Release a deleted row's files from a reference-counted storage"""
+        if not getattr(self.storage, 'reference_counted', False):
+            return
+        file = getattr(instance, self.attname)
+        if file:
+            self.storage.delete(file.name)
+        if self.variants_field:
+            self.release(getattr(instance, self.variants_field), keep=file.name)
+
+    def submit(self, model, pk, source_name):
+        """Hand an image to the worker pool; its result is stored from a callback"""
+        done = Future()
+        _pending.add(done)
+        try:
+            with self.storage.open(source_name, 'rb') as source:
+                data = source.read()
+            pool = get_pool()
+            future = pool.submit(process_image, data, SIZES)
+        except Exception:
+            logger.exception('Could not queue %s for processing', source_name)
+            self._finish(model, pk, source_name, None, None, done)
+            return
+        future.add_done_callback(lambda future: self._finish(model, pk, source_name, pool, future, done))
+
+    def _finish(self, model, pk, source_name, pool, future, done):
+        # Runs in the pool's result thread, not in a request
+        try:
+            variants = failed_variants(source_name)
+            if future is not None:
+                try:
+                    variants = store_variants(self.storage, source_name, future.result())
+                except BrokenProcessPool:
+                    logger.exception('Image worker died while processing %s', source_name)
+                    _discard_pool(pool)
+                except Exception:
+                    logger.exception('Could not build derivatives of %s', source_name)
+            # Skip the write if the image was replaced in the meantime; its own job records it
+            updated = model._default_manager.filter(pk=pk, **{self.name: source_name}).update(**{
+                self.name: variants['source'],
+                self.variants_field: variants,
+            })
+            if not updated:
+                self.release(variants, keep=source_name)
+            elif variants['source'] != source_name:
+                # Superseded by the copy without EXIF data
+                self.storage.delete(source_name)
+        except Exception:
+            logger.exception('Could not record derivatives of %s', source_name)
+        finally:
+            close_old_connections()
+            _pending.discard(done)
+            done.set_result(None)
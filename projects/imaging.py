@@ -0,0 +1,102 @@
+"""
+Pillow work for uploaded images.
+
+This module deliberately imports nothing from Django so it can run in the
+worker processes of the image pool (see ``projects.images``): it takes the
+raw bytes of an upload and returns encoded bytes, and never touches storage
+or the database.
+"""
+import io
+
+from PIL import Image, ImageOps, features
+
+# Encoders in order of preference; WebP is skipped if Pillow was built without it
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Formats whose originals are re-saved without their EXIF block; others
+# (e.g. animated GIFs) would lose more than metadata by re-encoding
+SANITIZED_FORMATS = {
+    'JPEG': {'quality': 95},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 95},
+}
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt != 'webp' or features.check('webp')]
+
+
+def encode(image, fmt):
+    pil_format, options = FORMATS[fmt]
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        # JPEG has no alpha channel; flatten transparent images onto white
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    output = io.BytesIO()
+    image.save(output, pil_format, **options)
+    return output.getvalue()
+
+
+def sanitize(image, source_format, icc_profile):
+    """Re-encode an already orientation-fixed original without its metadata"""
+    options = dict(SANITIZED_FORMATS[source_format])
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    if source_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    output = io.BytesIO()
+    image.save(output, source_format, **options)
+    return output.getvalue()
+
+
+def process_image(data, sizes, formats=None):
+    """
+    Decode an upload, fix its orientation and render the derivatives.
+
+    ``sizes`` maps size names to maximum widths. Returns::
+
+        {'width': w, 'height': h,
+         'original': bytes without EXIF, or None if the original can stay as is,
+         'sizes': {'card': {'width': w, 'height': h, 'webp': bytes, 'jpeg': bytes}
+                           or {'same_as': 'card'} for sizes wider than the image, ...}}
+
+    Raises whatever Pillow raises for files it can't decode.
+    """
+    formats = formats or available_formats()
+    image = Image.open(io.BytesIO(data))
+    source_format = image.format
+    has_exif = bool(image.getexif())
+    icc_profile = image.info.get('icc_profile')
+    # Applies the EXIF orientation to the pixels and drops the tag
+    image = ImageOps.exif_transpose(image)
+    image.load()
+    width, height = image.size
+
+    original = None
+    if has_exif and source_format in SANITIZED_FORMATS:
+        original = sanitize(image, source_format, icc_profile)
+
+    results = {}
+    by_width = {}
+    for size, max_width in sizes.items():
+        target = min(max_width, width)
+        if target in by_width:
+            # The image is narrower than this size too; reuse the smaller copy
+            results[size] = {'same_as': by_width[target]}
+            continue
+        resized = image
+        if target != width:
+            resized = image.resize((target, max(round(height * target / width), 1)), Image.LANCZOS)
+        entry = {'width': resized.width, 'height': resized.height}
+        for fmt in formats:
+            entry[fmt] = encode(resized, fmt)
+        results[size] = entry
+        by_width[target] = size
+    return {'width': width, 'height': height, 'original': original, 'sizes': results}
@@ -0,0 +1,120 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from projects.benchmark import PERCENTILES, ROUTES, InProcessDriver, ServerDriver, build_routes, compare, run_benchmark
+from projects.models import Project
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the main routes with concurrent workers, reporting latency percentiles, throughput and '
+        'queries per request, and flag regressions against a saved baseline. The donate and comment '
+        'routes add rows, so run it against a local database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per route (default: 200)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Concurrent workers (default: 4)')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per route first (default: 10)')
+        parser.add_argument('--routes', nargs='+', choices=ROUTES, help='Routes to run (default: all)')
+        parser.add_argument(
+            '--server', metavar='URL',
+            help='Benchmark a server running on this database, e.g. http://127.0.0.1:8000, '
+                 'instead of the test client in this process'
+        )
+        parser.add_argument('--project', type=int, help='Project to use (default: the active one with most donations)')
+        parser.add_argument('--search', help="Search term (default: a word of the project's title)")
+        parser.add_argument('--user', default='bench', help='User the requests log in as, created if missing (default: bench)')
+        parser.add_argument('--baseline', metavar='PATH', help='Compare with a baseline saved by --save-baseline')
+        parser.add_argument('--save-baseline', metavar='PATH', help='Save the results as a baseline')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='p95 growth allowed before a route counts as regressed (default: 0.2, i.e. 20%%)'
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Could not read the baseline: {e}')
+
+        project = self.get_project(options['project'])
+        term = options['search'] or max(project.title.split(), key=len)
+        routes = [route for route in build_routes(project, term) if not options['routes'] or route.name in options['routes']]
+        user = self.get_user(options['user'])
+        if options['server']:
+            drivers = [ServerDriver(options['server'], user) for _ in range(options['concurrency'])]
+        else:
+            drivers = [InProcessDriver(user) for _ in range(options['concurrency'])]
+            if settings.DEBUG:
+                self.stdout.write(self.style.WARNING('DEBUG is on; its overhead is included in the numbers.'))
+        self.stdout.write(
+            f'Benchmarking {len(routes)} routes on project {project.pk}, searching for "{term}": '
+            f'{options["requests"]} requests each from {options["concurrency"]} workers...'
+        )
+
+        summaries = {}
+        for result in run_benchmark(routes, drivers, options['requests'], options['warmup']):
+            summaries[result.name] = result.summary()
+        self.report(summaries)
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'server': options['server'] or 'in-process',
+                    'requests': options['requests'],
+                    'concurrency': options['concurrency'],
+                    'routes': summaries,
+                }, f, indent=2)
+            self.stdout.write(f'Saved baseline to {options["save_baseline"]}.')
+        if baseline is not None:
+            regressions = compare(summaries, baseline, options['tolerance'])
+            for message in regressions:
+                self.stderr.write(self.style.ERROR(f'Regression in {message}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS(f'Successfully compared with {options["baseline"]}: no regressions.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Successfully benchmarked the routes.'))
+
+    def get_project(self, project_id):
+        projects = Project.objects.filter(status='active')
+        if project_id is not None:
+            projects = projects.filter(pk=project_id)
+        project = projects.order_by('-donation_count', 'pk').first()
+        if project is None:
+            raise CommandError('No active project to benchmark; load some with seed_scale.')
+        return project
+
+    def get_user(self, username):
+        User = get_user_model()
+        user, created = User.objects.get_or_create(
+            username=username, defaults={'email': f'{username}@example.com', 'is_active': True}
+        )
+        if created:
+            user.set_unusable_password()
+            user.save(update_fields=['password'])
+        elif not user.is_active:
+            raise CommandError(f'User {username} is not active.')
+        return user
+
+    def report(self, summaries):
+        columns = [f'p{percent}ms' for percent in PERCENTILES]
+        self.stdout.write(
+            f'{"route":<22}{"requests":>9}{"errors":>8}' + ''.join(f'{column:>9}' for column in columns)
+            + f'{"req/s":>9}{"queries":>9}'
+        )
+        for name, summary in summaries.items():
+            values = [summary[f'p{percent}'] for percent in PERCENTILES] + [summary['rps'], summary['queries']]
+            self.stdout.write(
+                f'{name:<22}{summary["requests"]:>9}{summary["errors"]:>8}'
+                + ''.join(f'{"-" if value is None else f"{value:.1f}":>9}' for value in values)
+            )
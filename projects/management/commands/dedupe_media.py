@@ -0,0 +1,100 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import FileField, Q, Sum
+from projects.images import FORMATS, ResponsiveImageField, variant_names
+from projects.models import MediaBlob
+from projects.storage import is_blob
+
+class Command(BaseCommand):
+    help = 'Move uploaded files into content-addressed storage, keeping one copy of identical files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of rows read per query (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        self.blobs = {}
+        self.missing = 0
+        stored_before = MediaBlob.objects.aggregate(total=Sum('size'))['total'] or 0
+        rows = 0
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, FileField) or not getattr(field.storage, 'reference_counted', False):
+                    continue
+                rows += self.dedupe_field(model, field, options['batch_size'])
+                self.stdout.write(f'Processed {model._meta.label}.{field.name}...')
+
+        # Every row now points at a blob, so the old copies are unreferenced
+        freed = 0
+        for (storage, name), blob in self.blobs.items():
+            if blob:
+                freed += storage.size(name)
+                storage.delete_untracked(name)
+        stored_after = MediaBlob.objects.aggregate(total=Sum('size'))['total'] or 0
+        freed -= stored_after - stored_before
+
+        if self.missing:
+            self.stdout.write(self.style.WARNING(f'Skipped {self.missing} references to missing files.'))
+        moved = [blob for blob in self.blobs.values() if blob]
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully moved {len(moved)} files referenced by {rows} rows '
+            f'into {len(set(moved))} blobs, freeing {freed} bytes.'
+        ))
+
+    def dedupe_field(self, model, field, batch_size):
+        variants_field = getattr(field, 'variants_field', None) if isinstance(field, ResponsiveImageField) else None
+        columns = ['pk', field.name] + ([variants_field] if variants_field else [])
+        rows = 0
+        last_pk = None
+        while True:
+            # Walk the primary key so rows that were already moved don't shift the batches
+            batch = model._default_manager.exclude(Q(**{field.name: ''}) | Q(**{f'{field.name}__isnull': True}))
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch.order_by('pk').values(*columns)[:batch_size])
+            if not batch:
+                return rows
+            for row in batch:
+                changes = {}
+                name = self.move(field.storage, row[field.name])
+                if name != row[field.name]:
+                    changes[field.name] = name
+                variants = row.get(variants_field) if variants_field else None
+                if variants and variants.get('source') == row[field.name]:
+                    moved = self.move_variants(field.storage, variants, name)
+                    if moved != variants:
+                        changes[variants_field] = moved
+                if changes:
+                    model._default_manager.filter(pk=row['pk']).update(**changes)
+                    rows += 1
+            last_pk = batch[-1]['pk']
+
+    def move(self, storage, name):
+        """Blob name for a file, saving it on first sight and adding a reference after that"""
+        if is_blob(name):
+            return name
+        key = (storage, name)
+        if key not in self.blobs:
+            if not storage.exists(name):
+                self.missing += 1
+                self.blobs[key] = None
+                return name
+            with storage.open(name, 'rb') as f:
+                self.blobs[key] = storage.save(name, f)
+        elif self.blobs[key] is None:
+            self.missing += 1
+            return name
+        else:
+            storage.retain(self.blobs[key])
+        return self.blobs[key]
+
+    def move_variants(self, storage, variants, source):
+        # Sizes can share a copy, which holds a single reference
+        names = {name: self.move(storage, name) for name in variant_names(variants)}
+        moved = {**variants, 'source': source, 'sizes': {}}
+        for size, entry in variants.get('sizes', {}).items():
+            moved['sizes'][size] = {key: names.get(value, value) if key in FORMATS else value
+                                    for key, value in entry.items()}
+        return moved
@@ -0,0 +1,39 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from projects.images import PROCESSING, ResponsiveImageField, wait_for_image_processing
+
+class Command(BaseCommand):
+    help = 'Generate resized WebP/JPEG derivatives for every uploaded image that lacks them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Regenerate derivatives even when they are up to date'
+        )
+
+    def handle(self, *args, **options):
+        generated = 0
+        for model in apps.get_models():
+            for field in model._meta.get_fields():
+                if not isinstance(field, ResponsiveImageField) or not field.variants_field:
+                    continue
+                images = (
+                    model._default_manager.exclude(Q(**{field.name: ''}) | Q(**{f'{field.name}__isnull': True}))
+                    .only('pk', field.name, field.variants_field)
+                    .order_by('pk')
+                )
+                for instance in images.iterator(chunk_size=500):
+                    stored = getattr(instance, field.variants_field) or {}
+                    # Records left 'processing' belong to a worker that stopped before finishing
+                    stuck = stored.get('status') == PROCESSING
+                    if options['force'] or stuck or not field.variants_are_current(instance):
+                        field.update_variants(instance, force=True)
+                        generated += 1
+                self.stdout.write(f'Processed {model._meta.label}.{field.name}...')
+        # With background processing enabled the images are still in the worker pool
+        wait_for_image_processing()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully generated derivatives for {generated} images.')
+        )
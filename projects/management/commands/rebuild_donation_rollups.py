@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from projects.models import DonationDay, Project
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily donation rollup of every project from its donations'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of projects rebuilt per transaction (default: 500)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        projects = 0
+        days = 0
+        last_id = 0
+        while True:
+            # Walk the primary key so each batch aggregates a bounded slice of donations
+            ids = list(
+                Project.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                days += DonationDay.objects.rebuild(ids)
+            projects += len(ids)
+            last_id = ids[-1]
+            self.stdout.write(f'Rebuilt {days} daily rows for {projects} projects...')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully rebuilt {days} daily rows for {projects} projects.')
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from projects.models import Project
+from projects.search import get_search_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the project full-text search index from scratch'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Rebuilding search index with {type(backend).__name__}...')
+        backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Search index rebuilt for {Project.objects.count()} projects.')
+        )
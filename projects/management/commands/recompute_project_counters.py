@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from projects.models import Project
+
+class Command(BaseCommand):
+    help = 'Rebuild the stored donation and rating counters on every project'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of projects updated per statement (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+        while True:
+            # Walk the primary key so each batch is a short, indexed UPDATE
+            ids = list(
+                Project.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with transaction.atomic():
+                updated += Project.objects.filter(id__gte=ids[0], id__lte=ids[-1]).recompute_counters()
+            last_id = ids[-1]
+            self.stdout.write(f'Recomputed counters for {updated} projects...')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Successfully recomputed counters for {updated} projects.')
+        )
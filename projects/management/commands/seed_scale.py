@@ -0,0 +1,461 @@
+"""
+Production-sized data for local profiling.
+
+Rows are inserted with bulk_create in batches of --batch-size, one
+transaction per batch. Users, projects and comments get their ids here
+rather than from the database, so later rows can point at them (and comment
+paths can be written up front) without reading anything back, and the same
+--seed produces the same rows, dated relative to today.
+
+bulk_create sends no signals, so what they keep up to date is rebuilt once
+at the end instead of once per row: project counters, daily donation
+rollups, the search index, similar projects and the home rails.
+"""
+import io
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from PIL import Image, ImageDraw
+from projects.images import SIZES, store_variants, variant_names
+from projects.imaging import process_image
+from projects.models import (
+    Category, Comment, CommentReport, Donation, DonationDay, MediaBlob, Project, ProjectImage,
+    ProjectRating, ProjectReport, ProjectTag, Tag,
+)
+from projects.rails import RAILS, invalidate_rails
+from projects.search import get_search_backend
+from projects.similarity import SimilarityEngine
+
+ADJECTIVES = [
+    'open', 'solar', 'urban', 'little', 'green', 'smart', 'local', 'wild', 'bright', 'quiet',
+    'mobile', 'tiny', 'shared', 'modern', 'simple', 'bold', 'clean', 'digital', 'handmade', 'young',
+    'ocean', 'mountain', 'rural', 'kind', 'healthy', 'creative', 'global', 'safe', 'free', 'better',
+]
+NOUNS = [
+    'garden', 'library', 'studio', 'school', 'kitchen', 'clinic', 'bakery', 'theatre', 'workshop', 'farm',
+    'festival', 'album', 'film', 'game', 'book', 'museum', 'park', 'bike', 'robot', 'app',
+    'radio', 'market', 'shelter', 'well', 'bridge', 'choir', 'camp', 'lab', 'press', 'cafe',
+    'orchestra', 'telescope', 'boat', 'map', 'podcast', 'gallery', 'court', 'playground', 'makerspace', 'van',
+]
+WORDS = ADJECTIVES + NOUNS + [
+    'the', 'a', 'for', 'with', 'our', 'and', 'to', 'of', 'in', 'we', 'will', 'build', 'help', 'support',
+    'community', 'people', 'every', 'new', 'your', 'project', 'children', 'city', 'neighbourhood', 'together',
+]
+FIRST_NAMES = ['Ahmed', 'Sara', 'Omar', 'Mona', 'Youssef', 'Nour', 'Karim', 'Laila', 'Hassan', 'Mariam', 'Ali', 'Hana']
+LAST_NAMES = ['Hassan', 'Ibrahim', 'Mahmoud', 'Saleh', 'Farouk', 'Nasser', 'Kamal', 'Fathy', 'Adel', 'Samir']
+COUNTRIES = ['Egypt', 'Egypt', 'Egypt', 'Saudi Arabia', 'UAE', 'Jordan', 'Morocco', 'Tunisia', 'Germany', 'USA']
+# Default categories when the database has none; see setup_categories
+CATEGORIES = ['Technology', 'Art & Design', 'Music', 'Education', 'Environment', 'Community', 'Health & Fitness']
+
+# Common donation amounts, most frequent first
+AMOUNTS = [Decimal(amount) for amount in ('10', '20', '50', '25', '100', '5', '15', '200', '30', '250', '500', '1000')]
+AMOUNT_WEIGHTS = list(accumulate([25, 20, 15, 12, 10, 6, 4, 3, 2, 1.5, 1, 0.5]))
+RATING_WEIGHTS = list(accumulate([5, 7, 18, 35, 35]))
+TARGETS = [Decimal(target) for target in ('1000', '5000', '10000', '25000', '50000', '100000')]
+
+# Share of comments that reply to an earlier one, and how deep threads get
+REPLY_SHARE = 0.4
+MAX_DEPTH = 5
+# Distinct pictures the project images are drawn from
+PICTURES = 8
+
+# Models whose auto_now_add timestamps are set here instead
+TIMESTAMPS = [
+    (ProjectImage, 'created_at'), (Comment, 'timestamp'), (Donation, 'timestamp'),
+    (ProjectRating, 'timestamp'), (ProjectReport, 'timestamp'), (CommentReport, 'timestamp'),
+]
+
+DAY = 86400
+
+
+@contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the timestamps given instead of stamping every row with now()"""
+    fields = [model._meta.get_field(name) for model, name in TIMESTAMPS]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def skewed_weights(rng, count):
+    """Cumulative weights for rng.choices where a few items get most of the picks"""
+    return list(accumulate(rng.paretovariate(1.2) for _ in range(count)))
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate users, projects with tags and images, donations, comment threads, ratings and '
+        'reports at a configurable scale for profiling; the same --seed gives the same data'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Users to create (default: 10000)')
+        parser.add_argument('--projects', type=int, default=10000, help='Projects to create (default: 10000)')
+        parser.add_argument('--donations', type=int, default=500000, help='Donations to create (default: 500000)')
+        parser.add_argument(
+            '--comments', type=int, default=100000,
+            help=f'Comments to create, {REPLY_SHARE:.0%} of them replies (default: 100000)'
+        )
+        parser.add_argument('--ratings', type=int, default=100000, help='Ratings to create (default: 100000)')
+        parser.add_argument(
+            '--reports', type=int, default=2000,
+            help='Reports to create, half on projects and half on comments (default: 2000)'
+        )
+        parser.add_argument('--tags', type=int, default=300, help='Distinct tags to use (default: 300)')
+        parser.add_argument(
+            '--images', type=int, default=3,
+            help=f'Most images per project, drawn from {PICTURES} generated pictures (default: 3)'
+        )
+        parser.add_argument('--days', type=int, default=730, help='Days of history to spread the data over (default: 730)')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument(
+            '--password', default='password',
+            help='Password of every generated user (default: "password")'
+        )
+        parser.add_argument('--skip-similar', action='store_true', help="Don't rebuild the similar projects")
+        parser.add_argument(
+            '--batch-size', type=int, default=10000,
+            help='Number of rows inserted per transaction (default: 10000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['projects'] < 1:
+            raise CommandError('At least one user and one project are needed.')
+        if options['ratings'] > options['users'] * options['projects']:
+            raise CommandError('Each user can only rate a project once; lower --ratings.')
+        self.batch_size = options['batch_size']
+        self.rng = random.Random(options['seed'])
+        self.prefix = f'seed{options["seed"]}_'
+        User = get_user_model()
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(f'Data for --seed {options["seed"]} already exists; pick another seed.')
+        # Midnight, so a run today and a run tomorrow date the same rows alike
+        self.now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        started = time.monotonic()
+
+        with explicit_timestamps():
+            user_ids = self.create_users(User, options['users'], options['days'], options['password'])
+            project_ids = self.create_projects(user_ids, options['projects'], options['days'])
+            self.create_tags(project_ids, options['tags'])
+            if options['images']:
+                self.create_images(project_ids, options['images'])
+            self.create_donations(user_ids, project_ids, options['donations'])
+            comment_ids = self.create_comments(user_ids, project_ids, options['comments'])
+            self.create_ratings(user_ids, project_ids, options['ratings'])
+            self.create_reports(user_ids, project_ids, comment_ids, options['reports'])
+        self.reset_sequences([User, Project, Comment])
+        self.rebuild(project_ids, options['skip_similar'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully seeded {len(user_ids)} users and {len(project_ids)} projects '
+            f'in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def insert(self, model, rows):
+        """bulk_create the rows of a generator in batches; returns how many there were"""
+        label = model._meta.verbose_name_plural
+        rows = iter(rows)
+        total = 0
+        while batch := list(islice(rows, self.batch_size)):
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            total += len(batch)
+            self.stdout.write(f'Inserted {total} {label}...')
+        return total
+
+    def ago(self, seconds):
+        return self.now - timedelta(seconds=seconds)
+
+    def text(self, low, high):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high))).capitalize() + '.'
+
+    def create_users(self, User, count, days, password):
+        rng = self.rng
+        first_id = next_id(User)
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(password)
+
+        def rows():
+            for i in range(count):
+                first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+                username = f'{self.prefix}{i}'
+                yield User(
+                    id=first_id + i,
+                    username=username,
+                    email=f'{username}@example.com',
+                    first_name=first,
+                    last_name=last,
+                    password=password,
+                    is_active=True,
+                    date_joined=self.ago(rng.uniform(0, days * DAY)),
+                    gender=rng.choice(('Male', 'Female')),
+                    country=rng.choice(COUNTRIES),
+                )
+        self.insert(User, rows())
+        # Donors and commenters: a few very active users, many occasional ones
+        self.user_weights = skewed_weights(rng, count)
+        return range(first_id, first_id + count)
+
+    def create_projects(self, user_ids, count, days):
+        rng = self.rng
+        categories = list(Category.objects.order_by('id').values_list('id', flat=True))
+        if not categories:
+            Category.objects.bulk_create(Category(name=name) for name in CATEGORIES)
+            categories = list(Category.objects.order_by('id').values_list('id', flat=True))
+        first_id = next_id(Project)
+        # Seconds before self.now each project started and ended (negative once it ends in the future)
+        self.starts, self.ends = [], []
+
+        def rows():
+            for i in range(count):
+                start = rng.uniform(0, days * DAY)
+                end = start - rng.uniform(30, 120) * DAY
+                self.starts.append(start)
+                self.ends.append(max(end, 0))
+                if end > 0:
+                    status = 'completed'
+                else:
+                    status = 'cancelled' if rng.random() < 0.05 else 'active'
+                yield Project(
+                    id=first_id + i,
+                    owner_id=rng.choice(user_ids),
+                    title=f'{rng.choice(ADJECTIVES).capitalize()} {rng.choice(NOUNS)} {rng.choice(NOUNS)}',
+                    details='\n\n'.join(self.text(20, 80) for _ in range(rng.randint(1, 4))),
+                    category_id=rng.choice(categories),
+                    total_target=rng.choice(TARGETS),
+                    start_time=self.ago(start),
+                    end_time=self.ago(end),
+                    status=status,
+                    featured=rng.random() < 0.005,
+                )
+        self.insert(Project, rows())
+        # Popularity: most donations, comments and ratings go to a few projects
+        self.project_weights = skewed_weights(rng, count)
+        return range(first_id, first_id + count)
+
+    def create_tags(self, project_ids, count):
+        rng = self.rng
+        combinations = [f'{adjective}-{noun}' for adjective in ADJECTIVES for noun in NOUNS]
+        rng.shuffle(combinations)
+        names = [
+            combinations[i % len(combinations)] + (f'-{i // len(combinations)}' if i >= len(combinations) else '')
+            for i in range(count)
+        ]
+        tag_ids = [tag.id for tag in Tag.objects.for_names(names)]
+        # A long tail: the first tags are used far more than the last
+        weights = list(accumulate(1 / (rank + 1) for rank in range(len(tag_ids))))
+
+        def rows():
+            for project_id in project_ids:
+                picked = set(rng.choices(tag_ids, cum_weights=weights, k=rng.randint(0, 5)))
+                for tag_id in sorted(picked):
+                    yield ProjectTag(project_id=project_id, tag_id=tag_id)
+        self.insert(ProjectTag, rows())
+
+    def create_images(self, project_ids, most):
+        rng = self.rng
+        pictures = [self.create_picture(i) for i in range(PICTURES)]
+        used = Counter()
+
+        def rows():
+            for index, project_id in enumerate(project_ids):
+                for position in range(rng.randint(0, most)):
+                    picture = rng.randrange(PICTURES)
+                    used[picture] += 1
+                    yield ProjectImage(
+                        project_id=project_id,
+                        image=pictures[picture]['source'],
+                        image_variants=pictures[picture],
+                        caption=self.text(3, 8) if rng.random() < 0.3 else '',
+                        is_primary=position == 0,
+                        position=position,
+                        created_at=self.ago(self.starts[index]),
+                    )
+        self.insert(ProjectImage, rows())
+        # Saving a picture took one reference to each of its files; every row needs one
+        for picture, variants in enumerate(pictures):
+            names = {variants['source'], *variant_names(variants)}
+            if used[picture]:
+                MediaBlob.objects.filter(name__in=names).update(references=F('references') + used[picture] - 1)
+            else:
+                for name in names:
+                    default_storage.delete(name)
+
+    def create_picture(self, number):
+        """Draw, store and derive one picture; returns its image_variants"""
+        rng = self.rng
+        image = Image.new('RGB', (1200, 800), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(12):
+            x, y = rng.randrange(1200), rng.randrange(800)
+            radius = rng.randrange(40, 300)
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', quality=85)
+        data = buffer.getvalue()
+        name = default_storage.save(f'project_images/seed-{number}.jpg', ContentFile(data))
+        variants = store_variants(default_storage, name, process_image(data, SIZES))
+        if variants['source'] != name:
+            default_storage.delete(name)
+        return variants
+
+    def create_donations(self, user_ids, project_ids, count):
+        rng = self.rng
+        first_user, first_project = user_ids[0], project_ids[0]
+        projects = range(len(project_ids))
+        users = range(len(user_ids))
+
+        def rows():
+            remaining = count
+            while remaining:
+                size = min(remaining, self.batch_size)
+                remaining -= size
+                picked_projects = rng.choices(projects, cum_weights=self.project_weights, k=size)
+                picked_users = rng.choices(users, cum_weights=self.user_weights, k=size)
+                amounts = rng.choices(AMOUNTS, cum_weights=AMOUNT_WEIGHTS, k=size)
+                for project, user, amount in zip(picked_projects, picked_users, amounts):
+                    yield Donation(
+                        user_id=first_user + user,
+                        project_id=first_project + project,
+                        amount=amount,
+                        timestamp=self.ago(rng.uniform(self.ends[project], self.starts[project])),
+                    )
+        self.insert(Donation, rows())
+
+    def create_comments(self, user_ids, project_ids, count):
+        rng = self.rng
+        first_id = next_id(Comment)
+        # Per comment made so far, by id - first_id
+        paths, projects, ages = [], [], []
+
+        def rows():
+            for i in range(count):
+                comment_id = first_id + i
+                parent_id = None
+                if paths and rng.random() < REPLY_SHARE:
+                    parent = rng.randrange(len(paths))
+                    if len(paths[parent]) // Comment.PATH_STEP >= MAX_DEPTH:
+                        # Deep enough; answer the thread's first comment instead
+                        parent = int(paths[parent][:Comment.PATH_STEP - 1]) - first_id
+                    parent_id = first_id + parent
+                    project = projects[parent]
+                    path = f'{paths[parent]}{comment_id:010d}/'
+                    age = max(ages[parent] - rng.uniform(0, 7 * DAY), 0)
+                else:
+                    project = rng.choices(range(len(project_ids)), cum_weights=self.project_weights)[0]
+                    path = f'{comment_id:010d}/'
+                    age = rng.uniform(0, self.starts[project])
+                paths.append(path)
+                projects.append(project)
+                ages.append(age)
+                yield Comment(
+                    id=comment_id,
+                    project_id=project_ids[project],
+                    user_id=rng.choices(user_ids, cum_weights=self.user_weights)[0],
+                    content=self.text(5, 60),
+                    parent_id=parent_id,
+                    path=path,
+                    timestamp=self.ago(age),
+                )
+        self.insert(Comment, rows())
+        return range(first_id, first_id + count)
+
+    def create_ratings(self, user_ids, project_ids, count):
+        rng = self.rng
+        per_project = Counter(rng.choices(range(len(project_ids)), cum_weights=self.project_weights, k=count))
+        # Popular projects may have drawn more ratings than there are users; hand the rest out in order
+        spare = 0
+        for project in range(len(project_ids)):
+            spare += max(per_project[project] - len(user_ids), 0)
+            per_project[project] = min(per_project[project], len(user_ids))
+        for project in range(len(project_ids)):
+            if not spare:
+                break
+            extra = min(len(user_ids) - per_project[project], spare)
+            per_project[project] += extra
+            spare -= extra
+
+        def rows():
+            for project in range(len(project_ids)):
+                for user_id in rng.sample(user_ids, per_project[project]):
+                    yield ProjectRating(
+                        user_id=user_id,
+                        project_id=project_ids[project],
+                        rating=rng.choices(range(1, 6), cum_weights=RATING_WEIGHTS)[0],
+                        comment=self.text(5, 30) if rng.random() < 0.2 else '',
+                        timestamp=self.ago(rng.uniform(0, self.starts[project])),
+                    )
+        self.insert(ProjectRating, rows())
+
+    def create_reports(self, user_ids, project_ids, comment_ids, count):
+        rng = self.rng
+        project_reasons = [reason for reason, _ in ProjectReport.REPORT_REASONS]
+        comment_reasons = [reason for reason, _ in CommentReport.REPORT_REASONS]
+
+        def rows(model, targets, field, reasons, wanted):
+            # One report per user and target; give up on duplicates rather than loop forever
+            seen = set()
+            for _ in range(wanted * 2):
+                if len(seen) == wanted:
+                    break
+                pair = (rng.choice(user_ids), rng.choice(targets))
+                if pair in seen:
+                    continue
+                seen.add(pair)
+                yield model(**{
+                    'user_id': pair[0],
+                    field: pair[1],
+                    'reason': rng.choice(reasons),
+                    'description': self.text(5, 40),
+                    'is_resolved': rng.random() < 0.3,
+                    'timestamp': self.ago(rng.uniform(0, 30 * DAY)),
+                })
+        self.insert(ProjectReport, rows(ProjectReport, project_ids, 'project_id', project_reasons, count - count // 2))
+        if comment_ids:
+            self.insert(CommentReport, rows(CommentReport, comment_ids, 'comment_id', comment_reasons, count // 2))
+
+    def reset_sequences(self, models):
+        # Ids were given explicitly, which databases with sequences don't notice
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
+
+    def rebuild(self, project_ids, skip_similar):
+        first, last = project_ids[0], project_ids[-1]
+        for start in range(first, last + 1, self.batch_size):
+            end = min(start + self.batch_size - 1, last)
+            batch = Project.objects.filter(id__gte=start, id__lte=end)
+            with transaction.atomic():
+                batch.recompute_counters()
+                DonationDay.objects.rebuild(batch.values('id'))
+            self.stdout.write(f'Rebuilt counters and donation rollups for {end - first + 1} projects...')
+        self.stdout.write('Rebuilding search index...')
+        get_search_backend().rebuild()
+        if not skip_similar:
+            self.stdout.write('Rebuilding similar projects...')
+            SimilarityEngine().rebuild()
+        invalidate_rails(*RAILS)
@@ -0,0 +1,269 @@
+"""
+Request metrics.
+
+``MetricsMiddleware`` times every request and records, per view (the URL
+name, e.g. ``project_detail``) and method:
+
+- ``http_request_duration_seconds``: time to build the response
+- ``http_request_db_seconds``: time spent in SQL (``projects.querystats``)
+- ``http_request_template_seconds``: time spent rendering templates, measured
+  by the ``DjangoTemplates`` backend below
+- ``http_response_size_bytes``: size of the response body
+- ``http_requests_total`` (also by status) and ``db_queries_total``
+
+``metrics_view`` serves them in the Prometheus text format to callers
+presenting ``METRICS['TOKEN']`` or coming from ``METRICS['ALLOWED_IPS']``.
+Both are unset by default, so the endpoint answers nobody until configured.
+Behind a reverse proxy on the same host every request comes from 127.0.0.1,
+so allow-listing addresses there needs ``CLIENT_IP_HEADER``: the header the
+proxy puts the client's address in.
+
+Recording takes no lock: each thread adds to its own shard, and a scrape sums
+the shards. The middleware is synchronous, so under ASGI Django runs it in the
+same thread as the (synchronous) views and database queries it measures,
+exactly as under WSGI. Each server process keeps its own numbers.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.template.backends import django as django_backend
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_safe
+
+from .querystats import log_queries
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Addresses that may read the metrics without a token
+    'ALLOWED_IPS': [],
+    # META key of the header a trusted proxy sets to the client address, e.g.
+    # 'HTTP_X_REAL_IP'; when None, REMOTE_ADDR is the client address
+    'CLIENT_IP_HEADER': None,
+    # Sent by scrapers as "Authorization: Bearer <token>"; None disables it
+    'TOKEN': None,
+}
+
+# Upper bounds of the histogram buckets
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Time to respond to a request', DURATION_BUCKETS),
+    'http_request_db_seconds': ('Time spent in SQL queries per request', DURATION_BUCKETS),
+    'http_request_template_seconds': ('Time spent rendering templates per request', DURATION_BUCKETS),
+    'http_response_size_bytes': ('Size of response bodies', SIZE_BUCKETS),
+}
+COUNTERS = {
+    'http_requests_total': 'Responses sent',
+    'db_queries_total': 'SQL queries run by requests',
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Requests that matched no URL pattern
+UNMATCHED = 'unmatched'
+
+
+def get_metrics_settings():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class Shard:
+    """One thread's totals; only that thread writes to it"""
+
+    def __init__(self):
+        # (name, labels) -> per-bucket counts followed by the sum and the count
+        self.histograms = {}
+        # (name, labels) -> total
+        self.counters = {}
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        buckets = HISTOGRAMS[name][1]
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            # One more bucket for values beyond the last bound
+            histogram = self.histograms[key] = [0] * (len(buckets) + 3)
+        histogram[bisect_left(buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+    def increment(self, name, labels, amount=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+def get_shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = Shard()
+        # Only taken once per thread
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def collect():
+    """Totals over every thread, as ({(name, labels): histogram}, {(name, labels): total})"""
+    with _shards_lock:
+        shards = list(_shards)
+    histograms, counters = {}, {}
+    for shard in shards:
+        # dict.copy() is atomic, so a thread adding a new key meanwhile is harmless
+        for key, values in shard.histograms.copy().items():
+            merged = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                merged[i] += value
+        for key, total in shard.counters.copy().items():
+            counters[key] = counters.get(key, 0) + total
+    return histograms, counters
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in items) + '}'
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    histograms, counters = collect()
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, values):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {values[-1]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_number(values[-2])}')
+            lines.append(f'{name}_count{format_labels(labels)} {values[-1]}')
+    for name, description in COUNTERS.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+        for (metric, labels), total in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{format_labels(labels)} {format_number(total)}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestTimings:
+    def __init__(self):
+        self.template = 0.0
+
+
+_current = ContextVar('request_timings', default=None)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_metrics_settings()['ENABLED']:
+            return self.get_response(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            with log_queries(detail=False) as queries:
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else UNMATCHED
+        if view == 'metrics':
+            return response
+        labels = (('view', view), ('method', request.method))
+        shard = get_shard()
+        shard.observe('http_request_duration_seconds', labels, duration)
+        shard.observe('http_request_db_seconds', labels, queries.time)
+        shard.observe('http_request_template_seconds', labels, timings.template)
+        size = response_size(response)
+        if size is not None:
+            shard.observe('http_response_size_bytes', labels, size)
+        shard.increment('http_requests_total', labels + (('status', response.status_code),))
+        shard.increment('db_queries_total', labels, queries.count)
+        return response
+
+
+def response_size(response):
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    # Streamed without a length; unknown until it has been sent
+    return None
+
+
+class Template:
+    """A backend template that adds its render time to the current request's"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        timings = _current.get()
+        if timings is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            timings.template += time.perf_counter() - start
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, timed for MetricsMiddleware"""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
+
+
+def client_address(request, config):
+    """The caller's address, as told by the trusted proxy when there is one"""
+    if not config['CLIENT_IP_HEADER']:
+        return request.META.get('REMOTE_ADDR')
+    # X-Forwarded-For lists every hop; the last one is what our proxy saw
+    forwarded = request.META.get(config['CLIENT_IP_HEADER'], '').split(',')[-1].strip()
+    return forwarded or None
+
+
+@require_safe
+def metrics_view(request):
+    """Prometheus scrape endpoint; 404 to anyone not allowed to read it"""
+    config = get_metrics_settings()
+    allowed = client_address(request, config) in config['ALLOWED_IPS']
+    if not allowed and config['TOKEN']:
+        allowed = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {config["TOKEN"]}')
+    if not allowed:
+        raise Http404('Not found')
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+CREATE_INDEX = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS projects_project_fts USING fts5("
+    "title, tags, details, category, owner, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+POPULATE_INDEX = (
+    "INSERT INTO projects_project_fts (rowid, title, tags, details, category, owner) "
+    "SELECT p.id, p.title, p.tags, p.details, COALESCE(c.name, ''), "
+    "COALESCE(u.first_name, '') || ' ' || COALESCE(u.last_name, '') "
+    "FROM projects_project p "
+    "LEFT JOIN projects_category c ON c.id = p.category_id "
+    "INNER JOIN accounts_customuser u ON u.id = p.owner_id"
+)
+
+
+def create_search_index(apps, schema_editor):
+    # The FTS5 index only exists on SQLite; other databases use another backend
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_INDEX)
+    schema_editor.execute(POPULATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS projects_project_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0006_project_featured'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:43
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    Donation = apps.get_model('projects', 'Donation')
+    ProjectRating = apps.get_model('projects', 'ProjectRating')
+    donations = Donation.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    ratings = ProjectRating.objects.filter(project=OuterRef('pk')).order_by().values('project')
+    Project.objects.update(
+        donation_total=Coalesce(Subquery(donations.annotate(total=Sum('amount')).values('total')), Value(Decimal('0'))),
+        donation_count=Coalesce(Subquery(donations.annotate(count=Count('id')).values('count')), Value(0)),
+        rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('rating')).values('total')), Value(0)),
+        rating_count=Coalesce(Subquery(ratings.annotate(count=Count('id')).values('count')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0007_project_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='donation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='donation_total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
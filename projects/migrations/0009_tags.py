@@ -0,0 +1,94 @@
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+REBUILD_SEARCH_INDEX = [
+    "DELETE FROM projects_project_fts",
+    "INSERT INTO projects_project_fts (rowid, title, tags, details, category, owner) "
+    "SELECT p.id, p.title, "
+    "COALESCE((SELECT GROUP_CONCAT(t.name, ' ') FROM projects_projecttag pt "
+    "INNER JOIN projects_tag t ON t.id = pt.tag_id WHERE pt.project_id = p.id), ''), "
+    "p.details, COALESCE(c.name, ''), "
+    "COALESCE(u.first_name, '') || ' ' || COALESCE(u.last_name, '') "
+    "FROM projects_project p "
+    "LEFT JOIN projects_category c ON c.id = p.category_id "
+    "INNER JOIN accounts_customuser u ON u.id = p.owner_id",
+]
+
+
+def split_tag_text(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    Tag = apps.get_model('projects', 'Tag')
+    ProjectTag = apps.get_model('projects', 'ProjectTag')
+    tag_ids = {}
+    links = []
+    for project_id, text in Project.objects.exclude(tag_text='').values_list('id', 'tag_text').iterator():
+        names = (name.strip('#').lower()[:50] for name in re.split(r'[\s,]+', text or ''))
+        for name in dict.fromkeys(name for name in names if name):
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.get_or_create(name=name)[0].id
+            links.append(ProjectTag(project_id=project_id, tag_id=tag_ids[name]))
+    ProjectTag.objects.bulk_create(links, batch_size=1000)
+
+
+def join_tag_text(apps, schema_editor):
+    Project = apps.get_model('projects', 'Project')
+    for project in Project.objects.prefetch_related('tags'):
+        project.tag_text = ' '.join(tag.name for tag in project.tags.all())[:200]
+        project.save(update_fields=['tag_text'])
+
+
+def rebuild_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in REBUILD_SEARCH_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0008_project_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RenameField(
+            model_name='project',
+            old_name='tags',
+            new_name='tag_text',
+        ),
+        migrations.CreateModel(
+            name='ProjectTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='projects.project')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='projects.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'project'], name='projects_pr_tag_id_1bc022_idx')],
+                'unique_together': {('project', 'tag')},
+            },
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='projects', through='projects.ProjectTag', to='projects.tag'),
+        ),
+        migrations.RunPython(split_tag_text, join_tag_text),
+        migrations.RemoveField(
+            model_name='project',
+            name='tag_text',
+        ),
+        migrations.RunPython(rebuild_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0009_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarProject',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_rows', to='projects.project')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbour_of', to='projects.project')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['project', '-score'], name='projects_si_project_7ebd14_idx')],
+                'unique_together': {('project', 'similar')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0011_comment_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donation',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='donation',
+            constraint=models.UniqueConstraint(fields=('user', 'idempotency_key'), name='unique_donation_idempotency_key'),
+        ),
+    ]
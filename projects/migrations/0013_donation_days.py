@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_donation_days(apps, schema_editor):
+    Donation = apps.get_model('projects', 'Donation')
+    DonationDay = apps.get_model('projects', 'DonationDay')
+    days = (
+        Donation.objects.annotate(day=TruncDate('timestamp'))
+        .values('project_id', 'day')
+        .annotate(total=Sum('amount'), count=Count('id'), donor_count=Count('user', distinct=True))
+        .order_by()
+    )
+    DonationDay.objects.bulk_create((DonationDay(**row) for row in days.iterator()), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0012_donation_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DonationDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('donor_count', models.PositiveIntegerField(default=0)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='donation_days', to='projects.project')),
+            ],
+            options={
+                'ordering': ['day'],
+                'unique_together': {('project', 'day')},
+            },
+        ),
+        migrations.RunPython(backfill_donation_days, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:15
+
+import projects.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0013_donation_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='projectimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='image',
+            field=projects.images.ResponsiveImageField(blank=True, null=True, upload_to='project_images/', variants_field='image_variants'),
+        ),
+        migrations.AlterField(
+            model_name='projectimage',
+            name='image',
+            field=projects.images.ResponsiveImageField(upload_to='project_images/', variants_field='image_variants'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0015_media_blobs'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='projectimage',
+            options={'ordering': ['-is_primary', 'position', 'created_at']},
+        ),
+        migrations.AddField(
+            model_name='projectimage',
+            name='position',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
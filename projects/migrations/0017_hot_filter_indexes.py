@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0016_projectimage_position'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('parent__isnull', True)), fields=['project', '-timestamp', 'id'], name='comment_top_level_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent', 'timestamp', 'id'], name='projects_co_parent__b19dda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='donation',
+            index=models.Index(fields=['user', '-timestamp', 'id'], name='projects_do_user_id_83eb73_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['-start_time', 'id'], name='projects_pr_start_t_e55334_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['category', '-start_time', 'id'], name='projects_pr_categor_85282f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', '-start_time', 'id'], name='projects_pr_owner_i_f3d6db_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['status', '-start_time', '-id'], name='projects_pr_status_08aff0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='projectimage',
+            index=models.Index(fields=['project', '-is_primary', 'position', 'created_at'], name='projects_pr_project_d5bfca_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:22
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0017_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='projects_co_project_f28148_idx',
+        ),
+        migrations.RemoveField(
+            model_name='comment',
+            name='path',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0018_remove_comment_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(condition=models.Q(('featured', True)), fields=['status', '-start_time', '-id'], name='project_featured_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['category', 'status', '-start_time', '-id'], name='projects_pr_categor_df5125_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Comment = apps.get_model('projects', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def path_of(comment_id):
+        if comment_id not in paths:
+            parent_id = parents[comment_id]
+            prefix = path_of(parent_id) if parent_id else ''
+            paths[comment_id] = f'{prefix}{comment_id:010d}/'
+        return paths[comment_id]
+
+    comments = [Comment(id=comment_id, path=path_of(comment_id)) for comment_id in parents]
+    Comment.objects.bulk_update(comments, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0019_featured_category_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['project', 'path'], name='projects_co_project_f28148_idx'),
+        ),
+    ]
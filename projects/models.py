@@ -1,5 +1,14 @@
-from django.db import models
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, Max, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, Substr, TruncDate
 from django.conf import settings
+from django.utils import timezone
+
+from .images import ResponsiveImageField
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
@@ -8,17 +17,82 @@ class Category(models.Model):
         return self.name
 
 
+class TagQuerySet(models.QuerySet):
+    def for_names(self, names):
+        """Return Tag rows for ``names``, creating any that don't exist yet"""
+        names = list(dict.fromkeys(names))
+        existing = {tag.name: tag for tag in self.filter(name__in=names)}
+        missing = [Tag(name=name) for name in names if name not in existing]
+        if missing:
+            self.bulk_create(missing, ignore_conflicts=True)
+            existing = {tag.name: tag for tag in self.filter(name__in=names)}
+        return [existing[name] for name in names]
+    
+    def facets(self, projects, limit=20):
+        """Most used tags among ``projects``, annotated with ``project_count``"""
+        return self.filter(
+            projecttag__project__in=projects.order_by().values('pk')
+        ).annotate(project_count=Count('projecttag')).order_by('-project_count', 'name')[:limit]
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    objects = TagQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+    
+    @staticmethod
+    def parse(text):
+        """Split free text like "#art, design" into normalized tag names"""
+        names = (name.strip('#').lower()[:50] for name in re.split(r'[\s,]+', text or ''))
+        return list(dict.fromkeys(name for name in names if name))
+
+
+class ProjectQuerySet(models.QuerySet):
+    def with_card_stats(self):
+        """Annotate everything a project card shows so listings don't query per card"""
+        # Funding and rating figures come from the stored counters on Project
+        images = ProjectImage.objects.filter(project=OuterRef('pk')).order_by(*ProjectImage._meta.ordering)
+        return self.select_related('owner', 'category').prefetch_related('tags').annotate(
+            card_main_image=Subquery(images.values('image')[:1]),
+            card_main_image_variants=Subquery(images.values('image_variants')[:1], output_field=models.JSONField()),
+        )
+    
+    def top_rated(self):
+        """Rated projects annotated with ``avg_rating``, best first"""
+        return self.filter(rating_count__gt=0).annotate(
+            avg_rating=ExpressionWrapper(F('rating_sum') * 1.0 / F('rating_count'), output_field=FloatField())
+        ).order_by('-avg_rating')
+    
+    def recompute_counters(self):
+        """Rebuild the stored funding and rating counters from the source rows"""
+        donations = Donation.objects.filter(project=OuterRef('pk')).order_by().values('project')
+        ratings = ProjectRating.objects.filter(project=OuterRef('pk')).order_by().values('project')
+        return self.update(
+            donation_total=Coalesce(Subquery(donations.annotate(total=Sum('amount')).values('total')), Value(Decimal('0'))),
+            donation_count=Coalesce(Subquery(donations.annotate(count=Count('id')).values('count')), Value(0)),
+            rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('rating')).values('total')), Value(0)),
+            rating_count=Coalesce(Subquery(ratings.annotate(count=Count('id')).values('count')), Value(0)),
+        )
+
+
 class Project(models.Model):
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     details = models.TextField()
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     total_target = models.DecimalField(max_digits=10, decimal_places=2)
-    tags = models.CharField(max_length=200, blank=True)
+    tags = models.ManyToManyField(Tag, through='ProjectTag', blank=True, related_name='projects')
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     # Keep the main image field for backward compatibility
-    image = models.ImageField(upload_to='project_images/', blank=True, null=True)
+    image = ResponsiveImageField(upload_to='project_images/', blank=True, null=True, variants_field='image_variants')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     
     STATUS_CHOICES = [
         ('active', 'Active'),
@@ -28,13 +102,70 @@ class Project(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     featured = models.BooleanField(default=False, help_text="Mark this project as featured to display it on the home page")
 
+    # Denormalized counters, maintained by projects.signals on every
+    # Donation/ProjectRating write and rebuilt by recompute_project_counters
+    donation_total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    donation_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+
+    COUNTER_FIELDS = ('donation_total', 'donation_count', 'rating_sum', 'rating_count')
+
+    objects = ProjectQuerySet.as_manager()
+
+    class Meta:
+        # Each matches a listing's filter and keyset ordering, so a page is
+        # read in index order instead of sorting every match; see
+        # QueryPlanTestCase
+        indexes = [
+            # all_projects
+            models.Index(fields=['-start_time', 'id']),
+            models.Index(fields=['category', '-start_time', 'id']),
+            # my_projects and profile
+            models.Index(fields=['owner', '-start_time', 'id']),
+            # Home rails, which list active projects newest first
+            models.Index(fields=['status', '-start_time', '-id']),
+            # The featured rail. Partial, as few projects are featured: a full
+            # (featured, status, ...) index would look no more selective than
+            # status alone to the planner, which would never pick it
+            models.Index(
+                fields=['status', '-start_time', '-id'],
+                condition=models.Q(featured=True),
+                name='project_featured_idx',
+            ),
+            # Similar projects filled in from the same category
+            models.Index(fields=['category', 'status', '-start_time', '-id']),
+        ]
+
     def __str__(self):
         return self.title
     
+    def save(self, *args, **kwargs):
+        # Counters only change through F() updates, so never write back stale copies
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+    
+    def set_tags(self, names):
+        """Replace this project's tags with the given tag names"""
+        self.tags.set(Tag.objects.for_names(names))
+    
     def get_main_image(self):
         """Get the main image (first image or the old image field)"""
         if self.image:
             return self.image
+        if hasattr(self, 'card_main_image'):
+            # Annotated by ProjectQuerySet.with_card_stats()
+            if not self.card_main_image:
+                return None
+            return ProjectImage(
+                project_id=self.pk,
+                image=self.card_main_image,
+                image_variants=getattr(self, 'card_main_image_variants', None) or {},
+            ).image
         first_image = self.projectimage_set.first()
         return first_image.image if first_image else None
     
@@ -48,14 +179,13 @@ class Project(models.Model):
     
     def get_average_rating(self):
         """Calculate the average rating for this project"""
-        ratings = self.projectrating_set.all()
-        if ratings.exists():
-            return sum(rating.rating for rating in ratings) / ratings.count()
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0
     
     def get_rating_count(self):
         """Get the total number of ratings for this project"""
-        return self.projectrating_set.count()
+        return self.rating_count
     
     def get_user_rating(self, user):
         """Get the rating given by a specific user"""
@@ -64,13 +194,46 @@ class Project(models.Model):
         except ProjectRating.DoesNotExist:
             return None
     
+    def get_total_donations(self):
+        """Get the total amount donated to this project"""
+        return self.donation_total
+    
+    def get_donation_count(self):
+        """Get the number of donations made to this project"""
+        return self.donation_count
+    
     def get_donation_percentage(self):
         """Calculate the percentage of target amount raised"""
-        total_donations = sum(donation.amount for donation in self.donation_set.all())
+        total_donations = self.get_total_donations()
         if self.total_target > 0:
             return (total_donations / self.total_target) * 100
         return 0
     
+    def get_donation_series(self, days=30):
+        """
+        Donations per day for the last ``days`` days, oldest first, with days
+        without donations filled in and a running ``cumulative`` total.
+        Reads the daily rollup, so the cost grows with days, not donations.
+        """
+        end = timezone.localdate()
+        start = end - timedelta(days=days - 1)
+        rows = {row.day: row for row in self.donation_days.filter(day__range=(start, end))}
+        cumulative = self.donation_days.filter(day__lt=start).aggregate(total=Sum('total'))['total'] or Decimal('0')
+        series = []
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            row = rows.get(day)
+            total = row.total if row else Decimal('0')
+            cumulative += total
+            series.append({
+                'date': day,
+                'total': total,
+                'count': row.count if row else 0,
+                'donors': row.donor_count if row else 0,
+                'cumulative': cumulative,
+            })
+        return series
+    
     def can_be_cancelled(self):
         """Check if project can be cancelled (less than 25% raised)"""
         return self.status == 'active' and self.get_donation_percentage() < 25
@@ -80,65 +243,107 @@ class Project(models.Model):
         return self.status == 'cancelled'
     
     def get_similar_projects(self, limit=4):
-        """Get similar projects based on tags and category"""
-        if not self.tags:
-            # If no tags, return projects from the same category
-            if self.category:
-                return Project.objects.filter(
-                    category=self.category,
-                    status='active'
-                ).exclude(id=self.id).order_by('-start_time')[:limit]
-            return Project.objects.none()
-        
-        # Split tags and clean them
-        current_tags = [tag.strip().lower() for tag in self.tags.split() if tag.strip()]
-        
-        if not current_tags:
-            return Project.objects.none()
-        
-        # Find projects with similar tags
-        similar_projects = []
-        
-        # First priority: projects with exact tag matches
-        for tag in current_tags:
-            tag_projects = Project.objects.filter(
-                tags__icontains=tag,
-                status='active'
-            ).exclude(id=self.id)
-            
-            for project in tag_projects:
-                if project not in similar_projects:
-                    similar_projects.append(project)
-                    if len(similar_projects) >= limit:
-                        break
-            if len(similar_projects) >= limit:
-                break
-        
-        # If we don't have enough projects, add projects from the same category
-        if len(similar_projects) < limit and self.category:
-            category_projects = Project.objects.filter(
-                category=self.category,
-                status='active'
-            ).exclude(id=self.id).exclude(id__in=[p.id for p in similar_projects])
-            
-            for project in category_projects:
-                if project not in similar_projects:
-                    similar_projects.append(project)
-                    if len(similar_projects) >= limit:
-                        break
-        
-        return similar_projects[:limit]
+        """Get similar projects from the precomputed neighbour lists (see projects.similarity)"""
+        return list(
+            Project.objects.with_card_stats()
+            .filter(neighbour_of__project=self)
+            .order_by('-neighbour_of__score', '-id')[:limit]
+        )
+
+
+class ProjectTag(models.Model):
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ['project', 'tag']
+        # unique_together covers project -> tags; this covers tag -> projects
+        indexes = [models.Index(fields=['tag', 'project'])]
+
+    def __str__(self):
+        return f"{self.tag.name} on {self.project.title}"
+
+
+class SimilarProject(models.Model):
+    """One of a project's precomputed most similar projects"""
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='similar_rows')
+    similar = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='neighbour_of')
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ['project', 'similar']
+        indexes = [models.Index(fields=['project', '-score'])]
+
+    def __str__(self):
+        return f"{self.similar.title} is similar to {self.project.title} ({self.score:.2f})"
+
+
+class ProjectImageQuerySet(models.QuerySet):
+    def add_gallery(self, project, files, captions=None):
+        """
+        Add uploaded files to a project's gallery after its current images.
+
+        All rows are inserted with one bulk_create and their derivatives are
+        recorded with one bulk_update, so the number of queries doesn't grow
+        with the number of images.
+        """
+        from .rails import invalidate_rails, rails_showing
+        captions = captions or []
+        with transaction.atomic():
+            last = self.filter(project=project).aggregate(last=Max('position'))['last']
+            start = 0 if last is None else last + 1
+            images = [
+                ProjectImage(
+                    project=project,
+                    image=file,
+                    caption=captions[i] if i < len(captions) else '',
+                    position=start + i,
+                )
+                for i, file in enumerate(files)
+            ]
+            # bulk_create stores the files (FileField.pre_save) but sends no post_save
+            self.bulk_create(images)
+            ProjectImage._meta.get_field('image').update_variants_bulk(images)
+            invalidate_rails(*rails_showing([project.pk]))
+        return images
+
+    def set_primary(self, project, image_id):
+        """Make one image the project's primary image in a single UPDATE"""
+        from .rails import invalidate_rails, rails_showing
+        updated = self.filter(project=project).update(
+            is_primary=Case(When(pk=image_id, then=Value(True)), default=Value(False))
+        )
+        invalidate_rails(*rails_showing([project.pk]))
+        return updated
+
+    def reorder(self, project, image_ids):
+        """Give the listed images positions 0, 1, 2... in a single UPDATE"""
+        from .rails import invalidate_rails, rails_showing
+        if not image_ids:
+            return 0
+        updated = self.filter(project=project, pk__in=image_ids).update(
+            position=Case(*[When(pk=pk, then=Value(i)) for i, pk in enumerate(image_ids)])
+        )
+        invalidate_rails(*rails_showing([project.pk]))
+        return updated
 
 
 class ProjectImage(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='project_images/')
+    image = ResponsiveImageField(upload_to='project_images/', variants_field='image_variants')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     caption = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
+    # Gallery order, set by ProjectImageQuerySet.reorder()
+    position = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = ProjectImageQuerySet.as_manager()
+    
     class Meta:
-        ordering = ['-is_primary', 'created_at']
+        ordering = ['-is_primary', 'position', 'created_at']
+        # The main image of every project card is the first row of this
+        indexes = [models.Index(fields=['project', '-is_primary', 'position', 'created_at'])]
     
     def __str__(self):
         return f"Image for {self.project.title}"
@@ -150,28 +355,119 @@ class ProjectImage(models.Model):
         super().save(*args, **kwargs)
 
 
+class CommentQuerySet(models.QuerySet):
+    def thread(self):
+        """
+        Top-level comments, newest first, with their reply trees attached.
+
+        The whole thread and its authors are loaded with one query ordered by
+        ``path``, which puts every comment right after its parent, so the
+        tree can be assembled in a single pass. Comments whose parent is not
+        in the queryset are roots, so a path prefix filter gives a subtree.
+        """
+        roots = []
+        by_id = {}
+        for comment in self.select_related('user').order_by('path'):
+            comment._thread_replies = []
+            by_id[comment.pk] = comment
+            if comment.parent_id in by_id:
+                by_id[comment.parent_id]._thread_replies.append(comment)
+            else:
+                roots.append(comment)
+        roots.sort(key=lambda comment: (comment.timestamp, comment.pk), reverse=True)
+        return roots
+
+    def with_reply_counts(self):
+        """Select the author and annotate ``reply_total``, the number of direct replies"""
+        replies = Comment.objects.filter(parent=OuterRef('pk')).order_by().values('parent')
+        return self.select_related('user').annotate(
+            reply_total=Coalesce(Subquery(replies.annotate(count=Count('id')).values('count')), Value(0))
+        )
+
+
 class Comment(models.Model):
+    # Materialized path: the zero-padded ids of the ancestors and the comment
+    # itself, e.g. "0000000012/0000000015/". Sorting by path lists a thread
+    # depth first and a subtree is a prefix match.
+    PATH_STEP = 11
+
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+    path = models.CharField(max_length=255, blank=True, editable=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['project', 'path']),
+            # A project's top-level comments, newest first (COMMENT_ORDERING)
+            models.Index(
+                fields=['project', '-timestamp', 'id'],
+                condition=models.Q(parent__isnull=True),
+                name='comment_top_level_idx',
+            ),
+            # A comment's replies, oldest first (REPLY_ORDERING)
+            models.Index(fields=['parent', 'timestamp', 'id']),
+        ]
+
     def __str__(self):
         return f"Comment by {self.user.username} on {self.project.title}"
-    
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The path ends with our own id, so it can only be set once we have one
+        old_path, self.path = self.path, self.build_path()
+        if self.path != old_path:
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            if old_path:
+                # Moved to another parent; carry the replies along
+                Comment.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(self.path), Substr('path', len(old_path) + 1))
+                )
+
+    def build_path(self):
+        prefix = self.parent.path if self.parent_id else ''
+        return f'{prefix}{self.pk:010d}/'
+
+    @property
+    def depth(self):
+        """0 for top-level comments, 1 for their replies and so on"""
+        return len(self.path) // self.PATH_STEP - 1
+
     def get_replies(self):
         """Get all replies to this comment"""
-        return Comment.objects.filter(parent=self).order_by('timestamp')
-    
+        if hasattr(self, '_thread_replies'):
+            # Already loaded by CommentQuerySet.thread()
+            return self._thread_replies
+        return Comment.objects.filter(parent=self).select_related('user').order_by('timestamp')
+
+    def get_descendants(self):
+        """Replies at any depth, in thread order"""
+        return Comment.objects.filter(
+            project_id=self.project_id, path__startswith=self.path
+        ).exclude(pk=self.pk).order_by('path')
+
     def is_reply(self):
         """Check if this comment is a reply to another comment"""
         return self.parent is not None
     
     def get_reply_count(self):
         """Get the number of replies to this comment"""
+        if hasattr(self, 'reply_total'):
+            # Annotated by CommentQuerySet.with_reply_counts()
+            return self.reply_total
+        if hasattr(self, '_thread_replies'):
+            return len(self._thread_replies)
         return self.get_replies().count()
 
+    def get_author_name(self):
+        """The author's full name, falling back to the username"""
+        name = f"{self.user.first_name} {self.user.last_name}".strip()
+        return name or self.user.username
+
 
 
 class Donation(models.Model):
@@ -179,11 +475,55 @@ class Donation(models.Model):
     project = models.ForeignKey('Project', on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Client-supplied token that makes resubmitting the same donation a no-op
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'idempotency_key'], name='unique_donation_idempotency_key'),
+        ]
+        # A donor's history, newest first; by project is the foreign key's index
+        indexes = [models.Index(fields=['user', '-timestamp', 'id'])]
 
     def __str__(self):
         return f"{self.user.username} donated {self.amount} to {self.project.title}"
 
 
+class DonationDayQuerySet(models.QuerySet):
+    def rebuild(self, project_ids):
+        """Recompute the rollup rows of the given projects from their donations"""
+        days = (
+            Donation.objects.filter(project_id__in=project_ids)
+            .annotate(day=TruncDate('timestamp'))
+            .values('project_id', 'day')
+            .annotate(total=Sum('amount'), count=Count('id'), donor_count=Count('user', distinct=True))
+            .order_by()
+        )
+        self.filter(project_id__in=project_ids).delete()
+        return len(self.bulk_create(DonationDay(**row) for row in days))
+
+
+class DonationDay(models.Model):
+    """
+    One project's donations on one day, kept up to date by signals so funding
+    charts read one row per day instead of every donation.
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='donation_days')
+    day = models.DateField()
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+    donor_count = models.PositiveIntegerField(default=0)
+
+    objects = DonationDayQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('project', 'day')
+        ordering = ['day']
+
+    def __str__(self):
+        return f"{self.project.title} on {self.day}: {self.total} from {self.count} donations"
+
+
 class ProjectReport(models.Model):
     REPORT_REASONS = [
         ('inappropriate', 'Inappropriate Content'),
@@ -250,4 +590,20 @@ class ProjectRating(models.Model):
         ordering = ['-timestamp']
     
     def __str__(self):
-        return f"{self.user.username} rated {self.project.title} with {self.rating} stars"
\ No newline at end of file
+        return f"{self.user.username} rated {self.project.title} with {self.rating} stars"
+
+class MediaBlob(models.Model):
+    """
+    One file in content-addressed media storage (see projects.storage).
+
+    ``references`` counts the saves that returned this blob; the file is
+    removed when the last of them is deleted.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.references} references)"
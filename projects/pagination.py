@@ -0,0 +1,121 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with a ``WHERE (key) < (last key seen)`` condition instead
+of ``OFFSET``, so every page costs the same indexed range scan however deep
+the user goes. The cursor is a signed token holding the sort key of the last
+row on the previous page.
+"""
+import hashlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+
+CURSOR_SALT = 'projects.pagination.cursor'
+CURSOR_PARAM = 'cursor'
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor, is_first=True):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` by the unique sort key ``ordering``.
+
+    ``ordering`` uses ``order_by`` syntax and must end with a unique field
+    (normally ``id``) so the key identifies exactly one row.
+    """
+
+    def __init__(self, queryset, ordering, per_page=24):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = list(ordering)
+        self.per_page = per_page
+
+    def encode_cursor(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        return signing.dumps(values, salt=CURSOR_SALT)
+
+    def decode_cursor(self, cursor):
+        """Return the key values in ``cursor``, or None if it is missing or invalid"""
+        if not cursor:
+            return None
+        try:
+            values = signing.loads(cursor, salt=CURSOR_SALT)
+        except signing.BadSignature:
+            return None
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            return None
+        return values
+
+    def after(self, values):
+        """Q matching rows that sort strictly after the key ``values``"""
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            branch = Q(**{f'{name}__{lookup}': values[i]})
+            for previous, value in zip(self.ordering[:i], values[:i]):
+                branch &= Q(**{previous.lstrip('-'): value})
+            condition |= branch
+        return condition
+
+    def get_page(self, cursor=None):
+        queryset = self.queryset
+        values = self.decode_cursor(cursor)
+        if values is not None:
+            queryset = queryset.filter(self.after(values))
+        # Fetch one extra row to learn whether there is a next page
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            next_cursor = self.encode_cursor(rows[-1])
+        return KeysetPage(rows, next_cursor, is_first=values is None)
+
+
+def paginate(request, queryset, ordering, per_page=24):
+    """Return the page of ``queryset`` named by the request's cursor parameter"""
+    return KeysetPaginator(queryset, ordering, per_page).get_page(request.GET.get(CURSOR_PARAM))
+
+
+def query_cache_key(prefix, queryset):
+    """Cache key identifying the SQL behind ``queryset``"""
+    if queryset.query.is_empty():
+        # none() compiles to no SQL at all
+        return f'{prefix}:none'
+    sql, params = queryset.query.sql_with_params()
+    return f'{prefix}:' + hashlib.md5(f'{sql}|{params!r}'.encode()).hexdigest()
+
+
+def cached_count(queryset, timeout=60):
+    """Count ``queryset``, caching the result briefly since totals are only informative"""
+    key = query_cache_key('count', queryset)
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
@@ -0,0 +1,111 @@
+"""
+Per-request SQL accounting.
+
+``SQLAccountingMiddleware`` counts the queries each request runs on every
+database connection, their total time, and how many were repeats: the same
+statement with the same parameters (``duplicates``, a result that could have
+been reused) or with different ones (``similar``, usually a query per row of
+a list, the N+1 pattern). With ``SQL_ACCOUNTING['ENABLED']`` the numbers are
+sent as response headers::
+
+    X-SQL-Queries: 9
+    X-SQL-Time: 4.1
+    X-SQL-Duplicates: 0
+    X-SQL-Similar: 2
+    Server-Timing: sql;dur=4.1;desc="9 queries"
+
+``log_queries`` is the same accounting as a context manager, which the test
+suite uses to hold every view to a query budget and ``projects.metrics``
+uses (counting only) for SQL time. Unlike DEBUG's ``connection.queries`` it
+works with DEBUG off.
+"""
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+DEFAULTS = {
+    # Add the X-SQL-* and Server-Timing headers to responses
+    'ENABLED': False,
+}
+
+
+def get_sql_accounting_settings():
+    return {**DEFAULTS, **getattr(settings, 'SQL_ACCOUNTING', {})}
+
+
+class QueryLog:
+    """Execute wrapper that tallies the queries run through it"""
+
+    def __init__(self, detail=True):
+        # Without detail only count and time are kept, which is cheaper
+        self.detail = detail
+        self.count = 0
+        self.time = 0.0
+        self.statements = Counter()
+        self.executions = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            if self.detail:
+                self.record(sql, params)
+
+    def record(self, sql, params):
+        self.statements[sql] += 1
+        try:
+            self.executions[sql, repr(params)] += 1
+        except Exception:
+            # A parameter whose repr fails still counts towards the statement
+            pass
+
+    @property
+    def duplicates(self):
+        """Executions that repeated an earlier query exactly"""
+        return sum(count - 1 for count in self.executions.values())
+
+    @property
+    def similar(self):
+        """Executions that repeated an earlier statement with other parameters"""
+        return sum(count - 1 for count in self.statements.values()) - self.duplicates
+
+    def summary(self, limit=5):
+        """The most repeated statements, for test failures and logs"""
+        lines = [f'{self.count} queries in {self.time * 1000:.1f}ms']
+        for sql, count in self.statements.most_common(limit):
+            lines.append(f'{count}x {sql}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def log_queries(detail=True):
+    """Tally the queries run on this thread's connections inside the block"""
+    log = QueryLog(detail)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(log))
+        yield log
+
+
+class SQLAccountingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not get_sql_accounting_settings()['ENABLED']:
+            return self.get_response(request)
+        with log_queries() as log:
+            response = self.get_response(request)
+        milliseconds = f'{log.time * 1000:.1f}'
+        response.headers['X-SQL-Queries'] = str(log.count)
+        response.headers['X-SQL-Time'] = milliseconds
+        response.headers['X-SQL-Duplicates'] = str(log.duplicates)
+        response.headers['X-SQL-Similar'] = str(log.similar)
+        response.headers['Server-Timing'] = f'sql;dur={milliseconds};desc="{log.count} queries"'
+        return response
@@ -0,0 +1,128 @@
+"""
+Cached home page rails.
+
+The featured, latest and top-rated lists on the home page are the same for
+every visitor, so each rail is built once and cached as ready-to-render
+project cards. Signals in ``projects.signals`` bump a rail's generation when
+something it shows changes, which marks the cached copy stale.
+
+A stale or expired rail is rebuilt by one request holding a short cache lock;
+concurrent requests keep serving the previous copy meanwhile instead of all
+hitting the database at once.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .routing import use_primary
+
+RAIL_SIZE = 6
+FRESH_FOR = 300
+# How long an expired copy may still be served while another request rebuilds it
+STALE_FOR = 600
+LOCK_TIMEOUT = 30
+KEY_PREFIX = 'home-rails'
+
+
+def _featured():
+    from .models import Project
+    return Project.objects.filter(status='active', featured=True).order_by('-start_time', '-id')
+
+
+def _latest():
+    from .models import Project
+    return Project.objects.filter(status='active').order_by('-start_time', '-id')
+
+
+def _top():
+    from .models import Project
+    return Project.objects.filter(status='active').top_rated().order_by('-avg_rating', '-id')
+
+
+RAILS = {
+    'featured': _featured,
+    'latest': _latest,
+    'top': _top,
+}
+
+
+def _key(name):
+    return f'{KEY_PREFIX}:{name}'
+
+
+def _generation_key(name):
+    return f'{KEY_PREFIX}:{name}:generation'
+
+
+def build_rail(name):
+    """Query the cards for one rail"""
+    return list(RAILS[name]().with_card_stats()[:RAIL_SIZE])
+
+
+def get_rail(name):
+    """Return the cached cards for rail ``name``, rebuilding them if stale"""
+    key, generation_key = _key(name), _generation_key(name)
+    cached = cache.get_many([key, generation_key])
+    entry = cached.get(key)
+    # Read the generation before querying so a change made mid-rebuild
+    # leaves the stored copy stale rather than hiding the change
+    generation = cached.get(generation_key, 0)
+    if entry and entry['generation'] == generation and entry['fresh_until'] > time.time():
+        return entry['projects']
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        # Someone else is rebuilding; the old copy is good enough until they finish
+        if entry:
+            return entry['projects']
+        return build_rail(name)
+    try:
+        # A lagging replica would leave the change that invalidated the rail cached out
+        with use_primary():
+            projects = build_rail(name)
+        cache.set(key, {
+            'generation': generation,
+            'fresh_until': time.time() + FRESH_FOR,
+            'ids': {project.pk for project in projects},
+            'projects': projects,
+        }, FRESH_FOR + STALE_FOR)
+    finally:
+        cache.delete(lock_key)
+    return projects
+
+
+def get_home_rails(limit=RAIL_SIZE):
+    """Template context for the home page rails"""
+    return {f'{name}_projects': get_rail(name)[:limit] for name in RAILS}
+
+
+def rails_showing(project_ids):
+    """Names of the cached rails that currently show any of ``project_ids``"""
+    project_ids = set(project_ids)
+    entries = cache.get_many([_key(name) for name in RAILS])
+    return [
+        name for name in RAILS
+        if _key(name) in entries and project_ids & entries[_key(name)]['ids']
+    ]
+
+
+def _bump(name):
+    key = _generation_key(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # First invalidation; add() only loses to a concurrent bump, which does the same job
+        cache.add(key, 1, None)
+
+
+def invalidate_rails(*names):
+    """Mark rails stale once the current transaction commits"""
+    if not names:
+        return
+
+    def bump():
+        for name in names:
+            _bump(name)
+    # Bumping earlier would let a request rebuild from the uncommitted state
+    transaction.on_commit(bump)
@@ -0,0 +1,139 @@
+"""
+Read replica routing.
+
+Most page views only read: listings, search, project pages and the home
+page. Views marked ``@read_replica`` send their reads to one of the
+``DATABASE_ROUTING['REPLICAS']`` aliases; everything else, and every write,
+uses the primary (``default``).
+
+Replicas lag behind the primary, so a client that just wrote (donated,
+commented, rated, logged in) must not read from one straight away or it
+won't see its own change. ``ReplicaRoutingMiddleware`` keeps a request on the
+primary once it has written anything, sends POSTs there outright, and after a
+write sets a short-lived cookie that keeps that client's next requests on the
+primary for ``STICKY_SECONDS``. Reads inside a transaction, and of the apps in
+``PRIMARY_APPS`` (sessions and users, which login writes and the next request
+reads), always use the primary too.
+
+With ``REPLICAS`` empty, the default, all queries go to the primary.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+DEFAULTS = {
+    # Aliases in DATABASES that replicate the primary
+    'REPLICAS': [],
+    # How long a client that wrote keeps reading from the primary
+    'STICKY_SECONDS': 5,
+    # Apps whose tables are always read from the primary
+    'PRIMARY_APPS': ['accounts', 'admin', 'auth', 'contenttypes', 'sessions'],
+}
+
+PIN_COOKIE = 'db_primary'
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def get_routing_settings():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_ROUTING', {})}
+
+
+class RoutingState:
+    """Where the current request's reads may go"""
+
+    def __init__(self, pinned=False):
+        # Set while a @read_replica view runs
+        self.use_replica = False
+        # Reads go to the primary for the rest of the request
+        self.pinned = pinned
+        self.wrote = False
+        # Chosen on first use, so a request reads from one consistent replica
+        self.replica = None
+
+
+_state = ContextVar('database_routing', default=None)
+
+
+def read_replica(view):
+    """Let a view's reads go to a replica unless the client recently wrote"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = _state.get()
+        if state is None:
+            # Not behind ReplicaRoutingMiddleware; stay on the primary
+            return view(request, *args, **kwargs)
+        previous = state.use_replica
+        state.use_replica = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.use_replica = previous
+    return wrapper
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block, e.g. to build something that is cached"""
+    state = _state.get()
+    if state is None:
+        yield
+        return
+    previous = state.use_replica
+    state.use_replica = False
+    try:
+        yield
+    finally:
+        state.use_replica = previous
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or state.pinned:
+            return DEFAULT_DB_ALIAS
+        config = get_routing_settings()
+        if not config['REPLICAS'] or model._meta.app_label in config['PRIMARY_APPS']:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # A transaction reads its own uncommitted writes
+            return DEFAULT_DB_ALIAS
+        if state.replica is None:
+            state.replica = random.choice(config['REPLICAS'])
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        # Explicit, or an instance read from a replica would be saved back to it
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *get_routing_settings()['REPLICAS']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+        state = RoutingState(pinned=pinned)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        config = get_routing_settings()
+        if state.wrote and config['REPLICAS']:
+            response.set_cookie(PIN_COOKIE, '1', max_age=config['STICKY_SECONDS'], httponly=True, samesite='Lax')
+        return response
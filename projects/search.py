@@ -0,0 +1,199 @@
+"""
+Project search backends.
+
+Views never build search filters themselves; they call ``search_projects`` and
+get back a queryset filtered to the matches and annotated with ``relevance``.
+The backend is chosen with the ``PROJECT_SEARCH_BACKEND`` setting so the SQLite
+FTS5 index can be swapped for another engine when we move databases.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Exists, FloatField, IntegerField, OuterRef, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+DEFAULT_SEARCH_BACKEND = 'projects.search.SqliteFTS5SearchBackend'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search string into lowercase word tokens"""
+    return TOKEN_RE.findall(query.lower())
+
+
+class BaseSearchBackend:
+    """Interface every search backend implements"""
+
+    def search(self, queryset, query):
+        """Filter ``queryset`` to projects matching ``query`` and annotate ``relevance``"""
+        raise NotImplementedError
+
+    def no_results(self, queryset):
+        """An empty result that still carries ``relevance``, so callers can order by it"""
+        return queryset.none().annotate(relevance=Value(0.0, output_field=FloatField()))
+
+    def index_projects(self, project_ids):
+        """(Re)index the given projects"""
+
+    def index_category(self, category_id):
+        """Reindex every project in a category"""
+
+    def index_owner(self, owner_id):
+        """Reindex every project owned by a user"""
+
+    def remove_projects(self, project_ids):
+        """Drop the given projects from the index"""
+
+    def rebuild(self):
+        """Rebuild the whole index from the project table"""
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Unindexed ``icontains`` search, usable on any database"""
+
+    def search(self, queryset, query):
+        from .models import ProjectTag
+        query = query.strip()
+        if not query:
+            return self.no_results(queryset)
+        # Exists() rather than a join so projects with several tags aren't duplicated
+        tag_match = Exists(ProjectTag.objects.filter(project=OuterRef('pk'), tag__name__icontains=query))
+        return queryset.annotate(tag_match=tag_match).filter(
+            Q(title__icontains=query) |
+            Q(tag_match=True) |
+            Q(details__icontains=query) |
+            Q(category__name__icontains=query) |
+            Q(owner__first_name__icontains=query) |
+            Q(owner__last_name__icontains=query)
+        ).annotate(
+            relevance=Case(
+                When(title__icontains=query, then=3),
+                When(tag_match=True, then=2),
+                When(details__icontains=query, then=1),
+                default=0,
+                output_field=IntegerField(),
+            )
+        )
+
+
+class SqliteFTS5SearchBackend(BaseSearchBackend):
+    """
+    Full-text search backed by an SQLite FTS5 virtual table.
+
+    The index row for a project shares its rowid with the project id, so a
+    search is a single MATCH on the index joined to ``projects_project`` by
+    primary key. Relevance is the negated bm25 score with title matches
+    weighted highest, mirroring the old title > tags > details ordering.
+    """
+    table = 'projects_project_fts'
+    columns = ('title', 'tags', 'details', 'category', 'owner')
+    weights = (10.0, 5.0, 1.0, 2.0, 2.0)
+
+    def match_expression(self, query):
+        """Turn user input into an FTS5 phrase-prefix expression, or None"""
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        # Tokens are \w-only so they can be quoted without escaping
+        return '"%s"*' % ' '.join(tokens)
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if expression is None:
+            return self.no_results(queryset)
+        weights = ', '.join(str(w) for w in self.weights)
+        # The rowid join goes through filter() so Django aliases the project
+        # table correctly when this queryset is nested as a subquery, and
+        # relevance is a real annotation so keyset pagination can filter on it
+        return queryset.extra(
+            tables=[self.table],
+            where=[f'{self.table} MATCH %s'],
+            params=[expression],
+        ).filter(
+            id=RawSQL(f'{self.table}.rowid', [])
+        ).annotate(
+            relevance=RawSQL(f'-bm25({self.table}, {weights})', [], output_field=FloatField())
+        )
+
+    def _source_sql(self):
+        from django.contrib.auth import get_user_model
+        from .models import Category, Project, ProjectTag, Tag
+        return (
+            f"SELECT p.id, p.title, "
+            f"COALESCE((SELECT GROUP_CONCAT(t.name, ' ') FROM {ProjectTag._meta.db_table} pt "
+            f"INNER JOIN {Tag._meta.db_table} t ON t.id = pt.tag_id WHERE pt.project_id = p.id), ''), "
+            f"p.details, COALESCE(c.name, ''), "
+            f"COALESCE(u.first_name, '') || ' ' || COALESCE(u.last_name, '') "
+            f"FROM {Project._meta.db_table} p "
+            f"LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id "
+            f"INNER JOIN {get_user_model()._meta.db_table} u ON u.id = p.owner_id"
+        )
+
+    def _reindex(self, where, params):
+        from .models import Project
+        columns = ', '.join(self.columns)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid IN '
+                f'(SELECT p.id FROM {Project._meta.db_table} p WHERE {where})',
+                params,
+            )
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, {columns}) '
+                f'{self._source_sql()} WHERE {where}',
+                params,
+            )
+
+    def index_projects(self, project_ids):
+        project_ids = list(project_ids)
+        if not project_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(project_ids))
+        self._reindex(f'p.id IN ({placeholders})', project_ids)
+
+    def index_category(self, category_id):
+        self._reindex('p.category_id = %s', [category_id])
+
+    def index_owner(self, owner_id):
+        self._reindex('p.owner_id = %s', [owner_id])
+
+    def remove_projects(self, project_ids):
+        project_ids = list(project_ids)
+        if not project_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(project_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})',
+                project_ids,
+            )
+
+    def create_table(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"{', '.join(self.columns)}, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+    def rebuild(self):
+        columns = ', '.join(self.columns)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+            self.create_table(cursor)
+            cursor.execute(f'INSERT INTO {self.table} (rowid, {columns}) {self._source_sql()}')
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """Return the configured search backend instance"""
+    path = getattr(settings, 'PROJECT_SEARCH_BACKEND', DEFAULT_SEARCH_BACKEND)
+    return import_string(path)()
+
+
+def search_projects(queryset, query):
+    """Filter ``queryset`` by a user search string; results carry ``relevance``"""
+    return get_search_backend().search(queryset, query)
@@ -0,0 +1,215 @@
+"""
+Media serving.
+
+``serve_media`` replaces ``django.conf.urls.static.static()``, which only
+works with DEBUG on and streams every byte through a Python worker. It
+answers conditional requests (strong ETags, If-None-Match, If-Modified-Since)
+and single byte ranges itself, and with ``MEDIA_SERVING['OFFLOAD']`` set it
+only decides *what* to send: the response carries an ``X-Sendfile`` (Apache,
+lighttpd) or ``X-Accel-Redirect`` (nginx) header and the front proxy
+transfers the file.
+
+Files in content-addressed storage (``projects.storage``) never change under
+their name, so they are sent with a year-long immutable Cache-Control and
+their hash as ETag.
+
+``serve_static`` does the same for the hashed files ``collectstatic`` writes
+to STATIC_ROOT (``projects.staticfiles``), sending the gzip or brotli copy
+when the browser accepts it.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
+from .storage import BLOBS_DIR
+
+DEFAULTS = {
+    # None (send from Python), 'x-sendfile' or 'x-accel-redirect'
+    'OFFLOAD': None,
+    # Internal nginx location that aliases MEDIA_ROOT, for X-Accel-Redirect
+    'ACCEL_PREFIX': '/protected-media/',
+    # Cache lifetime of files that may be replaced under the same name
+    'MAX_AGE': 60 * 60,
+}
+
+# Content-addressed files can be cached for good
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# Names ManifestStaticFilesStorage gives collected files, e.g. css/home.4f1a2b3c9d8e.css
+HASHED_STATIC_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+# Precompressed copies, in order of preference
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+BLOB_RE = re.compile(rf'^{BLOBS_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[\w]+)?$')
+
+
+def get_media_serving_settings():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+def parse_range(header, size):
+    """
+    ``(start, end)`` (inclusive) for a single-range Range header, None to
+    ignore the header, or ``False`` if the range can't be satisfied.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        # Multiple ranges or another unit; answering with the whole file is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def file_etag(path, stat):
+    match = BLOB_RE.match(path)
+    if match:
+        # The name is the SHA-256 of the content
+        return quote_etag(match.group(1))
+    return quote_etag(f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+
+
+def accepts_encoding(header, coding):
+    """Whether an Accept-Encoding header allows ``coding``"""
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        if name.strip().lower() not in (coding, '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            # q=0 means "not acceptable"
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def read_range(full_path, start, length):
+    with open(full_path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def resolve(root, path):
+    """Normalized path and absolute path of a file under ``root``, or Http404"""
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(root, path)
+    except SuspiciousFileOperation:
+        # The path escapes the root
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+    return path, full_path
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT, or have the front proxy serve it"""
+    path, full_path = resolve(settings.MEDIA_ROOT, path)
+    return serve_file(request, get_media_serving_settings(), path, full_path, immutable=bool(BLOB_RE.match(path)))
+
+
+@require_safe
+def serve_static(request, path):
+    """Serve a collected file from STATIC_ROOT, precompressed if the browser accepts it"""
+    if not settings.STATIC_ROOT:
+        raise Http404('Not found')
+    path, full_path = resolve(settings.STATIC_ROOT, path)
+    immutable = bool(HASHED_STATIC_RE.search(path))
+    accepted = request.headers.get('Accept-Encoding', '')
+    for coding, suffix in PRECOMPRESSED:
+        if accepts_encoding(accepted, coding) and os.path.isfile(full_path + suffix):
+            path, full_path = path + suffix, full_path + suffix
+            break
+    # Static files are small and few; the proxy serves STATIC_ROOT directly when it can
+    config = {**get_media_serving_settings(), 'OFFLOAD': None}
+    response = serve_file(request, config, path, full_path, immutable)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+def serve_file(request, config, path, full_path, immutable):
+    try:
+        stat = os.stat(full_path)
+    except OSError:
+        raise Http404('Not found')
+    etag = file_etag(path, stat)
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build_response(request, config, path, full_path, stat.st_size, etag)
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    if immutable:
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=config['MAX_AGE'])
+    return response
+
+
+def build_response(request, config, path, full_path, size, etag):
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    if config['OFFLOAD']:
+        # The proxy reads the file and handles Range itself
+        response = HttpResponse(content_type=content_type)
+        if config['OFFLOAD'] == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = config['ACCEL_PREFIX'].rstrip('/') + '/' + path
+        else:
+            response.headers['X-Sendfile'] = full_path
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # A Range under a stale If-Range validator gets the whole, current file
+    if range_header and (not if_range or if_range == etag):
+        byte_range = parse_range(range_header, size)
+    if byte_range is False:
+        response = HttpResponse(status=416, content_type=content_type)
+        response.headers['Content-Range'] = f'bytes */{size}'
+    elif byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(read_range(full_path, start, length), status=206,
+                                         content_type=content_type)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.headers['Content-Length'] = str(length)
+    else:
+        # FileResponse lets the WSGI server use sendfile() through wsgi.file_wrapper
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,300 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Category, Donation, DonationDay, Project, ProjectImage, ProjectRating, Tag
+from .rails import RAILS, invalidate_rails, rails_showing
+from .search import get_search_backend
+from .similarity import get_similarity_engine
+
+OWNER_NAME_FIELDS = {'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=Project)
+def index_project(sender, instance, **kwargs):
+    """Keep the search index in sync with project edits"""
+    get_search_backend().index_projects([instance.pk])
+
+
+@receiver(post_delete, sender=Project)
+def unindex_project(sender, instance, **kwargs):
+    get_search_backend().remove_projects([instance.pk])
+
+
+@receiver(m2m_changed, sender=Project.tags.through)
+def reindex_tagged_projects(sender, instance, action, reverse, pk_set, **kwargs):
+    """Tag edits change a project's indexed text"""
+    if reverse and action == 'pre_clear':
+        # tag.projects.clear() reports no pk_set, so note the projects first
+        instance._cleared_project_ids = list(instance.projects.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        get_search_backend().index_projects([instance.pk])
+    elif action == 'post_clear':
+        get_search_backend().index_projects(getattr(instance, '_cleared_project_ids', []))
+    else:
+        get_search_backend().index_projects(pk_set)
+
+
+@receiver(post_save, sender=Tag)
+def reindex_renamed_tag(sender, instance, created, **kwargs):
+    if not created:
+        get_search_backend().index_projects(instance.projects.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_projects(sender, instance, created, **kwargs):
+    """A renamed category changes the indexed text of all its projects"""
+    if not created:
+        get_search_backend().index_category(instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_projects(sender, instance, **kwargs):
+    # The SET_NULL update sends no signals, so note the projects to reindex
+    instance._project_ids = list(instance.project_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_uncategorized_projects(sender, instance, **kwargs):
+    get_search_backend().index_projects(getattr(instance, '_project_ids', []))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def reindex_owner_projects(sender, instance, created, update_fields=None, **kwargs):
+    """Owner names are searchable, so reindex a user's projects when they change"""
+    if created:
+        return
+    if update_fields is not None and not OWNER_NAME_FIELDS.intersection(update_fields):
+        # e.g. the last_login update on every sign-in
+        return
+    get_search_backend().index_owner(instance.pk)
+
+
+def _bump_counters(project_id, **deltas):
+    """Atomically add ``deltas`` to a project's stored counters"""
+    Project.objects.filter(pk=project_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()}
+    )
+
+
+@receiver(pre_save, sender=Donation)
+def remember_donation(sender, instance, raw=False, **kwargs):
+    # Edits need the previous row so the old amount can be backed out
+    instance._counter_previous = None
+    if instance.pk and not raw:
+        instance._counter_previous = (
+            Donation.objects.filter(pk=instance.pk).values_list('project_id', 'amount', 'user_id').first()
+        )
+
+
+@receiver(post_save, sender=Donation)
+def count_donation(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counter_previous', None)
+    if previous:
+        _bump_counters(previous[0], donation_total=-previous[1], donation_count=-1)
+        _bump_donation_day(instance, *previous, sign=-1)
+    _bump_counters(instance.project_id, donation_total=Decimal(instance.amount), donation_count=1)
+    _bump_donation_day(instance, instance.project_id, Decimal(instance.amount), instance.user_id,
+                       sign=1, first_only=created)
+
+
+@receiver(post_delete, sender=Donation)
+def uncount_donation(sender, instance, **kwargs):
+    _bump_counters(instance.project_id, donation_total=-Decimal(instance.amount), donation_count=-1)
+    _bump_donation_day(instance, instance.project_id, Decimal(instance.amount), instance.user_id, sign=-1)
+
+
+def _bump_donation_day(donation, project_id, amount, user_id, sign, first_only=False):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) a donation in its day's rollup row.
+
+    The donor counts towards the day's unique donors through their first
+    donation that day; ``first_only`` checks only earlier donations, which
+    keeps batches inserted before their signals run from cancelling out.
+
+    Removals only touch an existing row: when a project is deleted with its
+    donations the cascade may already have removed the rollup rows, and
+    recreating one at zero would take its counts below zero.
+    """
+    day = timezone.localdate(donation.timestamp)
+    others = Donation.objects.filter(project_id=project_id, user_id=user_id, timestamp__date=day)
+    others = others.filter(pk__lt=donation.pk) if first_only else others.exclude(pk=donation.pk)
+    if sign > 0:
+        DonationDay.objects.get_or_create(project_id=project_id, day=day)
+    DonationDay.objects.filter(project_id=project_id, day=day).update(
+        total=F('total') + sign * amount,
+        count=F('count') + sign,
+        donor_count=F('donor_count') + (0 if others.exists() else sign),
+    )
+
+
+@receiver(pre_save, sender=ProjectRating)
+def remember_rating(sender, instance, raw=False, **kwargs):
+    instance._counter_previous = None
+    if instance.pk and not raw:
+        instance._counter_previous = (
+            ProjectRating.objects.filter(pk=instance.pk).values_list('project_id', 'rating').first()
+        )
+
+
+@receiver(post_save, sender=ProjectRating)
+def count_rating(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counter_previous', None)
+    if previous:
+        _bump_counters(previous[0], rating_sum=-previous[1], rating_count=-1)
+    _bump_counters(instance.project_id, rating_sum=int(instance.rating), rating_count=1)
+
+
+@receiver(post_delete, sender=ProjectRating)
+def uncount_rating(sender, instance, **kwargs):
+    _bump_counters(instance.project_id, rating_sum=-instance.rating, rating_count=-1)
+
+
+@receiver(pre_save, sender=Project)
+def remember_project_state(sender, instance, raw=False, **kwargs):
+    # The similarity and home rail receivers only act on changes to these fields
+    instance._previous_state = None
+    if instance.pk and not raw:
+        instance._previous_state = (
+            Project.objects.filter(pk=instance.pk).values('category_id', 'status', 'featured').first()
+        )
+
+
+@receiver(post_save, sender=Project)
+def update_similar_projects(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    # Only category and status changes (and tags, below) move a project's neighbours
+    previous = getattr(instance, '_previous_state', None)
+    if created or previous is None or (
+        (previous['category_id'], previous['status']) != (instance.category_id, instance.status)
+    ):
+        _update_similar_projects([instance.pk])
+
+
+@receiver(m2m_changed, sender=Project.tags.through)
+def update_similar_projects_for_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        _update_similar_projects([instance.pk])
+    else:
+        _update_similar_projects(pk_set if action != 'post_clear' else getattr(instance, '_cleared_project_ids', []))
+
+
+class PendingSimilarityUpdate:
+    """The projects whose neighbours one transaction changed, updated when it commits"""
+
+    def __init__(self):
+        self.project_ids = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        for project in Project.objects.filter(pk__in=list(self.project_ids)):
+            get_similarity_engine().update_project(project)
+
+
+def _update_similar_projects(project_ids):
+    """
+    Update the neighbours of ``project_ids`` once the transaction commits.
+
+    Saving a project form fires post_save and then post_remove and post_add
+    for its tags, and each update scans the project's category; collecting
+    the ids until commit runs it once per project.
+    """
+    pending = getattr(connection, 'pending_similarity_update', None)
+    # A rollback discards the callback, so check it is still queued
+    if pending is not None and not pending.done and any(entry[1] is pending for entry in connection.run_on_commit):
+        pending.project_ids.update(project_ids)
+        return
+    pending = connection.pending_similarity_update = PendingSimilarityUpdate()
+    pending.project_ids.update(project_ids)
+    # Outside a transaction this runs at once
+    transaction.on_commit(pending)
+
+
+@receiver(pre_delete, sender=Project)
+def remember_neighbour_lists(sender, instance, **kwargs):
+    # The cascade removes the rows, so note which lists need refilling
+    instance._neighbour_of = list(instance.neighbour_of.values_list('project_id', flat=True))
+
+
+@receiver(post_delete, sender=Project)
+def refill_neighbour_lists(sender, instance, **kwargs):
+    get_similarity_engine().remove_project(instance.pk, getattr(instance, '_neighbour_of', []))
+
+
+@receiver(post_save, sender=Project)
+def invalidate_rails_for_project(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if created:
+        invalidate_rails('latest', *(['featured'] if instance.featured else []))
+    elif previous is None or previous['status'] != instance.status:
+        invalidate_rails(*RAILS)
+    else:
+        # Any other edit only matters to rails already showing the card
+        names = set(rails_showing([instance.pk]))
+        if previous['featured'] != instance.featured:
+            names.add('featured')
+        invalidate_rails(*names)
+
+
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=Donation)
+@receiver(post_delete, sender=Donation)
+@receiver(post_save, sender=ProjectImage)
+@receiver(post_delete, sender=ProjectImage)
+def invalidate_rails_for_card(sender, instance, raw=False, **kwargs):
+    """Cards show funding progress and the main image"""
+    if raw:
+        return
+    project_id = instance.pk if sender is Project else instance.project_id
+    invalidate_rails(*rails_showing([project_id]))
+
+
+@receiver(post_save, sender=ProjectRating)
+@receiver(post_delete, sender=ProjectRating)
+def invalidate_top_rail(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_rails('top')
+
+
+@receiver(m2m_changed, sender=Project.tags.through)
+def invalidate_rails_for_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_rails(*rails_showing([instance.pk]))
+    else:
+        project_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_project_ids', [])
+        invalidate_rails(*rails_showing(project_ids))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_all_rails(sender, instance, created=False, **kwargs):
+    # Renames are rare enough not to track which cards show the name
+    if not created:
+        invalidate_rails(*RAILS)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_rails_for_owner(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not OWNER_NAME_FIELDS.intersection(update_fields)):
+        return
+    invalidate_rails(*RAILS)
@@ -0,0 +1,343 @@
+"""
+Precomputed "similar projects".
+
+The similarity of two projects is
+
+    tag Jaccard + CATEGORY_WEIGHT * (same category) + DONOR_WEIGHT * donor Jaccard
+
+and every project stores its TOP_K most similar active projects as
+``SimilarProject`` rows, so the detail page reads them with one indexed query.
+A full rebuild (``rebuild_similar_projects``) computes tag and donor overlaps
+as sparse matrix products when numpy/scipy are installed, falling back to an
+inverted index otherwise. Edits to a single project's tags, category or status
+update the affected lists incrementally.
+"""
+import heapq
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, OuterRef, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+from .models import Donation, Project, ProjectTag, SimilarProject
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - exercised when scipy isn't installed
+    np = sparse = None
+
+DEFAULTS = {
+    'TOP_K': 4,
+    'CATEGORY_WEIGHT': 0.3,
+    # Donor overlap needs a scan of donations, so it is off unless configured
+    'DONOR_WEIGHT': 0.0,
+}
+
+# Rows of the similarity matrix computed per sparse product
+CHUNK_SIZE = 2000
+
+
+def get_similarity_settings():
+    return {**DEFAULTS, **getattr(settings, 'PROJECT_SIMILARITY', {})}
+
+
+class SimilarityEngine:
+    def __init__(self, top_k=None, category_weight=None, donor_weight=None):
+        config = get_similarity_settings()
+        self.top_k = top_k if top_k is not None else config['TOP_K']
+        self.category_weight = category_weight if category_weight is not None else config['CATEGORY_WEIGHT']
+        self.donor_weight = donor_weight if donor_weight is not None else config['DONOR_WEIGHT']
+
+    def _select(self, project_id, category_id, candidates, category_fill):
+        """
+        Pick the top-K ``(id, score)`` pairs from ``candidates`` (active projects
+        only), topping up from ``category_fill(category_id, exclude, count)``
+        with same-category projects when there are too few.
+        """
+        best = heapq.nlargest(self.top_k, candidates, key=lambda item: (item[1], item[0]))
+        missing = self.top_k - len(best)
+        if missing and category_id is not None and self.category_weight > 0:
+            exclude = {project_id} | {similar_id for similar_id, _ in best}
+            best += [(similar_id, self.category_weight) for similar_id in category_fill(category_id, exclude, missing)]
+        return best
+
+    # Full rebuild
+
+    def rebuild(self):
+        """Recompute every project's neighbours; returns the number of rows stored"""
+        projects = list(Project.objects.order_by('-start_time', '-id').values_list('id', 'category_id', 'status'))
+        active_by_category = defaultdict(list)
+        for project_id, category_id, status in projects:
+            if status == 'active' and category_id is not None:
+                active_by_category[category_id].append(project_id)
+
+        def category_fill(category_id, exclude, count):
+            found = []
+            for project_id in active_by_category[category_id]:
+                if project_id not in exclude:
+                    found.append(project_id)
+                    if len(found) == count:
+                        break
+            return found
+
+        project_tags = list(ProjectTag.objects.values_list('project_id', 'tag_id'))
+        project_donors = []
+        if self.donor_weight > 0:
+            project_donors = list(Donation.objects.values_list('project_id', 'user_id').distinct())
+
+        if sparse is not None:
+            scored = self._scores_sparse(projects, project_tags, project_donors)
+        else:
+            scored = self._scores_python(projects, project_tags, project_donors)
+
+        rows = []
+        with transaction.atomic():
+            SimilarProject.objects.all().delete()
+            for project_id, category_id, candidates in scored:
+                for similar_id, score in self._select(project_id, category_id, candidates, category_fill):
+                    rows.append(SimilarProject(project_id=project_id, similar_id=similar_id, score=score))
+                if len(rows) >= 5000:
+                    SimilarProject.objects.bulk_create(rows)
+                    rows = []
+            SimilarProject.objects.bulk_create(rows)
+        return SimilarProject.objects.count()
+
+    def _scores_sparse(self, projects, project_tags, project_donors):
+        """Yield ``(project_id, category_id, candidates)`` using sparse matrix products"""
+        ids = np.array([project_id for project_id, _, _ in projects])
+        index = {project_id: i for i, project_id in enumerate(ids.tolist())}
+        categories = np.array([-1 if category_id is None else category_id for _, category_id, _ in projects])
+        active = np.array([status == 'active' for _, _, status in projects])
+        n = len(ids)
+
+        def incidence(pairs):
+            # Binary project x item matrix plus each project's item count
+            if not pairs:
+                matrix = sparse.csr_matrix((n, 1))
+            else:
+                rows = [index[project_id] for project_id, _ in pairs]
+                items = {}
+                cols = [items.setdefault(item, len(items)) for _, item in pairs]
+                matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, len(items)))
+                matrix.data[:] = 1
+            return matrix, np.asarray(matrix.sum(axis=1)).ravel(), matrix.T.tocsr()
+
+        def jaccard(matrix, sizes, transposed, start, stop):
+            overlap = (matrix[start:stop] @ transposed).tocoo()
+            union = sizes[overlap.row + start] + sizes[overlap.col] - overlap.data
+            return sparse.csr_matrix(
+                (overlap.data / union, (overlap.row, overlap.col)), shape=(stop - start, n)
+            )
+
+        tags = incidence(project_tags)
+        donors = incidence(project_donors) if self.donor_weight > 0 else None
+
+        for start in range(0, n, CHUNK_SIZE):
+            stop = min(start + CHUNK_SIZE, n)
+            scores = jaccard(*tags, start, stop)
+            if donors is not None:
+                scores = scores + self.donor_weight * jaccard(*donors, start, stop)
+            scores = scores.tocsr()
+            for offset in range(stop - start):
+                i = start + offset
+                low, high = scores.indptr[offset], scores.indptr[offset + 1]
+                cols, values = scores.indices[low:high], scores.data[low:high].copy()
+                keep = active[cols] & (cols != i)
+                cols, values = cols[keep], values[keep]
+                if categories[i] >= 0:
+                    values += self.category_weight * (categories[cols] == categories[i])
+                if len(cols) > self.top_k:
+                    # Keep everything tied with the K-th best so _select breaks ties
+                    kth = -np.partition(-values, self.top_k - 1)[self.top_k - 1]
+                    top = values >= kth
+                    cols, values = cols[top], values[top]
+                candidates = list(zip(ids[cols].tolist(), values.tolist()))
+                yield int(ids[i]), projects[i][1], candidates
+
+    def _scores_python(self, projects, project_tags, project_donors):
+        """Yield ``(project_id, category_id, candidates)`` using inverted indexes"""
+        info = {project_id: (category_id, status) for project_id, category_id, status in projects}
+
+        def overlaps(pairs):
+            items_of, projects_of = defaultdict(set), defaultdict(set)
+            for project_id, item in pairs:
+                items_of[project_id].add(item)
+                projects_of[item].add(project_id)
+            return items_of, projects_of
+
+        def jaccard(project_id, items_of, projects_of):
+            own = items_of.get(project_id, ())
+            shared = Counter(other for item in own for other in projects_of[item])
+            return {
+                other: count / (len(own) + len(items_of[other]) - count)
+                for other, count in shared.items()
+            }
+
+        tags = overlaps(project_tags)
+        donors = overlaps(project_donors) if self.donor_weight > 0 else None
+
+        for project_id, category_id, _ in projects:
+            scores = jaccard(project_id, *tags)
+            if donors is not None:
+                for other, score in jaccard(project_id, *donors).items():
+                    scores[other] = scores.get(other, 0) + self.donor_weight * score
+            candidates = []
+            for other, score in scores.items():
+                other_category, other_status = info[other]
+                if other == project_id or other_status != 'active':
+                    continue
+                if category_id is not None and other_category == category_id:
+                    score += self.category_weight
+                candidates.append((other, score))
+            yield project_id, category_id, candidates
+
+    # Incremental updates
+
+    def _category_fill(self, category_id, exclude, count):
+        return list(
+            Project.objects.filter(category_id=category_id, status='active')
+            .exclude(pk__in=exclude)
+            .order_by('-start_time', '-id')
+            .values_list('id', flat=True)[:count]
+        )
+
+    def _list_stats(self):
+        """Annotations giving the size and lowest score of a project's stored list"""
+        rows = SimilarProject.objects.filter(project=OuterRef('pk')).order_by().values('project')
+        return {
+            'list_size': Coalesce(Subquery(rows.annotate(count=Count('id')).values('count')), Value(0)),
+            'list_min': Subquery(rows.annotate(low=Min('score')).values('low')),
+        }
+
+    def _overlap_scores(self, project):
+        """
+        Score ``project`` against every project sharing a tag or donor with it.
+
+        Returns ``{other_id: (score, status, list_size, list_min)}`` where the
+        category bonus is already included in the score and the last two
+        describe the other project's current stored list.
+        """
+        scores = defaultdict(float)
+        info = {}
+        own_tags = ProjectTag.objects.filter(project=project).values('tag_id')
+        own_tag_count = own_tags.count()
+        tag_counts = ProjectTag.objects.filter(project=OuterRef('pk')).order_by().values('project').annotate(
+            count=Count('id')
+        ).values('count')
+        tag_rows = (
+            Project.objects.filter(projecttag__tag_id__in=own_tags)
+            .exclude(pk=project.pk)
+            .annotate(shared=Count('projecttag'), total=Subquery(tag_counts), **self._list_stats())
+            .values_list('id', 'category_id', 'status', 'list_size', 'list_min', 'shared', 'total')
+        )
+        for other, category_id, status, size, low, shared, total in tag_rows:
+            scores[other] += shared / (own_tag_count + total - shared)
+            info[other] = (category_id, status, size, low)
+
+        if self.donor_weight > 0:
+            own_donors = Donation.objects.filter(project=project).values('user_id')
+            own_donor_count = own_donors.distinct().count()
+            donor_counts = Donation.objects.filter(project=OuterRef('pk')).order_by().values('project').annotate(
+                count=Count('user', distinct=True)
+            ).values('count')
+            donor_rows = (
+                Project.objects.filter(donation__user_id__in=own_donors)
+                .exclude(pk=project.pk)
+                .annotate(shared=Count('donation__user', distinct=True), total=Subquery(donor_counts), **self._list_stats())
+                .values_list('id', 'category_id', 'status', 'list_size', 'list_min', 'shared', 'total')
+            )
+            for other, category_id, status, size, low, shared, total in donor_rows:
+                scores[other] += self.donor_weight * shared / (own_donor_count + total - shared)
+                info[other] = (category_id, status, size, low)
+
+        result = {}
+        for other, score in scores.items():
+            category_id, status, size, low = info[other]
+            if project.category_id is not None and category_id == project.category_id:
+                score += self.category_weight
+            result[other] = (score, status, size, low)
+        return result
+
+    def compute_neighbours(self, project):
+        """Return ``project``'s top-K ``(similar_id, score)`` pairs"""
+        scores = self._overlap_scores(project)
+        candidates = [(other, score) for other, (score, status, _, _) in scores.items() if status == 'active']
+        return self._select(project.pk, project.category_id, candidates, self._category_fill)
+
+    def _store(self, project_id, neighbours):
+        SimilarProject.objects.filter(project_id=project_id).delete()
+        SimilarProject.objects.bulk_create([
+            SimilarProject(project_id=project_id, similar_id=similar_id, score=score)
+            for similar_id, score in neighbours
+        ])
+
+    def refresh_project(self, project):
+        """Recompute just ``project``'s own list"""
+        self._store(project.pk, self.compute_neighbours(project))
+
+    @transaction.atomic
+    def update_project(self, project):
+        """
+        Bring every list involving ``project`` up to date after its tags,
+        category or status changed.
+        """
+        scores = self._overlap_scores(project)
+        candidates = [(other, score) for other, (score, status, _, _) in scores.items() if status == 'active']
+        self._store(project.pk, self._select(project.pk, project.category_id, candidates, self._category_fill))
+
+        # Lists that held the project get recomputed from scratch, since its
+        # score to them may have dropped below their next best candidate
+        dropped = set(SimilarProject.objects.filter(similar=project).values_list('project_id', flat=True))
+        SimilarProject.objects.filter(similar=project).delete()
+        if project.status != 'active':
+            self._refresh_ids(dropped)
+            return
+
+        if project.category_id is not None and self.category_weight > 0:
+            # Same-category projects with no overlap only top up short lists,
+            # as in _select, whatever the scores already stored
+            category_rows = (
+                Project.objects.filter(category_id=project.category_id)
+                .exclude(pk=project.pk)
+                .annotate(**self._list_stats())
+                .filter(list_size__lt=self.top_k)
+                .values_list('id', 'status', 'list_size', 'list_min')
+            )
+            for other, status, size, low in category_rows:
+                scores.setdefault(other, (self.category_weight, status, size, low))
+
+        # Everywhere else the project only enters a list if it beats the weakest entry
+        added = []
+        for other, (score, _, size, low) in scores.items():
+            if other in dropped:
+                continue
+            if size < self.top_k or (low is not None and score > low):
+                added.append(SimilarProject(project_id=other, similar_id=project.pk, score=score))
+        SimilarProject.objects.bulk_create(added)
+        self._trim(row.project_id for row in added)
+        self._refresh_ids(dropped)
+
+    def remove_project(self, project_id, dropped):
+        """Refill the lists that contained a deleted project"""
+        self._refresh_ids(set(dropped) - {project_id})
+
+    def _refresh_ids(self, project_ids):
+        project_ids = list(project_ids)
+        for start in range(0, len(project_ids), 500):
+            for project in Project.objects.filter(pk__in=project_ids[start:start + 500]):
+                self.refresh_project(project)
+
+    def _trim(self, project_ids):
+        """Drop rows ranked below TOP_K in the given projects' lists"""
+        project_ids = list(project_ids)
+        for start in range(0, len(project_ids), 500):
+            ranked = SimilarProject.objects.filter(project_id__in=project_ids[start:start + 500]).annotate(
+                position=Window(RowNumber(), partition_by=[F('project_id')], order_by=[F('score').desc(), F('similar_id').desc()])
+            ).filter(position__gt=self.top_k)
+            SimilarProject.objects.filter(pk__in=[row.pk for row in ranked]).delete()
+
+
+def get_similarity_engine():
+    return SimilarityEngine()
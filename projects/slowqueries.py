@@ -0,0 +1,215 @@
+"""
+Slow query sampler.
+
+With ``SLOW_QUERIES['ENABLED']`` every database connection gets an execute
+wrapper that times its queries. A query over ``THRESHOLD`` seconds is
+recorded under its fingerprint, the SQL with literals, parameters and
+``IN (...)`` lists normalized away, so the same query with other values adds
+to one entry: how often it was slow, its total and worst time, which views
+ran it and, captured the first time it is seen, the database's plan for it
+(``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` elsewhere). A plan that says
+``SCAN projects_project`` rather than ``SEARCH ... USING INDEX`` is the
+usual culprit.
+
+Entries are kept in a ring buffer of ``BUFFER_SIZE`` fingerprints per
+process, the least recently slow one making room for a new one, and are
+listed at /admin/slow-queries/. Queries under the threshold only pay for
+two clock reads and a settings lookup.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib import admin
+from django.db import DatabaseError, transaction
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.utils import timezone
+
+DEFAULTS = {
+    'ENABLED': False,
+    # Seconds a query must take to be recorded
+    'THRESHOLD': 0.1,
+    # Distinct queries remembered
+    'BUFFER_SIZE': 100,
+}
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+PLACEHOLDER_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Statements that are explained; the plan of a write is rarely the problem
+EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+
+# Views the most time was spent for, shown per entry
+TOP_VIEWS = 3
+
+
+def get_slow_query_settings():
+    return {**DEFAULTS, **getattr(settings, 'SLOW_QUERIES', {})}
+
+
+def fingerprint(sql):
+    """(normalized SQL, short hash) shared by every run of the same query"""
+    normalized = STRING_RE.sub('?', sql).replace('%s', '?')
+    normalized = NUMBER_RE.sub('?', normalized)
+    normalized = PLACEHOLDER_LIST_RE.sub('(...)', normalized)
+    normalized = WHITESPACE_RE.sub(' ', normalized).strip()
+    return normalized, hashlib.sha1(normalized.encode()).hexdigest()[:12]
+
+
+class SlowQuery:
+    def __init__(self, fingerprint, sql):
+        self.fingerprint = fingerprint
+        self.sql = sql
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.views = Counter()
+        self.plan = None
+        self.last_seen = None
+
+    @property
+    def average_time(self):
+        return self.total_time / self.count if self.count else 0.0
+
+    def top_views(self):
+        return self.views.most_common(TOP_VIEWS)
+
+
+class SlowQueryLog:
+    """Ring buffer of slow queries by fingerprint"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, sql, duration, view, size):
+        """Add one slow run; returns the entry if it is new and needs a plan"""
+        normalized, digest = fingerprint(sql)
+        with self.lock:
+            entry = self.entries.get(digest)
+            new = entry is None
+            if new:
+                entry = self.entries[digest] = SlowQuery(digest, normalized)
+                while len(self.entries) > size:
+                    self.entries.popitem(last=False)
+            else:
+                self.entries.move_to_end(digest)
+            entry.count += 1
+            entry.total_time += duration
+            entry.max_time = max(entry.max_time, duration)
+            entry.views[view] += 1
+            entry.last_seen = timezone.now()
+        return entry if new else None
+
+    def snapshot(self):
+        """Entries, most total time first"""
+        with self.lock:
+            entries = list(self.entries.values())
+        return sorted(entries, key=lambda entry: entry.total_time, reverse=True)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+slow_query_log = SlowQueryLog()
+
+_request = ContextVar('slow_query_request', default=None)
+# Set while a plan is captured, so EXPLAIN isn't itself sampled
+_explaining = ContextVar('slow_query_explaining', default=False)
+
+
+def origin():
+    """The view running the current query"""
+    request = _request.get()
+    if request is None:
+        return '(no request)'
+    match = request.resolver_match
+    name = (match.url_name or match.view_name) if match else request.path
+    return f'{request.method} {name}'
+
+
+def fetch_plan(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+        return cursor.fetchall()
+
+
+def explain(connection, sql, params):
+    token = _explaining.set(True)
+    try:
+        if connection.in_atomic_block:
+            # In a savepoint, so a failed EXPLAIN doesn't break the transaction the query ran in
+            with transaction.atomic(using=connection.alias):
+                rows = fetch_plan(connection, sql, params)
+        else:
+            rows = fetch_plan(connection, sql, params)
+    except DatabaseError as e:
+        return f'EXPLAIN failed: {e}'
+    finally:
+        _explaining.reset(token)
+    if connection.vendor == 'sqlite':
+        # (id, parent, _, detail), indented by depth as the sqlite3 shell does
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        return '\n'.join(lines)
+    return '\n'.join(' | '.join(str(column) for column in row) for row in rows)
+
+
+def slow_query_sampler(execute, sql, params, many, context):
+    """Execute wrapper recording queries over the threshold"""
+    if _explaining.get():
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - start
+    config = get_slow_query_settings()
+    if duration >= config['THRESHOLD']:
+        entry = slow_query_log.record(sql, duration, origin(), config['BUFFER_SIZE'])
+        if entry is not None and not many and EXPLAINABLE_RE.match(sql):
+            entry.plan = explain(context['connection'], sql, params)
+    return result
+
+
+def install_sampler(sender, connection, **kwargs):
+    """connection_created receiver adding the sampler to new connections"""
+    if get_slow_query_settings()['ENABLED'] and slow_query_sampler not in connection.execute_wrappers:
+        connection.execute_wrappers.append(slow_query_sampler)
+
+
+class SlowQueryMiddleware:
+    """Lets the sampler tell which view ran a query"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            _request.reset(token)
+
+
+def slow_queries_view(request):
+    """Admin page listing the sampled slow queries"""
+    if request.method == 'POST':
+        slow_query_log.clear()
+        return redirect('slow_queries')
+    config = get_slow_query_settings()
+    return TemplateResponse(request, 'admin/slow_queries.html', {
+        **admin.site.each_context(request),
+        'title': 'Slow queries',
+        'entries': slow_query_log.snapshot(),
+        'config': config,
+    })
@@ -0,0 +1,70 @@
+"""
+Static file bundles.
+
+The site's CSS and JavaScript live in ``static/`` rather than inline in the
+templates, so browsers download them once instead of with every page.
+``CompressedManifestStaticFilesStorage`` is what ``collectstatic`` writes
+them with in production: each file is copied under a name containing a hash
+of its content (``css/home.4f1a2b3c9d8e.css``), so it can be cached for good
+and a changed file gets a new URL, and a ``.gz`` and, when the ``brotli``
+package is installed, ``.br`` copy is written next to every compressible
+file. ``projects.serving.serve_static`` (or the proxy's gzip_static /
+brotli_static) sends the copy the browser accepts.
+"""
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - exercised when brotli isn't installed
+    brotli = None
+
+# Text formats worth compressing; images and fonts are compressed already
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.map', '.json', '.svg', '.txt', '.html', '.xml'}
+
+# Below this many bytes the headers outweigh the saving
+MIN_SIZE = 256
+
+
+def compressors():
+    """(suffix, function) for each encoding files are precompressed with"""
+    available = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        available.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    return available
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted(set(self.hashed_files.values())):
+            for compressed_name in self.compress(name):
+                yield name, compressed_name, True
+
+    def compress(self, name):
+        """Write the precompressed copies of ``name``, returning their names"""
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            return []
+        written = []
+        data = None
+        for suffix, compress in compressors():
+            compressed_name = name + suffix
+            # The hash in the name means existing copies are of this exact content
+            if self.exists(compressed_name):
+                continue
+            if data is None:
+                with self.open(name) as f:
+                    data = f.read()
+                if len(data) < MIN_SIZE:
+                    return []
+            compressed = compress(data)
+            if len(compressed) >= len(data):
+                continue
+            self._save(compressed_name, ContentFile(compressed))
+            written.append(compressed_name)
+        return written
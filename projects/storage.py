@@ -0,0 +1,119 @@
+"""
+Content-addressed media storage.
+
+Every file is stored under the SHA-256 of its bytes, e.g.
+``blobs/9f/86/9f86d08...b0.jpg``, whatever field or ``upload_to`` it came
+from. Uploading the same image twice (a header used on two projects, a
+profile picture re-uploaded) keeps one copy on disk, and browsers that cached
+the URL once reuse it everywhere.
+
+``MediaBlob`` rows count the saves that returned each blob. ``delete``
+releases one reference and only removes the file when none are left, so
+deleting one project's image never breaks another project showing the same
+file. Files saved before this storage was enabled keep their names until
+``dedupe_media`` moves them into blobs.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+BLOBS_DIR = 'blobs'
+
+
+def content_hash(content):
+    """SHA-256 and size of a File, read in chunks"""
+    if getattr(content, 'sha256', None):
+        # Hashed while it was received; see projects.uploads
+        return content.sha256, content.size
+    digest = hashlib.sha256()
+    size = 0
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def blob_name(digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    return f'{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def is_blob(name):
+    return name.startswith(f'{BLOBS_DIR}/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Lets callers know a delete() only drops a reference
+    reference_counted = True
+
+    def _save(self, name, content):
+        from .models import MediaBlob
+        digest, size = content_hash(content)
+        name = blob_name(digest, name)
+        # One UPDATE when the content is already stored, which is the case dedupe makes common
+        if not MediaBlob.objects.filter(name=name).update(references=F('references') + 1):
+            try:
+                with transaction.atomic():
+                    MediaBlob.objects.create(name=name, sha256=digest, size=size, references=1)
+            except IntegrityError:
+                # Stored concurrently by another upload of the same content
+                MediaBlob.objects.filter(name=name).update(references=F('references') + 1)
+        # After the reference is held, so a concurrent last delete can't remove the file under us
+        if not self.exists(name):
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            self._write(name, content)
+        return name
+
+    def _write(self, name, content):
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        # Write aside and rename, so a reader never sees half a blob and
+        # two writers of the same content just replace each other's copy
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def delete(self, name):
+        """Release one reference to ``name``; the file goes when the last one does"""
+        from .models import MediaBlob
+        if not name:
+            raise ValueError('The name must be given to delete().')
+        if not is_blob(name):
+            # Not tracked, so whether anything else uses it is unknown; keep it
+            return
+        with transaction.atomic():
+            MediaBlob.objects.filter(name=name, references__gt=0).update(references=F('references') - 1)
+            if MediaBlob.objects.filter(name=name, references=0).delete()[0]:
+                super().delete(name)
+
+    def retain(self, name):
+        """Add a reference to an existing blob, as saving its content again would"""
+        from .models import MediaBlob
+        return MediaBlob.objects.filter(name=name).update(references=F('references') + 1) > 0
+
+    def delete_untracked(self, name):
+        """Remove a file saved before this storage was enabled"""
+        super().delete(name)
+
+    def references(self, name):
+        from .models import MediaBlob
+        return MediaBlob.objects.filter(name=name).values_list('references', flat=True).first() or 0
@@ -0,0 +1,58 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+register = template.Library()
+
+# The rendered width of each derivative size in our layouts, for the sizes attribute
+SIZES_ATTR = {
+    'card': '(max-width: 600px) 100vw, 400px',
+    'gallery': '(max-width: 1000px) 100vw, 960px',
+    'full': '100vw',
+}
+
+
+def srcset(image, entries, fmt):
+    """``url width`` pairs for every stored width of the image in ``fmt``"""
+    widths = {}
+    for entry in entries.values():
+        if entry.get(fmt):
+            widths[entry['width']] = image.storage.url(entry[fmt])
+    return ', '.join(f'{url} {width}w' for width, url in sorted(widths.items()))
+
+
+@register.simple_tag
+def picture(image, size='card', sizes=None, **attrs):
+    """
+    Render a ResponsiveImageField file as a ``<picture>`` with WebP and JPEG
+    ``srcset``s, falling back to a plain ``<img>`` of the original upload.
+
+    Usage: {% picture project.get_main_image "card" alt=project.title class="project-image" %}
+    """
+    if not image:
+        return ''
+    attrs.setdefault('alt', '')
+    attrs.setdefault('loading', 'lazy')
+    entries = (getattr(image, 'variants', None) or {}).get('sizes')
+    if not entries:
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+
+    default = entries.get(size) or next(iter(entries.values()))
+    sizes = sizes or SIZES_ATTR.get(size, '100vw')
+    webp = srcset(image, entries, 'webp')
+    source = format_html('<source type="image/webp" srcset="{}" sizes="{}">', webp, sizes) if webp else ''
+    # display: contents keeps existing CSS that targets the <img> laying out as before
+    return format_html(
+        '<picture style="display: contents;">{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        source, image.storage.url(default['jpeg']), srcset(image, entries, 'jpeg'), sizes, flatatt(attrs),
+    )
+
+
+@register.simple_tag
+def image_url(image, size='card', fmt='webp'):
+    """URL of one derivative of ``image``, or of the original if there is none"""
+    if not image:
+        return ''
+    if hasattr(image, 'variant_url'):
+        return image.variant_url(size, fmt)
+    return image.url
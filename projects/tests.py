@@ -1,14 +1,90 @@
-from django.test import TestCase, Client
+from asgiref.sync import sync_to_async
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from .models import Project, Category
+from .models import Project, Category, Comment, Donation, DonationDay, MediaBlob, ProjectImage, ProjectRating, SimilarProject, Tag
+from django.core.cache import cache
+from django.db import OperationalError, connection, router, transaction
+from django.http import HttpResponse
+from django.db.models import Count, Sum
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .images import variant_names, wait_for_image_processing
+from .donations import DonationBuffer, DonationError, PendingDonation, donate, parse_amount
+from .pagination import CURSOR_PARAM, KeysetPaginator
+from .querystats import log_queries
+from . import benchmark, urls as projects_urls
+from accounts import urls as accounts_urls
+from accounts.models import ActivationToken
+from .rails import RAIL_SIZE, RAILS, get_rail
+from .routing import PIN_COOKIE, ReplicaRoutingMiddleware, read_replica, use_primary
+from .search import get_search_backend, search_projects
+from .uploads import StreamingUploadHandler
+from .views import COMMENT_ORDERING, REPLY_ORDERING
+from .similarity import SimilarityEngine
+from .slowqueries import fingerprint, slow_query_log, slow_query_sampler
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from decimal import Decimal
 from datetime import datetime, timedelta
+from collections import defaultdict
+from contextlib import closing
+from concurrent.futures import Future
+from io import BytesIO, StringIO
+from unittest import mock
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import tempfile
+
+from PIL import Image
 
 User = get_user_model()
 
+# Password of the users make_user() creates
+PASSWORD = 'testpass123'
+
+# Smallest valid GIF, for upload tests
+TINY_GIF = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00'
+    b'\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+
+
+def make_user(username, **fields):
+    """An active user who can log in with the shared test password"""
+    return User.objects.create_user(username=username, password=PASSWORD, **{'is_active': True, **fields})
+
+
+def make_project(owner, title, tags=None, hours=0, **fields):
+    """A project that started ``hours`` ago and runs for 30 days; ``fields`` override the defaults"""
+    now = timezone.now()
+    project = Project.objects.create(owner=owner, title=title, **{
+        'details': f'{title} details',
+        'total_target': Decimal('100.00'),
+        'start_time': now - timedelta(hours=hours),
+        'end_time': now + timedelta(days=30),
+        **fields,
+    })
+    if tags:
+        project.set_tags(tags)
+    return project
+
+
 class SearchTestCase(TestCase):
     def setUp(self):
+        # Home page rails are cached across tests
+        cache.clear()
         # Create test user
         self.user = User.objects.create_user(
             username='testuser',
@@ -31,10 +107,10 @@ class SearchTestCase(TestCase):
             details='This is a test project about technology',
             category=self.category,
             total_target=Decimal('1000.00'),
-            tags='technology python django',
             start_time=datetime.now(),
             end_time=datetime.now() + timedelta(days=30)
         )
+        self.project1.set_tags(['technology', 'python', 'django'])
         
         self.project2 = Project.objects.create(
             owner=self.user,
@@ -42,10 +118,10 @@ class SearchTestCase(TestCase):
             details='This is another project about art',
             category=self.category,
             total_target=Decimal('500.00'),
-            tags='art design',
             start_time=datetime.now(),
             end_time=datetime.now() + timedelta(days=30)
         )
+        self.project2.set_tags(['art', 'design'])
         
         self.client = Client()
     
@@ -105,3 +181,1906 @@ class SearchTestCase(TestCase):
         response = self.client.get(reverse('home'), {'search': 'technology'})
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Test Project 1')
+
+    def test_search_without_words(self):
+        """Test that punctuation-only searches return no results instead of failing"""
+        self.client.login(username='testuser', password='testpass123')
+        for backend in ['projects.search.SqliteFTS5SearchBackend', 'projects.search.BasicSearchBackend']:
+            get_search_backend.cache_clear()
+            with self.settings(PROJECT_SEARCH_BACKEND=backend):
+                for query in ['"', '  ', '*!']:
+                    response = self.client.get(reverse('all_projects'), {'search': query})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(self.client.get(reverse('home'), {'search': query}).status_code, 200)
+                response = self.client.get(reverse('search_suggestions'), {'q': '""'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['projects'], [])
+        get_search_backend.cache_clear()
+
+
+class SearchIndexTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='indexuser',
+            password='testpass123',
+            first_name='Ada',
+            last_name='Lovelace'
+        )
+        self.category = Category.objects.create(name='Science')
+        self.project = Project.objects.create(
+            owner=self.user,
+            title='Analytical Engine',
+            details='A general purpose mechanical computer',
+            category=self.category,
+            total_target=Decimal('1000.00'),
+            start_time=datetime.now(),
+            end_time=datetime.now() + timedelta(days=30)
+        )
+        self.project.set_tags(['startup', 'engines'])
+
+    def search(self, query):
+        return list(search_projects(Project.objects.all(), query))
+
+    def test_project_edits_are_indexed(self):
+        """Test that saving a project updates the index"""
+        self.assertEqual(self.search('analytical'), [self.project])
+        self.project.title = 'Difference Engine'
+        self.project.save()
+        self.assertEqual(self.search('analytical'), [])
+        self.assertEqual(self.search('difference'), [self.project])
+
+    def test_prefix_and_word_matching(self):
+        """Test that words match by prefix but not by inner substring"""
+        self.assertEqual(self.search('mech'), [self.project])
+        self.assertEqual(self.search('art'), [])
+
+    def test_category_rename_is_indexed(self):
+        """Test that renaming a category reindexes its projects"""
+        self.category.name = 'Mathematics'
+        self.category.save()
+        self.assertEqual(self.search('mathematics'), [self.project])
+        self.assertEqual(self.search('science'), [])
+
+    def test_category_delete_is_indexed(self):
+        """Test that deleting a category drops it from indexed projects"""
+        self.category.delete()
+        self.assertEqual(self.search('science'), [])
+        self.assertEqual(self.search('analytical'), [self.project])
+
+    def test_owner_rename_is_indexed(self):
+        """Test that changing the owner's name reindexes their projects"""
+        self.user.last_name = 'Byron'
+        self.user.save()
+        self.assertEqual(self.search('byron'), [self.project])
+        self.assertEqual(self.search('lovelace'), [])
+
+    def test_deleted_project_is_unindexed(self):
+        """Test that deleted projects disappear from search"""
+        self.project.delete()
+        self.assertEqual(self.search('analytical'), [])
+
+    def test_rebuild_command(self):
+        """Test that the rebuild command restores a wiped index"""
+        get_search_backend().remove_projects([self.project.pk])
+        self.assertEqual(self.search('analytical'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('analytical'), [self.project])
+
+    def test_relevance_prefers_title_matches(self):
+        """Test that title matches rank above detail matches"""
+        other = Project.objects.create(
+            owner=self.user,
+            title='Loom',
+            details='Punched cards borrowed from the analytical tradition',
+            category=self.category,
+            total_target=Decimal('10.00'),
+            start_time=datetime.now(),
+            end_time=datetime.now() + timedelta(days=30)
+        )
+        results = search_projects(Project.objects.all(), 'analytical').order_by('-relevance')
+        self.assertEqual(list(results), [self.project, other])
+
+
+class CardStatsTestCase(TestCase):
+    def setUp(self):
+        self.user = make_user('carduser')
+        self.donor = make_user('donor')
+        self.category = Category.objects.create(name='Music')
+
+    def create_project(self, title, with_stats=True):
+        project = make_project(self.user, title, category=self.category, total_target=Decimal('200.00'), tags=['card'])
+        if with_stats:
+            Donation.objects.create(user=self.donor, project=project, amount=Decimal('30.00'))
+            Donation.objects.create(user=self.user, project=project, amount=Decimal('20.00'))
+            ProjectRating.objects.create(user=self.donor, project=project, rating=5)
+            ProjectRating.objects.create(user=self.user, project=project, rating=2)
+            ProjectImage.objects.create(project=project, image='project_images/second.jpg')
+            ProjectImage.objects.create(project=project, image='project_images/primary.jpg', is_primary=True)
+        return project
+
+    def test_annotations_match_model_methods(self):
+        """Test that annotated values agree with the unannotated methods"""
+        project = self.create_project('Annotated')
+        project.refresh_from_db()
+        annotated = Project.objects.with_card_stats().get(pk=project.pk)
+        for method in ['get_total_donations', 'get_donation_count', 'get_average_rating',
+                       'get_rating_count', 'get_donation_percentage']:
+            self.assertEqual(getattr(annotated, method)(), getattr(project, method)(), method)
+        self.assertEqual(annotated.get_main_image().name, 'project_images/primary.jpg')
+
+    def test_annotations_without_related_rows(self):
+        """Test the annotated defaults for a project with no activity"""
+        project = Project.objects.with_card_stats().get(pk=self.create_project('Empty', with_stats=False).pk)
+        self.assertEqual(project.get_total_donations(), 0)
+        self.assertEqual(project.get_donation_count(), 0)
+        self.assertEqual(project.get_average_rating(), 0)
+        self.assertEqual(project.get_rating_count(), 0)
+        self.assertIsNone(project.get_main_image())
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_listing_query_count_is_constant(self):
+        """Test that adding cards does not add queries to listing pages"""
+        self.client.login(username='carduser', password='testpass123')
+        self.create_project('First')
+        urls = [reverse('all_projects'), reverse('my_projects'), reverse('home'), reverse('profile')]
+        baseline = [self.count_queries(url) for url in urls]
+        for i in range(5):
+            self.create_project(f'More {i}')
+        self.assertEqual([self.count_queries(url) for url in urls], baseline)
+
+
+class ProjectCounterTestCase(TestCase):
+    def setUp(self):
+        self.user = make_user('owner')
+        self.donor = make_user('counterdonor')
+        self.project = make_project(self.user, 'Counted')
+        self.other = make_project(self.user, 'Other')
+
+    def assertCounters(self, project, donation_total, donation_count, rating_sum, rating_count):
+        project.refresh_from_db()
+        self.assertEqual(
+            (project.donation_total, project.donation_count, project.rating_sum, project.rating_count),
+            (Decimal(donation_total), donation_count, rating_sum, rating_count)
+        )
+
+    def test_donation_counters(self):
+        """Test that donation writes keep the totals in step"""
+        first = Donation.objects.create(user=self.donor, project=self.project, amount=Decimal('10.50'))
+        Donation.objects.create(user=self.user, project=self.project, amount=Decimal('4.50'))
+        self.assertCounters(self.project, '15.00', 2, 0, 0)
+        self.assertEqual(self.project.get_donation_percentage(), Decimal('15'))
+
+        first.amount = Decimal('20.50')
+        first.save()
+        self.assertCounters(self.project, '25.00', 2, 0, 0)
+
+        first.project = self.other
+        first.save()
+        self.assertCounters(self.project, '4.50', 1, 0, 0)
+        self.assertCounters(self.other, '20.50', 1, 0, 0)
+
+        first.delete()
+        self.assertCounters(self.other, '0', 0, 0, 0)
+
+    def test_rating_counters(self):
+        """Test that rating writes keep the average in step"""
+        rating = ProjectRating.objects.create(user=self.donor, project=self.project, rating=5)
+        ProjectRating.objects.create(user=self.user, project=self.project, rating=2)
+        self.assertCounters(self.project, '0', 0, 7, 2)
+        self.assertEqual(self.project.get_average_rating(), 3.5)
+
+        rating.rating = 3
+        rating.save()
+        self.assertCounters(self.project, '0', 0, 5, 2)
+
+        rating.delete()
+        self.assertCounters(self.project, '0', 0, 2, 1)
+        self.assertEqual(list(Project.objects.top_rated()), [self.project])
+
+    def test_stale_project_save_keeps_counters(self):
+        """Test that saving an old project instance does not undo donations"""
+        stale = Project.objects.get(pk=self.project.pk)
+        Donation.objects.create(user=self.donor, project=self.project, amount=Decimal('30.00'))
+        stale.status = 'cancelled'
+        stale.save()
+        self.assertCounters(self.project, '30.00', 1, 0, 0)
+
+    def test_recompute_command(self):
+        """Test that the command repairs counters after bulk writes"""
+        Donation.objects.bulk_create([
+            Donation(user=self.donor, project=self.project, amount=Decimal('1.25'))
+            for _ in range(4)
+        ])
+        ProjectRating.objects.bulk_create([ProjectRating(user=self.donor, project=self.other, rating=4)])
+        self.assertCounters(self.project, '0', 0, 0, 0)
+        call_command('recompute_project_counters', batch_size=1, stdout=StringIO())
+        self.assertCounters(self.project, '5.00', 4, 0, 0)
+        self.assertCounters(self.other, '0', 0, 4, 1)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user = make_user('pager')
+        start = timezone.now()
+        self.projects = []
+        for i in range(7):
+            self.projects.append(Project.objects.create(
+                owner=self.user,
+                title=f'Garden {i}' if i % 2 else f'Orchard {i}',
+                details='Community garden project',
+                total_target=Decimal('100.00'),
+                # Pairs of projects share a start time to exercise the id tie-break
+                start_time=start - timedelta(days=i // 2),
+                end_time=start + timedelta(days=30)
+            ))
+
+    def walk(self, queryset, ordering, per_page=3):
+        paginator = KeysetPaginator(queryset, ordering, per_page)
+        pages = [paginator.get_page()]
+        while pages[-1].has_next:
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        return [[project.pk for project in page] for page in pages]
+
+    def test_pages_cover_listing_in_order(self):
+        """Test that walking the cursors yields every project exactly once"""
+        pages = self.walk(Project.objects.all(), ['-start_time', 'id'])
+        expected = list(Project.objects.order_by('-start_time', 'id').values_list('pk', flat=True))
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_search_pages_follow_relevance(self):
+        """Test cursor pagination over relevance-ranked search results"""
+        results = search_projects(Project.objects.all(), 'garden')
+        ordering = ['-relevance', '-start_time', 'id']
+        expected = list(results.order_by(*ordering).values_list('pk', flat=True))
+        self.assertEqual(sum(self.walk(results, ordering, per_page=2), []), expected)
+
+    def test_invalid_cursor_returns_first_page(self):
+        """Test that a tampered cursor falls back to the first page"""
+        paginator = KeysetPaginator(Project.objects.all(), ['-start_time', 'id'], 3)
+        first = paginator.get_page()
+        self.assertEqual(list(paginator.get_page('garbage')), list(first))
+        self.assertTrue(paginator.get_page('garbage').is_first)
+
+    def test_listing_view_pages(self):
+        """Test that a short listing renders on one page without a next link"""
+        response = self.client.get(reverse('all_projects'))
+        self.assertEqual(len(response.context['projects']), 7)
+        self.assertNotContains(response, 'Next Page')
+
+    def test_deep_pages_cost_the_same(self):
+        """Test that later pages issue the same queries as the first"""
+        paginator = KeysetPaginator(Project.objects.all(), ['-start_time', 'id'], 2)
+        with CaptureQueriesContext(connection) as first:
+            page = paginator.get_page()
+        while page.has_next:
+            with CaptureQueriesContext(connection) as later:
+                page = paginator.get_page(page.next_cursor)
+            self.assertEqual(len(later), len(first))
+            self.assertNotIn('OFFSET', later[0]['sql'])
+
+
+class TagTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('tagger')
+        self.category = Category.objects.create(name='Arts')
+        self.art = self.create_project('Mural', ['art', 'community'])
+        self.startup = self.create_project('Launchpad', ['startup', 'community'])
+
+    def create_project(self, title, tags):
+        # Similar projects are updated when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_project(self.user, title, category=self.category, tags=tags)
+
+    def test_parse(self):
+        """Test that free-text tags are normalized and deduplicated"""
+        self.assertEqual(Tag.parse(' #Art, design  art\tMusic '), ['art', 'design', 'music'])
+        self.assertEqual(Tag.parse(''), [])
+
+    def test_tag_filter_is_exact(self):
+        """Test that filtering by a tag no longer matches substrings"""
+        response = self.client.get(reverse('all_projects'), {'tag': 'art'})
+        self.assertEqual(list(response.context['projects']), [self.art])
+
+    def test_facets(self):
+        """Test tag facet counts on the listing page"""
+        response = self.client.get(reverse('all_projects'))
+        facets = [(tag.name, tag.project_count) for tag in response.context['tag_facets']]
+        self.assertEqual(facets, [('community', 2), ('art', 1), ('startup', 1)])
+
+    def test_facets_follow_search(self):
+        """Test that facets only count projects in the search results"""
+        response = self.client.get(reverse('all_projects'), {'search': 'mural'})
+        facets = [tag.name for tag in response.context['tag_facets']]
+        self.assertEqual(facets, ['art', 'community'])
+
+    def test_form_saves_tags(self):
+        """Test creating a project with tags through the form"""
+        self.client.login(username='tagger', password='testpass123')
+        image = SimpleUploadedFile('tiny.gif', TINY_GIF, content_type='image/gif')
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            response = self.client.post(reverse('create_project'), {
+                'title': 'Tagged',
+                'details': 'Created through the form',
+                'category': self.category.pk,
+                'total_target': '50.00',
+                'tags': 'Solar, #energy solar',
+                'start_time': '2030-01-01T10:00',
+                'end_time': '2030-02-01T10:00',
+                'image': image,
+            })
+        project = Project.objects.get(title='Tagged')
+        self.assertRedirects(response, reverse('project_detail', args=[project.pk]))
+        self.assertEqual([tag.name for tag in project.tags.all()], ['energy', 'solar'])
+        self.assertEqual(list(search_projects(Project.objects.all(), 'energy')), [project])
+
+    def test_similar_projects_share_tags(self):
+        """Test that similar projects are ranked by shared tags"""
+        closest = self.create_project('Street Art', ['art', 'community'])
+        self.assertEqual(self.art.get_similar_projects(limit=2), [closest, self.startup])
+
+
+@override_settings(PROJECT_SIMILARITY={'TOP_K': 3, 'CATEGORY_WEIGHT': 0.35})
+class SimilarProjectsTestCase(TestCase):
+    def setUp(self):
+        self.user = make_user('similar')
+        self.categories = [Category.objects.create(name=f'Category {i}') for i in range(3)]
+        self.random = random.Random(42)
+        self.tags = [f'tag{i}' for i in range(8)]
+        self.projects = [self.create_project(i) for i in range(24)]
+
+    def create_project(self, i):
+        # Similar projects are updated when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return make_project(
+                self.user,
+                f'Similar {i}',
+                hours=i,
+                category=self.random.choice(self.categories + [None]),
+                status=self.random.choice(['active', 'active', 'active', 'cancelled']),
+                tags=self.random.sample(self.tags, self.random.randint(0, 4)),
+            )
+
+    def stored_scores(self):
+        """Each project's neighbour scores, which are unique up to ties"""
+        scores = defaultdict(list)
+        for row in SimilarProject.objects.all():
+            scores[row.project_id].append(round(row.score, 9))
+        return {project_id: sorted(values) for project_id, values in scores.items()}
+
+    def assertMatchesRebuild(self):
+        incremental = self.stored_scores()
+        SimilarityEngine().rebuild()
+        self.assertEqual(incremental, self.stored_scores())
+        with mock.patch('projects.similarity.sparse', None):
+            SimilarityEngine().rebuild()
+        self.assertEqual(incremental, self.stored_scores())
+
+    def test_incremental_updates_match_rebuild(self):
+        """Test that signal-driven updates agree with a full rebuild"""
+        self.assertMatchesRebuild()
+        for project in self.random.sample(self.projects, 8):
+            with self.captureOnCommitCallbacks(execute=True):
+                project.category = self.random.choice(self.categories + [None])
+                project.status = self.random.choice(['active', 'cancelled'])
+                project.save()
+                project.set_tags(self.random.sample(self.tags, self.random.randint(0, 4)))
+        self.projects[0].delete()
+        self.assertMatchesRebuild()
+
+    def test_neighbours_are_active_and_ranked(self):
+        """Test that stored neighbours exclude inactive projects and come best first"""
+        project = next(p for p in self.projects if p.get_similar_projects())
+        similar = project.get_similar_projects()
+        self.assertLessEqual(len(similar), 3)
+        self.assertTrue(all(p.status == 'active' and p != project for p in similar))
+        scores = [project.similar_rows.get(similar=p).score for p in similar]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_detail_reads_neighbours_in_one_query(self):
+        """Test that reading neighbours is a single query plus the tag prefetch"""
+        project = self.projects[1]
+        with self.assertNumQueries(2):
+            similar = project.get_similar_projects()
+            [list(p.tags.all()) for p in similar]
+
+    def test_cancelled_project_leaves_lists(self):
+        """Test that cancelling a project removes it from other lists"""
+        project = next(p for p in self.projects if p.neighbour_of.exists())
+        project.status = 'cancelled'
+        with self.captureOnCommitCallbacks(execute=True):
+            project.save()
+        self.assertFalse(project.neighbour_of.exists())
+
+    def test_updates_coalesce_until_commit(self):
+        """Test that a save and its tag changes update each project's neighbours once, at commit"""
+        with mock.patch.object(SimilarityEngine, 'update_project', autospec=True) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                project = make_project(self.user, 'Coalesced', tags=['tag1', 'tag2'])
+                project.set_tags(['tag3'])
+                self.assertFalse(update.called)
+            self.assertEqual([call.args[1] for call in update.call_args_list], [project])
+
+            update.reset_mock()
+            tag = Tag.objects.create(name='coalesced')
+            with self.captureOnCommitCallbacks(execute=True):
+                tag.projects.add(*self.projects[:3])
+                tag.projects.remove(self.projects[0])
+            self.assertCountEqual([call.args[1] for call in update.call_args_list], self.projects[:3])
+
+    def test_rebuild_command(self):
+        """Test the rebuild management command"""
+        SimilarProject.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_similar_projects', stdout=out)
+        self.assertIn('Stored', out.getvalue())
+        self.assertTrue(SimilarProject.objects.exists())
+
+
+class HomeRailsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('railuser')
+        self.rater = make_user('rater')
+        self.projects = [make_project(self.user, f'Rail {i}', hours=i) for i in range(3)]
+
+    def test_cached_home_page_skips_project_queries(self):
+        """Test that a warm home page does not query projects or ratings"""
+        self.client.login(username='railuser', password='testpass123')
+        self.client.get(reverse('home'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        self.assertEqual(list(response.context['latest_projects']), self.projects)
+        self.assertFalse([q['sql'] for q in queries if 'projects_' in q['sql']])
+
+    def test_changes_invalidate_after_commit(self):
+        """Test that ratings, cancellations and new projects refresh the rails"""
+        get_rail('top')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProjectRating.objects.create(user=self.rater, project=self.projects[2], rating=4)
+        self.assertEqual(get_rail('top'), [self.projects[2]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.projects[0].status = 'cancelled'
+            self.projects[0].save()
+        self.assertNotIn(self.projects[0], get_rail('latest'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new = make_project(self.user, 'Featured', featured=True)
+        self.assertEqual(get_rail('featured'), [new])
+        self.assertEqual(get_rail('latest')[0], new)
+
+    def test_donation_refreshes_card(self):
+        """Test that funding shown on a cached card stays current"""
+        get_rail('latest')
+        with self.captureOnCommitCallbacks(execute=True):
+            Donation.objects.create(user=self.rater, project=self.projects[1], amount=Decimal('30.00'))
+        card = get_rail('latest')[1]
+        self.assertEqual(card.get_total_donations(), Decimal('30.00'))
+
+    def test_unrelated_edit_keeps_cache(self):
+        """Test that editing a project outside every rail leaves them cached"""
+        cancelled = make_project(self.user, 'Hidden', status='cancelled')
+        get_rail('latest')
+        with self.captureOnCommitCallbacks(execute=True):
+            cancelled.title = 'Still hidden'
+            cancelled.save()
+        with self.assertNumQueries(0):
+            get_rail('latest')
+
+    def test_stale_rail_served_while_rebuilding(self):
+        """Test that only the lock holder rebuilds an invalidated rail"""
+        stale = get_rail('latest')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_project(self.user, 'Newest')
+        cache.add('home-rails:latest:lock', 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_rail('latest'), stale)
+        cache.delete('home-rails:latest:lock')
+        self.assertEqual(get_rail('latest')[0].title, 'Newest')
+
+
+class CommentThreadTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('commenter', first_name='Com')
+        self.project = make_project(self.user, 'Discussed')
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(project=self.project, user=self.user, content=content, parent=parent)
+
+    def test_paths(self):
+        """Test that paths encode the ancestry"""
+        top = self.comment('Top')
+        reply = self.comment('Reply', parent=top)
+        nested = self.comment('Nested', parent=reply)
+        self.assertEqual(top.path, f'{top.pk:010d}/')
+        self.assertEqual(nested.path, f'{top.pk:010d}/{reply.pk:010d}/{nested.pk:010d}/')
+        self.assertEqual([top.depth, reply.depth, nested.depth], [0, 1, 2])
+        self.assertEqual(list(top.get_descendants()), [reply, nested])
+
+    def test_moving_comment_moves_replies(self):
+        """Test that re-parenting a comment rewrites its subtree"""
+        first, second = self.comment('First'), self.comment('Second')
+        reply = self.comment('Reply', parent=first)
+        nested = self.comment('Nested', parent=reply)
+        reply.parent = second
+        reply.save()
+        nested.refresh_from_db()
+        self.assertTrue(nested.path.startswith(second.path))
+        self.assertEqual(list(second.get_descendants()), [reply, nested])
+
+    def test_thread(self):
+        """Test that the thread is assembled in one query with the right order"""
+        older, newer = self.comment('Older'), self.comment('Newer')
+        Comment.objects.filter(pk=older.pk).update(timestamp=timezone.now() - timedelta(hours=1))
+        first = self.comment('First reply', parent=older)
+        second = self.comment('Second reply', parent=older)
+        nested = self.comment('Nested', parent=first)
+        with self.assertNumQueries(1):
+            thread = self.project.comment_set.thread()
+            self.assertEqual(thread, [newer, older])
+            self.assertEqual(thread[1].get_replies(), [first, second])
+            self.assertEqual(thread[1].get_reply_count(), 2)
+            self.assertEqual(thread[1].get_replies()[0].get_replies(), [nested])
+            self.assertEqual(nested.user.first_name, 'Com')
+
+    def test_detail_query_count_is_constant(self):
+        """Test that more comments and replies do not add queries to the detail page"""
+        url = reverse('project_detail', args=[self.project.pk])
+        self.comment('Only')
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            return len(queries), response
+
+        baseline, _ = count_queries()
+        for i in range(5):
+            top = self.comment(f'Top {i}')
+            reply = self.comment(f'Reply {i}', parent=top)
+            self.comment(f'Deep reply {i}', parent=reply)
+        queries, response = count_queries()
+        self.assertEqual(queries, baseline)
+        self.assertContains(response, 'Top 4')
+        # Replies are left to the comment API
+        self.assertContains(response, 'Show replies (1)')
+        self.assertNotContains(response, 'Reply 4')
+
+
+class CommentApiTestCase(TestCase):
+    def setUp(self):
+        self.user = make_user('apicommenter')
+        self.project = make_project(self.user, 'Busy thread')
+        now = timezone.now()
+        self.comments = []
+        for i in range(25):
+            comment = Comment.objects.create(project=self.project, user=self.user, content=f'Comment {i}')
+            # Some share a timestamp so the id tie-breaker is exercised
+            Comment.objects.filter(pk=comment.pk).update(timestamp=now - timedelta(minutes=i // 2))
+            self.comments.append(comment)
+
+    def test_comment_pages(self):
+        """Test paging through top-level comments newest first"""
+        url = reverse('comment_list_api', args=[self.project.pk])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['comments']), 20)
+        second = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertIsNone(second['next_cursor'])
+        contents = [c['content'] for c in first['comments'] + second['comments']]
+        self.assertEqual(contents, [f'Comment {i}' for i in range(25)])
+
+    def test_replies(self):
+        """Test that replies load oldest first with their own reply counts"""
+        parent = self.comments[0]
+        replies = [Comment.objects.create(project=self.project, user=self.user, content=f'Reply {i}', parent=parent)
+                   for i in range(3)]
+        Comment.objects.create(project=self.project, user=self.user, content='Nested', parent=replies[1])
+        with self.assertNumQueries(1):
+            data = self.client.get(reverse('comment_replies_api', args=[parent.pk])).json()
+        self.assertEqual([c['content'] for c in data['comments']], ['Reply 0', 'Reply 1', 'Reply 2'])
+        self.assertEqual([c['reply_count'] for c in data['comments']], [0, 1, 0])
+        self.assertEqual(data['comments'][1]['replies_url'], reverse('comment_replies_api', args=[replies[1].pk]))
+        top = self.client.get(reverse('comment_list_api', args=[self.project.pk])).json()['comments'][0]
+        self.assertEqual(top['reply_count'], 3)
+
+    def test_thread(self):
+        """Test that a comment's whole subtree loads in bounded queries however deep it goes"""
+        parent = self.comments[0]
+        replies = [Comment.objects.create(project=self.project, user=self.user, content=f'Reply {i}', parent=parent)
+                   for i in range(2)]
+        deepest = replies[0]
+        for depth in range(10):
+            deepest = Comment.objects.create(project=self.project, user=self.user, content=f'Depth {depth}', parent=deepest)
+        url = reverse('comment_thread_api', args=[parent.pk])
+        with self.assertNumQueries(2):
+            data = self.client.get(url).json()
+        self.assertEqual([c['content'] for c in data['comments']], ['Reply 0', 'Reply 1'])
+        self.assertEqual([c['reply_count'] for c in data['comments']], [1, 0])
+        node, contents = data['comments'][0], []
+        while node['replies']:
+            node = node['replies'][0]
+            contents.append(node['content'])
+        self.assertEqual(contents, [f'Depth {depth}' for depth in range(10)])
+        self.assertEqual(self.client.get(reverse('comment_thread_api', args=[deepest.pk + 1])).status_code, 404)
+
+    def test_detail_renders_first_page(self):
+        """Test that the detail page renders one page and links to the next"""
+        response = self.client.get(reverse('project_detail', args=[self.project.pk]))
+        self.assertContains(response, 'Comments (25)')
+        self.assertContains(response, '>Comment 19<')
+        self.assertNotContains(response, '>Comment 20<')
+        self.assertContains(response, 'id="load-more-comments"')
+        response = self.client.get(reverse('project_detail', args=[self.project.pk]),
+                                   {'cursor': response.context['comments'].next_cursor})
+        self.assertContains(response, '>Comment 24<')
+
+
+class DonationServiceTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('donor')
+        self.project = make_project(self.user, 'Fundraiser', total_target=Decimal('1000.00'))
+
+    def test_parse_amount(self):
+        """Test Decimal validation of submitted amounts"""
+        self.assertEqual(parse_amount('10'), Decimal('10.00'))
+        self.assertEqual(parse_amount(' 12.50 '), Decimal('12.50'))
+        for value in ['', 'abc', None, 'NaN', 'Infinity', '0.50', '-5', '10.001', '100000000', '1e30', '-1e30', '1e-30']:
+            with self.assertRaises(DonationError, msg=value):
+                parse_amount(value)
+
+    def test_idempotency_key(self):
+        """Test that replaying a key returns the original donation"""
+        first, created = donate(self.user, self.project, '25.00', 'key-1')
+        self.assertTrue(created)
+        again, created = donate(self.user, self.project, '25.00', 'key-1')
+        self.assertFalse(created)
+        self.assertEqual(again, first)
+        donate(self.user, self.project, '5.00')
+        donate(self.user, self.project, '5.00')
+        self.project.refresh_from_db()
+        self.assertEqual((self.project.donation_count, self.project.donation_total), (3, Decimal('35.00')))
+
+    def test_cancelled_project(self):
+        """Test that cancelled projects refuse donations"""
+        self.project.status = 'cancelled'
+        self.project.save()
+        with self.assertRaises(DonationError):
+            donate(self.user, self.project, '10')
+
+    def test_double_submit(self):
+        """Test that submitting the donate form twice records one donation"""
+        self.client.login(username='donor', password='testpass123')
+        url = reverse('donate', args=[self.project.pk])
+        key = self.client.get(url).context['idempotency_key']
+        for _ in range(2):
+            response = self.client.post(url, {'amount': '40', 'idempotency_key': key})
+            self.assertRedirects(response, reverse('project_detail', args=[self.project.pk]))
+        self.assertEqual(Donation.objects.get().amount, Decimal('40.00'))
+
+    def test_invalid_amount_keeps_key(self):
+        """Test that a rejected amount shows an error and keeps the key for the retry"""
+        self.client.login(username='donor', password='testpass123')
+        response = self.client.post(reverse('donate', args=[self.project.pk]),
+                                    {'amount': '10.005', 'idempotency_key': 'retry-key'})
+        self.assertContains(response, 'at most two decimal places')
+        self.assertEqual(response.context['idempotency_key'], 'retry-key')
+        self.assertFalse(Donation.objects.exists())
+
+
+class DonationStressTestCase(TransactionTestCase):
+    """Concurrent donations from many threads, as in a campaign spike"""
+    THREADS = 8
+    PER_THREAD = 50
+
+    @classmethod
+    def setUpClass(cls):
+        # The shared in-memory test database's table locks ignore the busy
+        # timeout, so these tests run on a copy in a file to see real SQLite
+        # locking. The extra handle keeps the in-memory database alive meanwhile
+        cls.memory_name = connection.settings_dict['NAME']
+        cls.memory_keeper = sqlite3.connect(cls.memory_name, uri=True)
+        handle, cls.file_name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        with closing(sqlite3.connect(cls.file_name)) as copy:
+            cls.memory_keeper.backup(copy)
+        # Renamed first, since close() leaves in-memory connections open
+        connection.settings_dict['NAME'] = cls.file_name
+        connection.close()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connection.close()
+        connection.settings_dict['NAME'] = cls.memory_name
+        connection.ensure_connection()
+        cls.memory_keeper.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(cls.file_name + suffix):
+                os.remove(cls.file_name + suffix)
+
+    def setUp(self):
+        self.owner = make_user('stressowner')
+        self.donors = [make_user(f'stress{i}') for i in range(self.THREADS)]
+        self.project = make_project(self.owner, 'Spike', total_target=Decimal('100000.00'))
+
+    def run_donors(self, submit):
+        """Each thread donates PER_THREAD times and resubmits every fifth donation"""
+        errors = []
+
+        def work(donor):
+            try:
+                for i in range(self.PER_THREAD):
+                    key = f'{donor.pk}-{i}'
+                    submit(donor, Decimal(i % 7 + 1), key)
+                    if i % 5 == 0:
+                        submit(donor, Decimal(i % 7 + 1), key)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work, args=(donor,)) for donor in self.donors]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        self.assertEqual(errors, [])
+        submissions = self.THREADS * (self.PER_THREAD + len(range(0, self.PER_THREAD, 5)))
+        return submissions / elapsed
+
+    def assertNoLostOrDuplicated(self):
+        expected_total = self.THREADS * sum(Decimal(i % 7 + 1) for i in range(self.PER_THREAD))
+        self.assertEqual(Donation.objects.count(), self.THREADS * self.PER_THREAD)
+        self.assertEqual(Donation.objects.aggregate(total=Sum('amount'))['total'], expected_total)
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.donation_count, self.THREADS * self.PER_THREAD)
+        self.assertEqual(self.project.donation_total, expected_total)
+
+    def test_direct_writes(self):
+        """Test that concurrent direct writes lose and duplicate nothing"""
+        project = self.project
+        rate = self.run_donors(lambda donor, amount, key: donate(donor, project, amount, key))
+        self.assertNoLostOrDuplicated()
+        self.assertGreater(rate, 100)
+
+    def test_buffered_writes(self):
+        """Test that the group-commit buffer loses and duplicates nothing"""
+        buffer = DonationBuffer(batch_size=50, flush_interval=0.005)
+        project_id = self.project.pk
+        rate = self.run_donors(
+            lambda donor, amount, key: buffer.submit(donor.pk, project_id, amount, key).result(timeout=30)
+        )
+        self.assertNoLostOrDuplicated()
+        self.assertGreater(rate, 100)
+
+    def test_buffered_failures(self):
+        """Test that a slow or failing writer thread surfaces as a donation error"""
+        failed = Future()
+        failed.set_exception(OperationalError('disk I/O error'))
+        with self.settings(PROJECT_DONATIONS={'BUFFERED': True, 'TIMEOUT': 0.01}):
+            for future in [Future(), failed]:
+                with mock.patch('projects.donations.get_donation_buffer') as buffer:
+                    buffer.return_value.submit.return_value = future
+                    with self.assertRaisesMessage(DonationError, 'try again'):
+                        donate(self.owner, self.project, '10', 'slow-key')
+        self.assertFalse(Donation.objects.exists())
+
+
+class DonationRollupTestCase(TestCase):
+    def setUp(self):
+        self.owner = make_user('rollupowner')
+        self.donors = [make_user(f'rollup{i}') for i in range(2)]
+        self.project = make_project(self.owner, 'Charted', total_target=Decimal('1000.00'), hours=10 * 24)
+
+    def donate_on(self, days_ago, donor, amount):
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() - timedelta(days=days_ago)):
+            return Donation.objects.create(user=donor, project=self.project, amount=Decimal(amount))
+
+    def rollup(self):
+        return list(self.project.donation_days.filter(count__gt=0).values_list('total', 'count', 'donor_count'))
+
+    def test_incremental_rollup(self):
+        """Test that donations, edits and deletes keep the daily rows exact"""
+        self.donate_on(2, self.donors[0], '10')
+        repeat = self.donate_on(2, self.donors[0], '5')
+        self.donate_on(2, self.donors[1], '20')
+        other_day = self.donate_on(0, self.donors[1], '7')
+        self.assertEqual(self.rollup(), [(Decimal('35'), 3, 2), (Decimal('7'), 1, 1)])
+
+        repeat.amount = Decimal('6')
+        repeat.save()
+        other_day.delete()
+        self.assertEqual(self.rollup(), [(Decimal('36'), 3, 2)])
+        self.assertEqual(self.project.donation_days.get(day=timezone.localdate()).donor_count, 0)
+
+        expected = self.rollup()
+        call_command('rebuild_donation_rollups', stdout=StringIO())
+        self.assertEqual(self.rollup(), expected)
+
+    def test_buffered_batch_counts_donor_once(self):
+        """Test that a donor's two donations in one batch count as one donor"""
+        buffer = DonationBuffer()
+        batch = [PendingDonation(self.donors[0].pk, self.project.pk, Decimal('5'), None) for _ in range(2)]
+        buffer.flush(batch)
+        self.assertEqual(self.rollup(), [(Decimal('10'), 2, 1)])
+
+    def test_delete_project_with_donations(self):
+        """Test that a project with donations can be deleted with its rollup rows"""
+        self.donate_on(2, self.donors[0], '10')
+        self.donate_on(0, self.donors[1], '7')
+        self.project.delete()
+        self.assertFalse(DonationDay.objects.exists())
+        self.assertFalse(Donation.objects.exists())
+
+    def test_delete_owner_and_donor(self):
+        """Test that deleting the owner removes their project, and deleting a donor updates the rollup"""
+        self.donate_on(2, self.donors[0], '10')
+        self.donate_on(2, self.donors[1], '20')
+        self.donors[1].delete()
+        self.assertEqual(self.rollup(), [(Decimal('10'), 1, 1)])
+        self.owner.delete()
+        self.assertFalse(Project.objects.exists())
+        self.assertFalse(DonationDay.objects.exists())
+
+    def test_series(self):
+        """Test that the series is zero-filled with a running total"""
+        self.donate_on(40, self.donors[0], '100')
+        self.donate_on(2, self.donors[0], '10')
+        series = self.project.get_donation_series(days=5)
+        self.assertEqual([day['total'] for day in series], [0, 0, Decimal('10'), 0, 0])
+        self.assertEqual(series[-1]['date'], timezone.localdate())
+        self.assertEqual([day['cumulative'] for day in series], [100, 100, 110, 110, 110])
+
+    def test_endpoint(self):
+        """Test the series endpoint's permissions and that its cost doesn't grow with donations"""
+        url = reverse('donation_series_api', args=[self.project.pk])
+        self.client.login(username='rollup0', password='testpass123')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.login(username='rollupowner', password='testpass123')
+        self.donate_on(1, self.donors[0], '10')
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url, {'days': 7})
+        for i in range(20):
+            self.donate_on(i % 5, self.donors[i % 2], '1')
+        with CaptureQueriesContext(connection) as after:
+            data = self.client.get(url, {'days': 7}).json()
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(len(data['series']), 7)
+        self.assertEqual(data['series'][-2]['total'], '14.00')
+        self.assertEqual(data['donation_count'], 21)
+
+
+def make_image(size, mode='RGB', fmt='JPEG'):
+    """Encoded test image with some detail so the encoders have work to do"""
+    image = Image.new(mode, size)
+    image.putdata([((x * 7) % 256, (y * 5) % 256, (x * y) % 256) + ((128,) if mode == 'RGBA' else ())
+                   for y in range(size[1]) for x in range(size[0])])
+    output = BytesIO()
+    image.save(output, fmt)
+    return output.getvalue()
+
+
+@override_settings(IMAGE_PROCESSING={'BACKGROUND': False})
+class ImageVariantsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = make_user('photographer')
+        self.project = make_project(self.user, 'Pictured')
+
+    def upload(self, name, content):
+        return ProjectImage.objects.create(project=self.project, image=SimpleUploadedFile(name, content))
+
+    def test_derivatives_generated_on_upload(self):
+        """Test that each size is written in WebP and JPEG without upscaling"""
+        original = make_image((1200, 800))
+        image = self.upload('photo.jpg', original)
+        sizes = image.image.variants['sizes']
+        self.assertEqual([(sizes[s]['width'], sizes[s]['height']) for s in ('card', 'gallery', 'full')],
+                         [(480, 320), (960, 640), (1200, 800)])
+        storage = image.image.storage
+        for entry in sizes.values():
+            self.assertTrue(storage.exists(entry['webp']))
+            self.assertTrue(storage.exists(entry['jpeg']))
+        self.assertLess(storage.size(sizes['card']['webp']), len(original) / 4)
+
+    def test_small_transparent_image(self):
+        """Test that small images share one copy and transparency is flattened for JPEG"""
+        image = self.upload('logo.png', make_image((300, 200), mode='RGBA', fmt='PNG'))
+        sizes = image.image.variants['sizes']
+        self.assertEqual(sizes['card'], sizes['full'])
+        with image.image.storage.open(sizes['card']['jpeg']) as f:
+            self.assertEqual(Image.open(f).mode, 'RGB')
+
+    def test_replaced_image_is_regenerated(self):
+        """Test that derivatives follow the current file"""
+        image = self.upload('first.jpg', make_image((600, 400)))
+        image.image = SimpleUploadedFile('second.jpg', make_image((500, 500)))
+        image.save()
+        image.refresh_from_db()
+        self.assertEqual(image.image.variants['sizes']['card']['height'], 480)
+        self.assertEqual(image.image.variants['source'], image.image.name)
+
+    def test_card_listing_serves_derivatives(self):
+        """Test that listings render card-sized srcsets from the annotated image"""
+        image = self.upload('card.jpg', make_image((1200, 800)))
+        self.client.login(username='photographer', password='testpass123')
+        response = self.client.get(reverse('all_projects'))
+        card = response.context['projects'][0].get_main_image()
+        self.assertEqual(card.variants, image.image.variants)
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, f'{image.image.storage.url(card.variants["sizes"]["card"]["jpeg"])} 480w')
+        self.assertNotContains(response, f'src="{image.image.url}"')
+
+    def test_picture_falls_back_to_original(self):
+        """Test that images without derivatives render the original"""
+        image = self.upload('plain.jpg', make_image((100, 100)))
+        ProjectImage.objects.filter(pk=image.pk).update(image_variants={})
+        image.refresh_from_db()
+        html = Template('{% load images %}{% picture image alt="x" %}').render(Context({'image': image.image}))
+        self.assertEqual(html, f'<img src="{image.image.url}" alt="x" loading="lazy">')
+
+    def test_backfill_command(self):
+        """Test that the command generates missing derivatives, including profile pictures"""
+        image = self.upload('old.jpg', make_image((700, 300)))
+        self.user.profile_picture = SimpleUploadedFile('me.jpg', make_image((200, 200)))
+        self.user.save()
+        ProjectImage.objects.update(image_variants={})
+        User.objects.update(profile_picture_variants={})
+        out = StringIO()
+        call_command('generate_image_variants', stdout=out)
+        self.assertIn('for 2 images', out.getvalue())
+        image.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(image.image.variants['width'], 700)
+        self.assertEqual(self.user.profile_picture.variants['sizes']['card']['width'], 200)
+
+
+@override_settings(IMAGE_PROCESSING={'BACKGROUND': False})
+class MediaStorageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = make_user('collector')
+        self.project = make_project(self.user, 'Stored')
+        self.header = make_image((600, 300))
+
+    def upload(self, name, content):
+        return ProjectImage.objects.create(project=self.project, image=SimpleUploadedFile(name, content))
+
+    def test_identical_uploads_share_one_file(self):
+        """Test that the same bytes uploaded through different fields are stored once"""
+        first = self.upload('header.jpg', self.header)
+        second = self.upload('header_copy.jpg', self.header)
+        self.project.image = SimpleUploadedFile('cover.jpg', self.header)
+        self.project.save()
+        self.user.profile_picture = SimpleUploadedFile('avatar.jpg', self.header)
+        self.user.save()
+        names = {first.image.name, second.image.name, self.project.image.name, self.user.profile_picture.name}
+        self.assertEqual(len(names), 1)
+        self.assertTrue(first.image.name.startswith('blobs/'))
+        self.assertEqual(first.image.variants['sizes'], self.user.profile_picture.variants['sizes'])
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).references, 4)
+        self.assertEqual(MediaBlob.objects.count(), 1 + len(variant_names(first.image.variants)))
+
+    def test_delete_releases_references(self):
+        """Test that a shared file survives until its last row is deleted"""
+        first = self.upload('a.jpg', self.header)
+        second = self.upload('b.jpg', self.header)
+        storage = first.image.storage
+        name, card = first.image.name, first.image.variants['sizes']['card']['webp']
+        first.delete()
+        self.assertTrue(storage.exists(name))
+        self.assertTrue(storage.exists(card))
+        second.delete()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(storage.exists(card))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_replaced_file_is_released(self):
+        """Test that replacing a picture frees the old file when nothing else uses it"""
+        self.user.profile_picture = SimpleUploadedFile('old.jpg', self.header)
+        self.user.save()
+        old = self.user.profile_picture.name
+        self.user.profile_picture = SimpleUploadedFile('new.png', make_image((100, 100), fmt='PNG'))
+        self.user.save()
+        self.assertFalse(self.user.profile_picture.storage.exists(old))
+        self.assertFalse(MediaBlob.objects.filter(name=old).exists())
+
+    def test_dedupe_command(self):
+        """Test that files saved under upload_to names are merged into shared blobs"""
+        storage = FileSystemStorage()
+        legacy = [storage.save(f'project_images/{name}', ContentFile(self.header)) for name in ('one.jpg', 'two.jpg')]
+        profile = storage.save('profile_pics/me.jpg', ContentFile(self.header))
+        images = [self.upload('x.jpg', make_image((10, 10))) for _ in legacy]
+        for image, name in zip(images, legacy):
+            ProjectImage.objects.filter(pk=image.pk).update(image=name, image_variants={})
+        User.objects.filter(pk=self.user.pk).update(profile_picture=profile)
+
+        out = StringIO()
+        call_command('dedupe_media', stdout=out)
+        self.assertIn('Successfully moved 3 files referenced by 3 rows into 1 blobs', out.getvalue())
+        names = set(ProjectImage.objects.values_list('image', flat=True))
+        self.user.refresh_from_db()
+        self.assertEqual(names, {self.user.profile_picture.name})
+        for name in legacy + [profile]:
+            self.assertFalse(storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=self.user.profile_picture.name).references, 3)
+
+
+class GalleryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = make_user('curator')
+        self.project = make_project(self.user, 'Gallery')
+        self.client.login(username='curator', password='testpass123')
+
+    def test_bulk_upload_uses_constant_queries(self):
+        """Test that a 20-image gallery is inserted and recorded in a handful of queries"""
+        files = [SimpleUploadedFile(f'photo{i}.png', make_image((40 + i, 30), fmt='PNG')) for i in range(20)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('project_gallery', args=[self.project.id]), {'images': files})
+        self.assertRedirects(response, reverse('project_gallery', args=[self.project.id]))
+        image_queries = [q['sql'] for q in queries if 'projects_projectimage' in q['sql']]
+        self.assertLessEqual(len(image_queries), 3)
+        images = list(self.project.projectimage_set.all())
+        self.assertEqual([image.position for image in images], list(range(20)))
+        self.assertEqual(images[3].image.width, 43)
+        self.assertTrue(all(image.image_variants['source'] == image.image.name for image in images))
+
+    def test_reorder_and_primary_in_single_updates(self):
+        """Test that ordering and the primary image are saved with one UPDATE each"""
+        images = ProjectImage.objects.add_gallery(
+            self.project, [SimpleUploadedFile(f'{i}.png', make_image((10, 10 + i), fmt='PNG')) for i in range(4)]
+        )
+        first, second, third, fourth = images
+        data = {f'position-{image.id}': position for image, position in zip(images, [3, 0, 2, 1])}
+        data['primary'] = third.id
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('reorder_gallery', args=[self.project.id]), data)
+        updates = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "projects_projectimage"')]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(list(self.project.projectimage_set.all()), [third, second, fourth, first])
+        self.assertEqual(ProjectImage.objects.filter(is_primary=True).get(), third)
+
+    def test_only_owner_manages_gallery(self):
+        """Test that other users can't upload to someone else's gallery"""
+        make_user('visitor')
+        self.client.login(username='visitor', password='testpass123')
+        response = self.client.post(reverse('project_gallery', args=[self.project.id]), {
+            'images': [SimpleUploadedFile('x.png', make_image((10, 10), fmt='PNG'))],
+        })
+        self.assertRedirects(response, reverse('project_detail', args=[self.project.id]))
+        self.assertFalse(self.project.projectimage_set.exists())
+
+
+class MediaServingTestCase(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.content = bytes(range(256)) * 4
+        self.name = FileSystemStorage().save('project_images/data.png', ContentFile(self.content))
+        self.url = reverse('media', args=[self.name])
+
+    def test_full_file_with_validators(self):
+        """Test that media is served with DEBUG off, with an ETag and range support advertised"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('max-age=3600', response['Cache-Control'])
+        not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_byte_ranges(self):
+        """Test single ranges, suffix ranges, unsatisfiable ranges and If-Range"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        suffix = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(suffix.streaming_content), self.content[-5:])
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=5000-').status_code, 416)
+        stale = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"old"')
+        self.assertEqual(stale.status_code, 200)
+
+    def test_blobs_are_immutable(self):
+        """Test that content-addressed files are cached for good under their hash"""
+        name = default_storage.save('x.png', ContentFile(self.content))
+        response = self.client.get(reverse('media', args=[name]))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(self.content).hexdigest()}"')
+
+    def test_offload_to_proxy(self):
+        """Test that with offloading on, no bytes are sent by Django"""
+        with self.settings(MEDIA_SERVING={'OFFLOAD': 'x-accel-redirect'}):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        with self.settings(MEDIA_SERVING={'OFFLOAD': 'x-sendfile'}):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], FileSystemStorage().path(self.name))
+
+    def test_paths_outside_media_root(self):
+        """Test that traversal and missing files are 404s"""
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/project_images/missing.png').status_code, 404)
+        self.assertEqual(self.client.get('/media/project_images/').status_code, 404)
+
+
+class StaticBundlesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_user('bundleuser')
+        self.client.login(username='bundleuser', password='testpass123')
+
+    def test_pages_link_bundles_instead_of_inline_assets(self):
+        """Test that the home page references its CSS and JavaScript instead of inlining them"""
+        content = self.client.get(reverse('home')).content.decode()
+        self.assertNotIn('<style>', content)
+        self.assertNotIn('<script>', content)
+        self.assertIn('/static/css/base.css', content)
+        self.assertIn('/static/css/home.css', content)
+        self.assertIn('/static/js/home.js', content)
+
+    def test_collected_bundles_are_hashed_and_precompressed(self):
+        """Test that collectstatic writes hashed, gzipped bundles that are served for good"""
+        static_root = tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'projects.staticfiles.CompressedManifestStaticFilesStorage'},
+        }
+        with self.settings(STATIC_ROOT=static_root.name, STORAGES=storages):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            content = self.client.get(reverse('home')).content.decode()
+            hashed = re.search(r'/static/(css/home\.[0-9a-f]{12}\.css)', content).group(1)
+            response = self.client.get(reverse('static', args=[hashed]), HTTP_ACCEPT_ENCODING='gzip, br;q=0')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertIn('Accept-Encoding', response['Vary'])
+            compressed = b''.join(response.streaming_content)
+            with open(os.path.join(static_root.name, hashed), 'rb') as f:
+                self.assertEqual(gzip.decompress(compressed), f.read())
+            plain = self.client.get(reverse('static', args=[hashed]))
+            self.assertFalse(plain.has_header('Content-Encoding'))
+            self.assertTrue(b''.join(plain.streaming_content).startswith(b'/*'))
+
+
+@override_settings(IMAGE_PROCESSING={'BACKGROUND': False})
+class UploadLimitsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = make_user('uploader')
+        self.client.login(username='uploader', password='testpass123')
+
+    def post_picture(self, name, content):
+        return self.client.post(reverse('edit_profile'), {
+            'gender': 'Male',
+            'country': 'Egypt',
+            'profile_picture': SimpleUploadedFile(name, content),
+        })
+
+    def test_accepted_upload_is_hashed_while_streaming(self):
+        """Test that a valid upload is saved under the digest computed by the handler"""
+        content = make_image((200, 100))
+        response = self.post_picture('me.jpg', content)
+        self.assertRedirects(response, reverse('profile'))
+        self.user.refresh_from_db()
+        self.assertIn(hashlib.sha256(content).hexdigest(), self.user.profile_picture.name)
+
+    @override_settings(UPLOAD_LIMITS={'MAX_SIZE': 2048})
+    def test_oversized_upload_rejected(self):
+        """Test that a file over the size limit is reported on the form and not stored"""
+        response = self.post_picture('big.jpg', make_image((300, 300)))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('too large', response.context['form'].errors['profile_picture'][0])
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.profile_picture)
+
+    def test_non_image_rejected_from_first_bytes(self):
+        """Test that a file is rejected by its content, not its name"""
+        response = self.post_picture('script.jpg', b'<?php echo "hi"; ?>' * 100)
+        self.assertIn('Unsupported file type', response.context['form'].errors['profile_picture'][0])
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_daily_quota(self):
+        """Test that uploads beyond a user's daily quota are refused"""
+        content = make_image((100, 100))
+        with self.settings(UPLOAD_LIMITS={'DAILY_QUOTA': len(content) + 100}):
+            self.assertEqual(self.post_picture('one.jpg', content).status_code, 302)
+            response = self.post_picture('two.jpg', content)
+        self.assertIn('daily upload limit', response.context['form'].errors['profile_picture'][0])
+
+    def test_handler_stops_at_first_bad_chunk(self):
+        """Test that the handler stops storing a file as soon as a chunk crosses the limit"""
+        request = RequestFactory().post('/')
+        request.user = self.user
+        with self.settings(UPLOAD_LIMITS={'MAX_SIZE': 100}):
+            handler = StreamingUploadHandler(request)
+        handler.handle_raw_input(None, request.META, None, None)
+        handler.new_file('image', 'a.png', 'image/png', None)
+        path = handler.file.temporary_file_path()
+        handler.receive_data_chunk(b'\x89PNG\r\n\x1a\n' + b'x' * 60, 0)
+        handler.receive_data_chunk(b'x' * 64, 68)
+        self.assertTrue(handler.rejected)
+        self.assertFalse(os.path.exists(path))
+        handler.receive_data_chunk(b'x' * 64, 132)
+        self.assertIsNone(handler.file_complete(196))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(request.rejected_uploads, {'image': 'The file is too large; the limit is 100\xa0bytes.'})
+
+    @override_settings(UPLOAD_LIMITS={'MAX_SIZE': 2048})
+    def test_fields_after_rejected_file(self):
+        """Test that fields sent after a rejected file still reach the form"""
+        response = self.client.post(reverse('edit_profile'), {
+            'profile_picture': SimpleUploadedFile('big.jpg', make_image((300, 300))),
+            'first_name': 'Ada',
+            'gender': 'Male',
+            'country': 'Egypt',
+        })
+        form = response.context['form']
+        self.assertEqual(list(form.errors), ['profile_picture'])
+        self.assertEqual(form.data['first_name'], 'Ada')
+
+        self.client.logout()
+        response = self.client.post(reverse('register'), {
+            'profile_picture': SimpleUploadedFile('big.jpg', make_image((300, 300))),
+            'username': 'latecomer',
+            'email': 'latecomer@example.com',
+            'phone_number': '01000000000',
+            'birthdate': '1990-01-01',
+            'gender': 'Female',
+            'country': 'Egypt',
+            'password1': 'S3cure-passphrase',
+            'password2': 'S3cure-passphrase',
+        })
+        self.assertEqual(list(response.context['form'].errors), ['profile_picture'])
+        self.assertFalse(User.objects.filter(username='latecomer').exists())
+
+
+@override_settings(IMAGE_PROCESSING={'BACKGROUND': True, 'WORKERS': 2})
+class ImageProcessingTestCase(TransactionTestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = make_user('uploader')
+        self.project = make_project(self.user, 'Processed')
+
+    def upload(self, name, content):
+        return ProjectImage.objects.create(project=self.project, image=SimpleUploadedFile(name, content))
+
+    def test_upload_is_processed_in_background(self):
+        """Test that an upload is served as is while processing and gets derivatives afterwards"""
+        image = self.upload('photo.jpg', make_image((1200, 800)))
+        self.assertTrue(image.image.processing)
+        self.assertEqual(image.image.variants, {})
+        html = Template('{% load images %}{% picture image %}').render(Context({'image': image.image}))
+        self.assertIn(f'src="{image.image.url}"', html)
+
+        wait_for_image_processing(timeout=60)
+        image.refresh_from_db()
+        self.assertFalse(image.image.processing)
+        self.assertEqual(image.image.variants['status'], 'ready')
+        self.assertEqual(image.image.variants['sizes']['card']['width'], 480)
+        self.assertTrue(image.image.storage.exists(image.image.variants['sizes']['full']['webp']))
+
+    def test_corrupt_image_does_not_stop_the_pool(self):
+        """Test that an undecodable upload is marked failed and later uploads still process"""
+        with self.assertLogs('projects.images', 'ERROR'):
+            broken = self.upload('broken.jpg', b'\xff\xd8\xff\xe0' + b'not really a jpeg' * 50)
+            wait_for_image_processing(timeout=60)
+        good = self.upload('good.png', make_image((300, 200), fmt='PNG'))
+        wait_for_image_processing(timeout=60)
+        broken.refresh_from_db()
+        good.refresh_from_db()
+        self.assertEqual(broken.image_variants['status'], 'failed')
+        self.assertEqual(broken.image.variants, {})
+        self.assertEqual(good.image.variants['sizes']['card']['width'], 300)
+
+    def test_orientation_fixed_and_exif_stripped(self):
+        """Test that EXIF orientation is applied to the pixels and the original loses its EXIF"""
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 degrees clockwise
+        exif[0x010F] = 'Camera Maker'
+        output = BytesIO()
+        Image.open(BytesIO(make_image((300, 200)))).save(output, 'JPEG', exif=exif)
+        image = self.upload('phone.jpg', output.getvalue())
+        wait_for_image_processing(timeout=60)
+        image.refresh_from_db()
+        self.assertEqual((image.image.variants['width'], image.image.variants['height']), (200, 300))
+        with image.image.storage.open(image.image.name) as f:
+            original = Image.open(f)
+            self.assertEqual(original.size, (200, 300))
+            self.assertEqual(dict(original.getexif()), {})
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': ['replica'], 'STICKY_SECONDS': 5})
+class ReplicaRoutingTestCase(TransactionTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def route(self, view, method='get', cookies=None):
+        """Run ``view`` behind the routing middleware; it returns where Project reads went"""
+        routed = []
+
+        def record(request):
+            routed.extend(view(request))
+            return HttpResponse()
+        request = getattr(self.factory, method)('/')
+        request.COOKIES.update(cookies or {})
+        response = ReplicaRoutingMiddleware(record)(request)
+        return routed, response
+
+    def test_marked_views_read_from_replica(self):
+        """Test that only marked views read from the replica, and never user or session tables"""
+        @read_replica
+        def marked(request):
+            with use_primary():
+                built = router.db_for_read(Project)
+            return [router.db_for_read(Project), router.db_for_read(User), built]
+        self.assertEqual(self.route(marked)[0], ['replica', 'default', 'default'])
+        self.assertEqual(self.route(lambda request: [router.db_for_read(Project)])[0], ['default'])
+        self.assertEqual(router.db_for_read(Project), 'default')
+
+    def test_writes_pin_request_and_client_to_primary(self):
+        """Test that after a write the request and the client's next requests read from the primary"""
+        @read_replica
+        def writes(request):
+            before = router.db_for_read(Project)
+            Category.objects.create(name='Pinned')
+            return [before, router.db_for_read(Project)]
+        routed, response = self.route(writes)
+        self.assertEqual(routed, ['replica', 'default'])
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+        reads = read_replica(lambda request: [router.db_for_read(Project)])
+        self.assertEqual(self.route(reads, cookies={PIN_COOKIE: '1'})[0], ['default'])
+        routed, response = self.route(reads)
+        self.assertEqual(routed, ['replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_posts_and_transactions_use_primary(self):
+        """Test that POSTs and reads inside a transaction never go to the replica"""
+        @read_replica
+        def in_transaction(request):
+            with transaction.atomic():
+                return [router.db_for_read(Project)]
+        self.assertEqual(self.route(in_transaction)[0], ['default'])
+        reads = read_replica(lambda request: [router.db_for_read(Project)])
+        self.assertEqual(self.route(reads, method='post')[0], ['default'])
+
+    def test_without_replicas_everything_uses_primary(self):
+        """Test that with no replicas configured nothing is routed or pinned"""
+        @read_replica
+        def writes(request):
+            Category.objects.create(name='Unrouted')
+            return [router.db_for_read(Project)]
+        with self.settings(DATABASE_ROUTING={'REPLICAS': []}):
+            routed, response = self.route(writes)
+        self.assertEqual(routed, ['default'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class QueryBudgetTestCase(TestCase):
+    # (url name, method): most queries a request with an empty cache may run. The
+    # data below has more cards, comments and images than a page shows, so a
+    # query per card or per comment pushes a view far over its budget
+    BUDGETS = {
+        ('create_project', 'get'): 3,
+        ('all_projects', 'get'): 6,
+        ('my_projects', 'get'): 4,
+        ('search_suggestions', 'get'): 2,
+        ('project_detail', 'get'): 12,
+        ('donate', 'get'): 4,
+        ('donate', 'post'): 13,
+        ('donation_series_api', 'get'): 6,
+        ('add_comment', 'post'): 5,
+        ('add_reply', 'post'): 6,
+        ('comment_list_api', 'get'): 1,
+        ('comment_replies_api', 'get'): 1,
+        ('comment_thread_api', 'get'): 2,
+        ('report_project', 'get'): 5,
+        ('report_comment', 'get'): 6,
+        ('rate_project', 'get'): 5,
+        ('project_gallery', 'get'): 5,
+        ('reorder_gallery', 'post'): 8,
+        ('cancel_project', 'get'): 4,
+        ('landing', 'get'): 2,
+        ('register', 'get'): 2,
+        ('logout', 'get'): 4,
+        ('login', 'get'): 2,
+        ('home', 'get'): 8,
+        ('profile', 'get'): 4,
+        ('edit_profile', 'get'): 2,
+        ('my_donations', 'get'): 3,
+        ('delete_account', 'get'): 2,
+        ('activate_account', 'get'): 6,
+    }
+
+    # Request data for the non-GET entries
+    DATA = {
+        ('donate', 'post'): {'amount': '15.00', 'idempotency_key': 'budget'},
+        ('add_comment', 'post'): {'content': 'Within budget'},
+        ('add_reply', 'post'): {'content': 'Still within budget'},
+        ('reorder_gallery', 'post'): {},
+        ('search_suggestions', 'get'): {'q': 'budget'},
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = make_user('budgetowner')
+        donors = [make_user(f'budgetdonor{i}') for i in range(5)]
+        categories = [Category.objects.create(name=f'Budget {i}') for i in range(3)]
+        # More than a page of cards, each with everything a card shows
+        for i in range(30):
+            project = make_project(
+                cls.owner,
+                f'Budget project {i}',
+                hours=i,
+                details='A project to keep within budget',
+                category=categories[i % 3],
+                total_target=Decimal('500.00'),
+                featured=i < 5,
+                tags=['budget', f'tag{i % 4}'],
+            )
+            for position, donor in enumerate(donors):
+                Donation.objects.create(user=donor, project=project, amount=Decimal('10.00'))
+                ProjectRating.objects.create(user=donor, project=project, rating=position + 1)
+            ProjectImage.objects.create(project=project, image=f'project_images/budget{i}.jpg', is_primary=True)
+            ProjectImage.objects.create(project=project, image=f'project_images/budget{i}b.jpg')
+            Donation.objects.create(user=cls.owner, project=project, amount=Decimal('5.00'))
+        cls.project = project
+        # A long comment thread on the project under test
+        for i in range(25):
+            comment = Comment.objects.create(user=donors[i % 5], project=project, content=f'Comment {i}')
+            for j in range(3):
+                Comment.objects.create(user=donors[j], project=project, parent=comment, content=f'Reply {j}')
+        cls.comment = comment
+        inactive = make_user('budgetinactive', is_active=False)
+        cls.token = ActivationToken.objects.create(user=inactive).token
+
+    def setUp(self):
+        cache.clear()
+
+    def url_patterns(self):
+        for module in (projects_urls, accounts_urls):
+            for pattern in module.urlpatterns:
+                yield pattern
+
+    def request(self, name, method, pattern):
+        args = {'project_id': self.project.id, 'comment_id': self.comment.id, 'token': self.token}
+        url = reverse(name, kwargs={key: args[key] for key in pattern.pattern.converters})
+        self.client.force_login(self.owner)
+        cache.clear()
+        with log_queries() as log:
+            response = getattr(self.client, method)(url, self.DATA.get((name, method), {}))
+        self.assertLess(response.status_code, 400, name)
+        return log
+
+    def test_every_view_has_a_budget(self):
+        """Test that no view in projects.urls or accounts.urls is left without a budget"""
+        budgeted = {name for name, method in self.BUDGETS}
+        for pattern in self.url_patterns():
+            self.assertIn(pattern.name, budgeted)
+
+    def test_repeated_statements_are_reported(self):
+        """Test that the accounting tells a query per row from a repeated identical query"""
+        with log_queries() as log:
+            donations = list(Donation.objects.filter(project=self.project).order_by('id')[:5])
+            for donation in donations:
+                donation.user.username
+            User.objects.get(pk=donations[0].user_id)
+        self.assertEqual(log.count, 7)
+        self.assertEqual(log.similar, 4)
+        self.assertEqual(log.duplicates, 1)
+        with self.settings(SQL_ACCOUNTING={'ENABLED': True}):
+            response = self.client.get(reverse('comment_list_api', args=[self.project.id]))
+        self.assertEqual(response['X-SQL-Queries'], '1')
+        self.assertEqual(response['X-SQL-Similar'], '0')
+        self.assertIn('sql;dur=', response['Server-Timing'])
+
+    def test_views_stay_within_budget(self):
+        """Test each view's query count against its budget at a realistic data size"""
+        patterns = {pattern.name: pattern for pattern in self.url_patterns()}
+        for (name, method), budget in self.BUDGETS.items():
+            with self.subTest(view=name, method=method):
+                log = self.request(name, method, patterns[name])
+                self.assertLessEqual(log.count, budget, log.summary())
+
+
+@override_settings(METRICS={'TOKEN': 'scrape-secret'})
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def scrape(self):
+        return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-secret')
+
+    def sample(self, line):
+        """Current value of one series of the scrape, 0 if it hasn't been recorded yet"""
+        text = self.scrape().content.decode()
+        for row in text.splitlines():
+            if row.startswith(line + ' '):
+                return float(row.rsplit(' ', 1)[1])
+        return 0
+
+    def test_views_are_timed(self):
+        """Test that a request records its latency, SQL, template time and size under its view"""
+        labels = '{view="all_projects",method="GET"}'
+        before = {name: self.sample(name) for name in [
+            'http_requests_total{view="all_projects",method="GET",status="200"}',
+            f'http_request_duration_seconds_count{labels}',
+            f'http_request_template_seconds_sum{labels}',
+            f'http_response_size_bytes_sum{labels}',
+            f'db_queries_total{labels}',
+        ]}
+        response = self.client.get(reverse('all_projects'))
+        after = {name: self.sample(name) for name in before}
+        delta = [after[name] - before[name] for name in before]
+        self.assertEqual(delta[:2], [1, 1])
+        self.assertGreater(delta[2], 0)
+        self.assertEqual(delta[3], len(response.content))
+        self.assertGreater(delta[4], 0)
+        # Scrapes don't count themselves
+        self.assertEqual(self.sample('http_requests_total{view="metrics",method="GET",status="200"}'), 0)
+
+    async def test_asgi_requests_are_timed_the_same(self):
+        """Test that requests through the ASGI handler are recorded like WSGI ones"""
+        series = 'http_request_template_seconds_count{view="login",method="GET"}'
+        before = await sync_to_async(self.sample)(series)
+        response = await self.async_client.get(reverse('login'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await sync_to_async(self.sample)(series), before + 1)
+
+    def test_endpoint_is_internal(self):
+        """Test that only token holders or allowed addresses can scrape"""
+        self.client.get(reverse('landing'))
+        response = self.scrape()
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn('# TYPE http_request_duration_seconds histogram', response.content.decode())
+        self.assertIn('http_request_duration_seconds_bucket{view="landing",method="GET",le="+Inf"}',
+                      response.content.decode())
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        # Closed by default, even to local addresses, which is where a proxy's requests come from
+        with self.settings(METRICS={}):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+        with self.settings(METRICS={'ALLOWED_IPS': ['10.0.0.5']}):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='203.0.113.9').status_code, 404)
+        with self.settings(METRICS={'ALLOWED_IPS': ['10.0.0.5'], 'CLIENT_IP_HEADER': 'HTTP_X_FORWARDED_FOR'}):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.5').status_code, 404)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1',
+                                             HTTP_X_FORWARDED_FOR='203.0.113.9').status_code, 404)
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1',
+                                             HTTP_X_FORWARDED_FOR='203.0.113.9, 10.0.0.5').status_code, 200)
+
+
+class SlowQueryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        slow_query_log.clear()
+        self.addCleanup(slow_query_log.clear)
+
+    def test_fingerprint_ignores_values(self):
+        """Test that runs differing only in values and list lengths share a fingerprint"""
+        first = fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'a' LIMIT 21")
+        second = fingerprint("SELECT  *  FROM t WHERE id IN (%s) AND name = 'it''s' LIMIT 5")
+        self.assertEqual(first, second)
+        self.assertEqual(first[0], 'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertNotEqual(fingerprint('SELECT * FROM u')[1], first[1])
+
+    def test_slow_queries_are_recorded_with_view_and_plan(self):
+        """Test that queries over the threshold are grouped with their view and query plan"""
+        with self.settings(SLOW_QUERIES={'THRESHOLD': 0}), connection.execute_wrapper(slow_query_sampler):
+            self.client.get(reverse('all_projects'))
+            self.client.get(reverse('all_projects'))
+        entries = slow_query_log.snapshot()
+        listing = [entry for entry in entries if entry.sql.startswith('SELECT') and 'projects_project' in entry.sql]
+        self.assertTrue(listing)
+        self.assertEqual(listing[0].views, {'GET all_projects': 2})
+        self.assertIn('projects_project', listing[0].plan)
+        # EXPLAIN itself isn't sampled
+        self.assertFalse([entry for entry in entries if entry.sql.startswith('EXPLAIN')])
+
+    def test_fast_queries_and_buffer_size(self):
+        """Test that queries under the threshold are skipped and the buffer keeps the latest entries"""
+        with connection.execute_wrapper(slow_query_sampler):
+            list(Project.objects.all())
+            self.assertEqual(slow_query_log.snapshot(), [])
+            with self.settings(SLOW_QUERIES={'THRESHOLD': 0, 'BUFFER_SIZE': 2}):
+                list(Project.objects.all())
+                list(Category.objects.all())
+                list(Tag.objects.all())
+        tables = sorted(entry.sql.split(' FROM ')[1].split()[0] for entry in slow_query_log.snapshot())
+        self.assertEqual(tables, ['"projects_category"', '"projects_tag"'])
+
+    def test_admin_page(self):
+        """Test that staff can read and clear the sampled queries"""
+        User.objects.create_superuser(username='slowadmin', password='testpass123', email='slow@example.com',
+                                      is_active=True)
+        self.client.login(username='slowadmin', password='testpass123')
+        with self.settings(SLOW_QUERIES={'THRESHOLD': 0}), connection.execute_wrapper(slow_query_sampler):
+            list(Project.objects.filter(title__contains='slow'))
+        digest = slow_query_log.snapshot()[0].fingerprint
+        response = self.client.get(reverse('slow_queries'))
+        self.assertContains(response, digest)
+        self.assertContains(response, '(no request)')
+        self.client.post(reverse('slow_queries'))
+        self.assertEqual(slow_query_log.snapshot(), [])
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('slow_queries')).status_code, 302)
+
+
+class SeedScaleTestCase(TestCase):
+    """Test the seed_scale command"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = self.settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+    def seed(self, seed, **options):
+        options = {'users': 15, 'projects': 10, 'donations': 300, 'comments': 60, 'ratings': 40, 'reports': 10,
+                   'images': 2, 'skip_similar': True, 'batch_size': 50, **options}
+        call_command('seed_scale', seed=seed, stdout=StringIO(), **options)
+        return Project.objects.filter(owner__username__startswith=f'seed{seed}_')
+
+    def test_rows_and_derived_data(self):
+        """Test that the generated rows come with consistent counters, rollups, paths and references"""
+        projects = self.seed(1)
+        self.assertEqual(projects.count(), 10)
+        self.assertEqual(Donation.objects.filter(project__in=projects).count(), 300)
+        self.assertEqual(ProjectRating.objects.filter(project__in=projects).count(), 40)
+        for project in projects:
+            donations = project.donation_set.aggregate(total=Sum('amount'))['total'] or 0
+            self.assertEqual(project.donation_total, donations)
+            self.assertEqual(project.donation_total, project.donation_days.aggregate(total=Sum('total'))['total'] or 0)
+            self.assertEqual(project.rating_count, project.projectrating_set.count())
+            self.assertFalse(project.donation_set.filter(timestamp__lt=project.start_time).exists())
+        replies = Comment.objects.filter(project__in=projects, parent__isnull=False).select_related('parent')
+        self.assertTrue(replies)
+        for reply in replies:
+            self.assertEqual(reply.path, f'{reply.parent.path}{reply.pk:010d}/')
+            self.assertEqual(reply.project_id, reply.parent.project_id)
+        for image in ProjectImage.objects.filter(project__in=projects).values('image').annotate(rows=Count('id')):
+            self.assertEqual(default_storage.references(image['image']), image['rows'])
+        project = projects.first()
+        self.assertIn(project, search_projects(projects, project.title))
+
+    def test_same_seed_same_data(self):
+        """Test that a seed always produces the same rows and can't be loaded twice"""
+        def snapshot(projects):
+            return (
+                list(projects.order_by('id').values_list('title', 'total_target', 'status')),
+                list(Donation.objects.filter(project__in=projects).order_by('id').values_list('amount', 'user__username')),
+            )
+        first = snapshot(self.seed(2, images=0))
+        User.objects.filter(username__startswith='seed2_').delete()
+        self.assertEqual(snapshot(self.seed(2, images=0)), first)
+        with self.assertRaises(CommandError):
+            self.seed(2, images=0)
+        self.assertNotEqual(snapshot(self.seed(3, images=0)), first)
+
+
+class BenchTestCase(TestCase):
+    """Test the bench command"""
+
+    def setUp(self):
+        cache.clear()
+        owner = make_user('benchowner')
+        self.project = make_project(
+            owner,
+            'Benchmark telescope',
+            details='A telescope for the school',
+            category=Category.objects.create(name='Science'),
+            total_target=Decimal('1000.00'),
+        )
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.baseline = os.path.join(directory.name, 'baseline.json')
+
+    def bench(self, **options):
+        call_command('bench', requests=3, concurrency=1, warmup=0, stdout=StringIO(), stderr=StringIO(), **options)
+
+    def test_reports_and_saves_every_route(self):
+        """Test that every route is measured without errors and saved as a baseline"""
+        self.bench(save_baseline=self.baseline)
+        with open(self.baseline) as f:
+            routes = json.load(f)['routes']
+        self.assertEqual(list(routes), benchmark.ROUTES)
+        for summary in routes.values():
+            self.assertEqual((summary['requests'], summary['errors']), (3, 0))
+            self.assertLessEqual(summary['p50'], summary['p99'])
+            self.assertGreater(summary['queries'], 0)
+        bench_user = User.objects.get(username='bench')
+        self.assertEqual(Donation.objects.filter(user=bench_user, project=self.project).count(), 3)
+        self.assertEqual(Comment.objects.filter(user=bench_user, project=self.project).count(), 3)
+
+    def test_regressions_fail_the_run(self):
+        """Test that slower routes and extra queries against the baseline are reported"""
+        self.bench(routes=['project_detail'], save_baseline=self.baseline)
+        with open(self.baseline) as f:
+            saved = json.load(f)
+        self.bench(routes=['project_detail'], baseline=self.baseline, tolerance=100)
+        saved['routes']['project_detail'].update(p95=0.001, queries=1)
+        with open(self.baseline, 'w') as f:
+            json.dump(saved, f)
+        with self.assertRaisesMessage(CommandError, '2 regressions'):
+            self.bench(routes=['project_detail'], baseline=self.baseline)
+
+    def test_compare(self):
+        """Test that small absolute changes and routes missing from the baseline are ignored"""
+        baseline = {'routes': {'home': {'p95': 2.0, 'queries': 3, 'errors': 0}}}
+        summary = {'p95': 2.9, 'queries': 3.4, 'errors': 0}
+        self.assertEqual(benchmark.compare({'home': summary, 'comment': summary}, baseline, 0.2), [])
+        summary = {'p95': 3.5, 'queries': 4, 'errors': 1}
+        self.assertEqual(len(benchmark.compare({'home': summary}, baseline, 0.2)), 3)
+        self.assertEqual(benchmark.percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(benchmark.percentile([5, 1, 4, 2, 3], 99), 5)
+
+
+class QueryPlanTestCase(TestCase):
+    """Test that the views' queries are answered from indexes, without full scans or sorts"""
+
+    # Tables small enough to read whole
+    SMALL_TABLES = {'projects_category'}
+    # Queries that may sort: no index can hold these orders
+    SORTS_ALLOWED = [
+        'FROM "projects_tag"',  # the few tags of each listed project, by name
+        '"avg_rating"',  # top rated rail, ordered by a computed average
+        '"relevance"',  # search results, ordered by rank
+        'INNER JOIN "projects_projecttag"',  # projects with a tag, found through the tag's index
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        # The planner only picks the index a production database would get
+        # with production-like row counts and the statistics ANALYZE gathers
+        call_command('seed_scale', seed=7, users=500, projects=3000, donations=30000, comments=6000, ratings=3000,
+                     reports=100, tags=100, images=0, skip_similar=True, stdout=StringIO())
+        cls.user = make_user('planner')
+        cls.category = Category.objects.order_by('id').first()
+        cls.project = make_project(
+            cls.user,
+            'Planetarium',
+            details='A planetarium for the city',
+            category=cls.category,
+            total_target=Decimal('1000.00'),
+            featured=True,
+        )
+        cls.project.set_tags(['space'])
+        cls.comment = Comment.objects.create(project=cls.project, user=cls.user, content='Great idea')
+        cls.reply = Comment.objects.create(project=cls.project, user=cls.user, content='Thanks', parent=cls.comment)
+        cls.donation = Donation.objects.create(user=cls.user, project=cls.project, amount=Decimal('10.00'))
+        ProjectRating.objects.create(user=cls.user, project=cls.project, rating=5)
+        cls.token = ActivationToken.objects.create(
+            user=make_user('inactive', is_active=False)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='planner', password='testpass123')
+
+    def cursor(self, obj, ordering):
+        return {CURSOR_PARAM: KeysetPaginator(type(obj).objects.all(), ordering).encode_cursor(obj)}
+
+    def problems(self, url, params=None):
+        """The plan lines of the queries behind ``url`` that scan a table or sort"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, params)
+        found = []
+        for query in queries.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                found += self.plan_problems(query['sql'])
+        return found
+
+    def plan(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[3] for row in cursor.fetchall()]
+
+    def plan_problems(self, sql, params=()):
+        found = []
+        for detail in self.plan(sql, params):
+            scan = re.fullmatch(r'SCAN (\w+)', detail)
+            if scan and scan[1] not in self.SMALL_TABLES:
+                found.append(f'{detail} in {sql}')
+            if detail == 'USE TEMP B-TREE FOR ORDER BY' and not any(s in sql for s in self.SORTS_ALLOWED):
+                found.append(f'{detail} in {sql}')
+        return found
+
+    def assertIndexed(self, url, params=None):
+        self.assertEqual(self.problems(url, params), [], f'{url} {params or ""}')
+
+    def test_project_listings(self):
+        """Test the project listings, home rails and search"""
+        second_page = self.cursor(self.project, ['-start_time', 'id'])
+        self.assertIndexed(reverse('home'))
+        self.assertIndexed(reverse('all_projects'))
+        self.assertIndexed(reverse('all_projects'), second_page)
+        self.assertIndexed(reverse('all_projects'), {'category': self.category.pk})
+        self.assertIndexed(reverse('all_projects'), {'category': self.category.pk, **second_page})
+        self.assertIndexed(reverse('all_projects'), {'tag': 'space'})
+        self.assertIndexed(reverse('all_projects'), {'search': 'planetarium'})
+        self.assertIndexed(reverse('search_suggestions'), {'q': 'planetarium'})
+        self.assertIndexed(reverse('my_projects'))
+        self.assertIndexed(reverse('profile'), second_page)
+
+    def test_project_page_and_comments(self):
+        """Test the project page and the comment APIs"""
+        self.assertIndexed(reverse('project_detail', args=[self.project.pk]))
+        self.assertIndexed(reverse('comment_list_api', args=[self.project.pk]))
+        self.assertIndexed(reverse('comment_list_api', args=[self.project.pk]),
+                           self.cursor(self.comment, COMMENT_ORDERING))
+        self.assertIndexed(reverse('comment_replies_api', args=[self.comment.pk]))
+        self.assertIndexed(reverse('comment_replies_api', args=[self.comment.pk]),
+                           self.cursor(self.reply, REPLY_ORDERING))
+        self.assertIndexed(reverse('comment_thread_api', args=[self.comment.pk]))
+
+    def test_account_pages(self):
+        """Test the donation history and account activation"""
+        self.assertIndexed(reverse('my_donations'))
+        self.assertIndexed(reverse('my_donations'), self.cursor(self.donation, ['-timestamp', 'id']))
+        self.client.logout()
+        self.assertIndexed(reverse('activate_account', args=[self.token.token]))
+
+    def test_hot_filters(self):
+        """Test that the featured rail and the category fill of similar projects use their own indexes"""
+        featured = RAILS['featured']()[:RAIL_SIZE].query.sql_with_params()
+        self.assertIn('SEARCH projects_project USING INDEX project_featured_idx (status=?)', self.plan(*featured))
+        with CaptureQueriesContext(connection) as queries:
+            SimilarityEngine()._category_fill(self.category.pk, [self.project.pk], 6)
+        self.assertIn('(category_id=? AND status=?)', ''.join(self.plan(queries.captured_queries[0]['sql'])))
+
+    def test_regressions_are_caught(self):
+        """Test that an unindexed filter and an unindexed ordering are reported"""
+        scan = Project.objects.filter(details='x').query.sql_with_params()
+        self.assertTrue(self.plan_problems(*scan)[0].startswith('SCAN projects_project in'))
+        comments = Comment.objects.filter(project=self.project, parent__isnull=True).order_by('content')
+        self.assertTrue(self.plan_problems(*comments.query.sql_with_params())[0].startswith('USE TEMP B-TREE'))
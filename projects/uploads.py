@@ -0,0 +1,183 @@
+"""
+Streaming upload handling.
+
+Django's default handlers keep small uploads in memory and only find out a
+file is too big or isn't an image once the whole request has been read and
+the form's ImageField opens it. ``StreamingUploadHandler`` replaces them: it
+writes every upload to a temporary file chunk by chunk, hashes it as it goes
+(``projects.storage`` reuses the digest instead of reading the file again),
+and stops storing a file as soon as it is over ``MAX_SIZE``, its first bytes
+aren't one of ``ALLOWED_TYPES``, or the uploader has used up their
+``DAILY_QUOTA``. The rest of that file is read past without being written,
+so the fields that follow it in the request still arrive.
+
+A stopped upload never reaches ``request.FILES``; the reason is kept on the
+request, and forms using ``UploadLimitsMixin`` show it against the field.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+DEFAULTS = {
+    # Largest single file, in bytes
+    'MAX_SIZE': 10 * 1024 * 1024,
+    # Keys of SIGNATURES accepted
+    'ALLOWED_TYPES': ['jpeg', 'png', 'gif', 'webp'],
+    # Bytes one user (or address, when anonymous) may upload per day; None for no limit
+    'DAILY_QUOTA': 200 * 1024 * 1024,
+}
+
+# Leading bytes of each accepted format
+SIGNATURES = {
+    'jpeg': re.compile(rb'\xff\xd8\xff'),
+    'png': re.compile(rb'\x89PNG\r\n\x1a\n'),
+    'gif': re.compile(rb'GIF8[79]a'),
+    'webp': re.compile(rb'RIFF.{4}WEBP', re.DOTALL),
+}
+
+# Enough of the file to check every signature
+SNIFF_LENGTH = 12
+
+QUOTA_KEY_PREFIX = 'upload-quota'
+
+
+def get_upload_settings():
+    return {**DEFAULTS, **getattr(settings, 'UPLOAD_LIMITS', {})}
+
+
+def sniff_type(head, allowed=None):
+    """Name of the format whose signature ``head`` starts with, or None"""
+    for name in allowed or SIGNATURES:
+        if SIGNATURES[name].match(head):
+            return name
+    return None
+
+
+def quota_key(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        owner = f'user-{user.pk}'
+    else:
+        owner = f'ip-{request.META.get("REMOTE_ADDR", "")}'
+    return f'{QUOTA_KEY_PREFIX}:{owner}:{timezone.localdate().isoformat()}'
+
+
+def quota_used(request):
+    return cache.get(quota_key(request), 0)
+
+
+def charge_quota(request, size):
+    key = quota_key(request)
+    # A day and a bit, so the counter outlives the day it counts
+    if not cache.add(key, size, 25 * 60 * 60):
+        cache.incr(key, size)
+
+
+def rejected_uploads(request):
+    """Field name -> message for the uploads ``StreamingUploadHandler`` stopped"""
+    # Reading FILES parses the request if the view hasn't yet
+    request.FILES
+    return getattr(request, 'rejected_uploads', {})
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+    """
+    Upload handler that streams to disk, hashes and rejects early.
+
+    Files are always written to a temporary file, never buffered in memory.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.config = get_upload_settings()
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.quota_left = None
+        if self.config['DAILY_QUOTA'] is not None and self.request is not None:
+            self.quota_left = self.config['DAILY_QUOTA'] - quota_used(self.request)
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None,
+                 content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.rejected = False
+        self.digest = hashlib.sha256()
+        self.head = b''
+        # Browsers rarely send a per-file length; when they do, nothing needs reading
+        if content_length is not None:
+            self.check_size(content_length)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.rejected:
+            self.check_size(start + len(raw_data))
+        if not self.rejected and len(self.head) < SNIFF_LENGTH:
+            self.head += raw_data[:SNIFF_LENGTH - len(self.head)]
+            if len(self.head) >= SNIFF_LENGTH:
+                self.check_type()
+        if self.rejected:
+            # Skip the rest of the file; None keeps the chunk from any later handler
+            return None
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if not self.rejected and len(self.head) < SNIFF_LENGTH:
+            # Shorter than the sniffed prefix; check what there is
+            self.check_type()
+        if self.rejected:
+            return None
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.digest.hexdigest()
+        if self.request is not None and self.config['DAILY_QUOTA'] is not None:
+            charge_quota(self.request, file_size)
+            self.quota_left -= file_size
+        return uploaded
+
+    def check_size(self, size):
+        max_size = self.config['MAX_SIZE']
+        if max_size is not None and size > max_size:
+            self.reject(f'The file is too large; the limit is {filesizeformat(max_size)}.')
+        elif self.quota_left is not None and size > self.quota_left:
+            self.reject(
+                f'You have reached your daily upload limit of {filesizeformat(self.config["DAILY_QUOTA"])}.'
+            )
+
+    def check_type(self):
+        if not sniff_type(self.head, self.config['ALLOWED_TYPES']):
+            names = ', '.join(name.upper() for name in self.config['ALLOWED_TYPES'])
+            self.reject(f'Unsupported file type; upload a {names} image.')
+
+    def reject(self, message):
+        if self.request is not None:
+            if not hasattr(self.request, 'rejected_uploads'):
+                self.request.rejected_uploads = {}
+            self.request.rejected_uploads[self.field_name] = message
+        self.rejected = True
+        # Deletes the temporary file; nothing more is written to it
+        self.file.close()
+
+
+class UploadLimitsMixin:
+    """
+    Form mixin that reports uploads rejected by ``StreamingUploadHandler``.
+
+    Pass ``upload_errors=rejected_uploads(request)`` when binding the form.
+    """
+
+    def __init__(self, *args, upload_errors=None, **kwargs):
+        self.upload_errors = upload_errors or {}
+        super().__init__(*args, **kwargs)
+
+    def _post_clean(self):
+        super()._post_clean()
+        for field, message in self.upload_errors.items():
+            if field not in self.fields:
+                continue
+            # Replaces "This field is required.", which would only confuse
+            self._errors.pop(field, None)
+            self.cleaned_data.pop(field, None)
+            self.add_error(field, message)
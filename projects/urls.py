@@ -8,10 +8,16 @@ urlpatterns = [
     path('search-suggestions/', views.search_suggestions, name='search_suggestions'),
     path('<int:project_id>/', views.project_detail_view, name='project_detail'),
     path('<int:project_id>/donate/', views.donate_view, name='donate'),
+    path('<int:project_id>/donations/daily/', views.donation_series_api, name='donation_series_api'),
     path('<int:project_id>/comment/', views.add_comment_view, name='add_comment'),
     path('comment/<int:comment_id>/reply/', views.add_reply_view, name='add_reply'),
+    path('<int:project_id>/comments/', views.comment_list_api, name='comment_list_api'),
+    path('comment/<int:comment_id>/replies/', views.comment_replies_api, name='comment_replies_api'),
+    path('comment/<int:comment_id>/thread/', views.comment_thread_api, name='comment_thread_api'),
     path('<int:project_id>/report/', views.report_project_view, name='report_project'),
     path('comment/<int:comment_id>/report/', views.report_comment_view, name='report_comment'),
     path('<int:project_id>/rate/', views.rate_project_view, name='rate_project'),
+    path('<int:project_id>/gallery/', views.project_gallery_view, name='project_gallery'),
+    path('<int:project_id>/gallery/order/', views.reorder_gallery_view, name='reorder_gallery'),
     path('<int:project_id>/cancel/', views.cancel_project_view, name='cancel_project'),
 ]
\ No newline at end of file
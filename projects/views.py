@@ -1,78 +1,101 @@
 from django.shortcuts import render, redirect
-from .forms import ProjectForm
+from .forms import GalleryUploadForm, ProjectForm
 from django.contrib.auth.decorators import login_required
-from .models import Project, Donation, Comment, ProjectReport, CommentReport, ProjectRating, ProjectImage, Category
+from .models import Project, Comment, ProjectReport, CommentReport, ProjectRating, ProjectImage, Category, Tag
 from django.contrib import messages
-from django.db.models import Q
 from django.http import JsonResponse
+from django.core.cache import cache
+from django.db import transaction
+from django.template.defaultfilters import date as format_date
+from django.urls import reverse
+from django.utils.timezone import localtime
+import logging
+import uuid
+from .donations import DonationError, donate
+from .pagination import cached_count, paginate, query_cache_key
+from .rails import get_home_rails
+from .routing import read_replica
+from .search import search_projects
+from .uploads import rejected_uploads
+
+logger = logging.getLogger(__name__)
+
+COMMENTS_PER_PAGE = 20
+# Top-level comments are newest first, replies read oldest first
+COMMENT_ORDERING = ['-timestamp', 'id']
+REPLY_ORDERING = ['timestamp', 'id']
 
 @login_required
 def my_projects_view(request):
     user = request.user
-    my_projects = Project.objects.filter(owner=user)
-    return render(request, 'my_projects.html', {'projects':my_projects})
+    my_projects = Project.objects.filter(owner=user).with_card_stats()
+    page = paginate(request, my_projects, ['-start_time', 'id'])
+    return render(request, 'my_projects.html', {'projects': page.object_list, 'page': page})
 
+@read_replica
 def all_projects_view(request):
     category_id = request.GET.get('category')
+    tag_name = request.GET.get('tag', '').strip().lower()
     search_query = request.GET.get('search', '').strip()
     categories = Category.objects.all()
 
-    projects = Project.objects.all()
+    projects = Project.objects.with_card_stats()
     selected_category = None
 
     if category_id:
         projects = projects.filter(category_id=category_id)
         selected_category = Category.objects.get(id=category_id)
 
+    if tag_name:
+        # Indexed join through ProjectTag
+        projects = projects.filter(tags__name=tag_name)
+
+    ordering = ['-start_time', 'id']
     if search_query:
-        # Enhanced search with multiple fields
-        projects = projects.filter(
-            Q(title__icontains=search_query) |
-            Q(tags__icontains=search_query) |
-            Q(details__icontains=search_query) |
-            Q(category__name__icontains=search_query) |
-            Q(owner__first_name__icontains=search_query) |
-            Q(owner__last_name__icontains=search_query)
-        ).distinct()
-        
-        # Order results by relevance (title matches first, then other fields)
-        from django.db.models import Case, When, IntegerField
-        projects = projects.annotate(
-            relevance=Case(
-                When(title__icontains=search_query, then=3),
-                When(tags__icontains=search_query, then=2),
-                When(details__icontains=search_query, then=1),
-                default=0,
-                output_field=IntegerField(),
-            )
-        ).order_by('-relevance', '-start_time')
+        # Full-text search, ordered by relevance (title matches first)
+        projects = search_projects(projects, search_query)
+        ordering = ['-relevance', '-start_time', 'id']
+
+    page = paginate(request, projects, ordering)
+    total_count = cached_count(projects) if search_query or selected_category or tag_name else None
+    tag_facets = cache.get_or_set(
+        query_cache_key('tag-facets', projects),
+        lambda: list(Tag.objects.facets(projects)),
+        300,
+    )
 
     context = {
-        'projects': projects,
+        'projects': page.object_list,
+        'page': page,
         'categories': categories,
         'selected_category': selected_category,
+        'selected_tag': tag_name,
+        'tag_facets': tag_facets,
         'search_query': search_query,
-        'search_results_count': projects.count() if search_query else None,
+        'search_results_count': total_count if search_query else None,
+        'total_count': total_count,
     }
     return render(request, 'all_projects.html', context)
 
 @login_required
 def create_project(request):
     if request.method == 'POST':
-        form = ProjectForm(request.POST, request.FILES) 
+        form = ProjectForm(request.POST, request.FILES, upload_errors=rejected_uploads(request))
         if form.is_valid():
             try:
-                project = form.save(commit=False)
-                project.owner = request.user  
-                project.save()
+                # One transaction, so the project and its tags update similar projects once, at commit
+                with transaction.atomic():
+                    project = form.save(commit=False)
+                    project.owner = request.user
+                    project.save()
+                    form.save_m2m()
                 
                 messages.success(request, f'Project "{project.title}" created successfully!')
                 return redirect('project_detail', project_id=project.id)
             except Exception as e:
                 messages.error(request, f'Error creating project: {str(e)}')
         else:
-            # Print form errors for debugging
-            print("Form errors:", form.errors)
+            logger.debug('Project form rejected: %s', form.errors.as_json())
             for field, errors in form.errors.items():
                 for error in errors:
                     messages.error(request, f'{field}: {error}')
@@ -81,16 +104,17 @@ def create_project(request):
    
     return render(request, 'form.html', {'form': form, 'title': 'Create Project'})
 
+@read_replica
 def project_detail_view(request, project_id):
     try:
         project = Project.objects.get(id=project_id)
-        # Get total donations for this project
-        donations = project.donation_set.all()
-        total_donations = sum(donation.amount for donation in donations)
+        # Get total donations for this project from the stored counters
+        total_donations = project.get_total_donations()
         # Calculate progress percentage
-        progress_percentage = (total_donations / project.total_target) * 100 if project.total_target > 0 else 0
-        # Get comments for this project (only top-level comments, not replies)
-        comments = project.comment_set.filter(parent__isnull=True).order_by('-timestamp')
+        progress_percentage = project.get_donation_percentage()
+        # Only the first page of top-level comments; more comments and all replies load through the JSON API
+        top_level_comments = project.comment_set.filter(parent__isnull=True)
+        comments = paginate(request, top_level_comments.with_reply_counts(), COMMENT_ORDERING, COMMENTS_PER_PAGE)
         
         # Get all images for this project
         project_images = project.projectimage_set.all()
@@ -110,11 +134,12 @@ def project_detail_view(request, project_id):
             'total_donations': total_donations,
             'progress_percentage': min(progress_percentage, 100),
             'comments': comments,
-            'donation_count': donations.count(),
+            'comment_count': top_level_comments.count(),
+            'donation_count': project.get_donation_count(),
             'average_rating': average_rating,
             'rating_count': rating_count,
             'user_rating': user_rating,
-            'donation_percentage': project.get_donation_percentage(),
+            'donation_percentage': progress_percentage,
             'project_images': project_images,
             'similar_projects': similar_projects,
         }
@@ -131,27 +156,25 @@ def donate_view(request, project_id):
         if project.is_cancelled():
             return redirect('project_detail', project_id=project_id)
         
+        error = None
         if request.method == 'POST':
-            amount = request.POST.get('amount')
-            if amount and float(amount) > 0:
-                # Create donation
-                donation = Donation.objects.create(
-                    user=request.user,
-                    project=project,
-                    amount=float(amount)
-                )
+            try:
+                # Validated as a Decimal and recorded once per idempotency key
+                donate(request.user, project, request.POST.get('amount'), request.POST.get('idempotency_key'))
                 return redirect('project_detail', project_id=project_id)
+            except DonationError as e:
+                error = str(e)
         
         # Calculate donation data for display
-        donations = project.donation_set.all()
-        total_donations = sum(donation.amount for donation in donations)
-        progress_percentage = (total_donations / project.total_target) * 100 if project.total_target > 0 else 0
-        
         context = {
             'project': project,
-            'total_donations': total_donations,
-            'progress_percentage': min(progress_percentage, 100),
-            'donation_count': donations.count(),
+            'total_donations': project.get_total_donations(),
+            'progress_percentage': min(project.get_donation_percentage(), 100),
+            'donation_count': project.get_donation_count(),
+            'error': error,
+            'amount': request.POST.get('amount', ''),
+            # Keep the key on a failed attempt so a retry is still the same donation
+            'idempotency_key': request.POST.get('idempotency_key') or uuid.uuid4().hex,
         }
         return render(request, 'donate.html', context)
     except Project.DoesNotExist:
@@ -203,6 +226,75 @@ def add_reply_view(request, comment_id):
     except Comment.DoesNotExist:
         return redirect('all_projects')
 
+def serialize_comment(comment):
+    """JSON representation of a comment for the comment API"""
+    return {
+        'id': comment.id,
+        'author': comment.get_author_name(),
+        'content': comment.content,
+        'timestamp': comment.timestamp.isoformat(),
+        'timestamp_display': format_date(localtime(comment.timestamp), 'F j, Y g:i A'),
+        'reply_count': comment.get_reply_count(),
+        'replies_url': reverse('comment_replies_api', args=[comment.id]),
+        'reply_url': reverse('add_reply', args=[comment.id]),
+        'report_url': reverse('report_comment', args=[comment.id]),
+    }
+
+def serialize_thread(comment):
+    """A comment and its replies at every depth, from CommentQuerySet.thread()"""
+    return {**serialize_comment(comment), 'replies': [serialize_thread(reply) for reply in comment.get_replies()]}
+
+def comment_page_response(page):
+    return JsonResponse({
+        'comments': [serialize_comment(comment) for comment in page],
+        'next_cursor': page.next_cursor,
+    })
+
+@read_replica
+def comment_list_api(request, project_id):
+    """JSON page of a project's top-level comments, newest first"""
+    comments = Comment.objects.filter(project_id=project_id, parent__isnull=True).with_reply_counts()
+    return comment_page_response(paginate(request, comments, COMMENT_ORDERING, COMMENTS_PER_PAGE))
+
+@read_replica
+def comment_replies_api(request, comment_id):
+    """JSON page of the direct replies to a comment, oldest first"""
+    replies = Comment.objects.filter(parent_id=comment_id).with_reply_counts()
+    return comment_page_response(paginate(request, replies, REPLY_ORDERING, COMMENTS_PER_PAGE))
+
+@read_replica
+def comment_thread_api(request, comment_id):
+    """JSON tree of a comment's replies at every depth, loaded with one path prefix query"""
+    comment = Comment.objects.filter(pk=comment_id).values('project_id', 'path').first()
+    if comment is None:
+        return JsonResponse({'error': 'Comment not found'}, status=404)
+    subtree = Comment.objects.filter(project_id=comment['project_id'], path__startswith=comment['path']).thread()
+    return JsonResponse({'comments': [serialize_thread(reply) for reply in subtree[0].get_replies()]})
+
+SERIES_DAYS = 30
+MAX_SERIES_DAYS = 365
+
+@login_required
+def donation_series_api(request, project_id):
+    """JSON daily donation series of a project for the owner's funding chart"""
+    try:
+        project = Project.objects.get(id=project_id)
+    except Project.DoesNotExist:
+        return JsonResponse({'error': 'Project not found'}, status=404)
+    if project.owner != request.user and not request.user.is_staff:
+        return JsonResponse({'error': 'Only the project owner can see this'}, status=403)
+    try:
+        days = min(max(int(request.GET.get('days', SERIES_DAYS)), 1), MAX_SERIES_DAYS)
+    except ValueError:
+        days = SERIES_DAYS
+    return JsonResponse({
+        'project': project.id,
+        'days': days,
+        'total_donations': project.get_total_donations(),
+        'donation_count': project.get_donation_count(),
+        'series': project.get_donation_series(days),
+    })
+
 @login_required
 def report_project_view(request, project_id):
     try:
@@ -311,6 +403,56 @@ def rate_project_view(request, project_id):
     except Project.DoesNotExist:
         return redirect('all_projects')
 
+@login_required
+def project_gallery_view(request, project_id):
+    """Owner page for uploading many gallery images at once and ordering them"""
+    try:
+        project = Project.objects.get(id=project_id)
+    except Project.DoesNotExist:
+        return redirect('all_projects')
+    if project.owner != request.user:
+        return redirect('project_detail', project_id=project_id)
+
+    if request.method == 'POST':
+        form = GalleryUploadForm(request.POST, request.FILES, upload_errors=rejected_uploads(request))
+        if form.is_valid():
+            # One transaction, one INSERT and one UPDATE however many files there are
+            images = ProjectImage.objects.add_gallery(project, form.cleaned_data['images'])
+            messages.success(request, f'Added {len(images)} images to the gallery.')
+            return redirect('project_gallery', project_id=project_id)
+    else:
+        form = GalleryUploadForm()
+    return render(request, 'project_gallery.html', {
+        'project': project,
+        'form': form,
+        'project_images': project.projectimage_set.all(),
+    })
+
+@login_required
+def reorder_gallery_view(request, project_id):
+    """Save the gallery order and primary image from the gallery page"""
+    try:
+        project = Project.objects.get(id=project_id)
+    except Project.DoesNotExist:
+        return redirect('all_projects')
+    if project.owner != request.user or request.method != 'POST':
+        return redirect('project_detail', project_id=project_id)
+
+    positions = []
+    for index, image_id in enumerate(project.projectimage_set.values_list('id', flat=True)):
+        try:
+            # Ties and blanks keep their current relative order
+            positions.append((int(request.POST.get(f'position-{image_id}') or index), index, image_id))
+        except ValueError:
+            positions.append((index, index, image_id))
+    with transaction.atomic():
+        ProjectImage.objects.reorder(project, [image_id for position, index, image_id in sorted(positions)])
+        primary = request.POST.get('primary')
+        if primary and primary.isdigit():
+            ProjectImage.objects.set_primary(project, int(primary))
+    messages.success(request, 'Gallery order saved.')
+    return redirect('project_gallery', project_id=project_id)
+
 @login_required
 def cancel_project_view(request, project_id):
     try:
@@ -342,24 +484,12 @@ def cancel_project_view(request, project_id):
     except Project.DoesNotExist:
         return redirect('all_projects')
 
+@read_replica
 def home_view(request):
-    # Get featured and top projects
-    featured_projects = Project.objects.filter(featured=True, status='active').order_by('-start_time')[:6]
-    latest_projects = Project.objects.filter(status='active').order_by('-start_time')[:6]
-    
-    # Get top rated projects
-    from django.db.models import Avg
-    top_projects = Project.objects.filter(status='active').annotate(
-        avg_rating=Avg('projectrating__rating')
-    ).filter(avg_rating__isnull=False).order_by('-avg_rating')[:6]
-    
-    context = {
-        'featured_projects': featured_projects,
-        'top_projects': top_projects,
-        'latest_projects': latest_projects,
-    }
-    return render(request, 'home.html', context)
+    # Featured, latest and top rated rails, served from the cache
+    return render(request, 'home.html', get_home_rails())
 
+@read_replica
 def search_suggestions(request):
     """AJAX endpoint for search suggestions and results"""
     try:
@@ -367,15 +497,8 @@ def search_suggestions(request):
         if len(query) < 2:
             return JsonResponse({'suggestions': [], 'projects': []})
         
-        # Get actual project results - case insensitive
-        projects = Project.objects.filter(
-            Q(title__icontains=query) |
-            Q(tags__icontains=query) |
-            Q(details__icontains=query) |
-            Q(category__name__icontains=query) |
-            Q(owner__first_name__icontains=query) |
-            Q(owner__last_name__icontains=query)
-        ).distinct()[:10]
+        # Get actual project results from the search index
+        projects = search_projects(Project.objects.with_card_stats(), query).order_by('-relevance', '-start_time')[:10]
         
         # Serialize projects
         from django.urls import reverse
@@ -388,8 +511,8 @@ def search_suggestions(request):
                     'title': project.title,
                     'owner_name': f"{project.owner.first_name} {project.owner.last_name}",
                     'description': project.details[:150] + '...' if len(project.details) > 150 else project.details,
-                    'image_url': main_image.url if main_image else '',
-                    'tags': [tag.strip() for tag in project.tags.split()] if project.tags else [],
+                    'image_url': main_image.variant_url('card') if main_image else '',
+                    'tags': [tag.name for tag in project.tags.all()],
                     'url': reverse('project_detail', args=[project.id]),
                     'category': project.category.name if project.category else 'General',
                     'donation_percentage': project.get_donation_percentage(),
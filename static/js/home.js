@@ -0,0 +1,109 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const sliderTrack = document.getElementById('slider-track');
+    const prevBtn = document.getElementById('prev-btn');
+    const nextBtn = document.getElementById('next-btn');
+    const dots = document.querySelectorAll('.dot');
+    const loadingElement = document.getElementById('slider-loading');
+
+    if (!sliderTrack) return;
+
+    // Hide loading state when slider is ready
+    if (loadingElement) {
+        setTimeout(() => {
+            loadingElement.classList.add('hidden');
+        }, 1000);
+    }
+
+    let currentSlide = 0;
+    const slideCount = dots.length;
+
+    function updateSlider() {
+        // Move slider to show current slide
+        sliderTrack.style.transform = `translateX(-${currentSlide * 100}%)`;
+
+        // Update dots
+        dots.forEach((dot, index) => {
+            const isActive = index === currentSlide;
+            dot.classList.toggle('active', isActive);
+            dot.setAttribute('aria-selected', isActive.toString());
+        });
+
+        // Update navigation buttons
+        if (prevBtn) prevBtn.disabled = currentSlide === 0;
+        if (nextBtn) nextBtn.disabled = currentSlide === slideCount - 1;
+    }
+
+    function nextSlide() {
+        if (currentSlide < slideCount - 1) {
+            currentSlide++;
+            updateSlider();
+        }
+    }
+
+    function prevSlide() {
+        if (currentSlide > 0) {
+            currentSlide--;
+            updateSlider();
+        }
+    }
+
+    function goToSlide(index) {
+        if (index >= 0 && index < slideCount) {
+            currentSlide = index;
+            updateSlider();
+        }
+    }
+
+    // Event listeners
+    if (prevBtn) prevBtn.addEventListener('click', prevSlide);
+    if (nextBtn) nextBtn.addEventListener('click', nextSlide);
+
+    dots.forEach((dot, index) => {
+        dot.addEventListener('click', () => goToSlide(index));
+    });
+
+    // Auto-play slider
+    let autoPlayInterval = setInterval(nextSlide, 6000);
+
+    // Pause auto-play on hover
+    sliderTrack.addEventListener('mouseenter', () => {
+        clearInterval(autoPlayInterval);
+    });
+
+    sliderTrack.addEventListener('mouseleave', () => {
+        autoPlayInterval = setInterval(nextSlide, 6000);
+    });
+
+    // Keyboard navigation
+    document.addEventListener('keydown', (e) => {
+        if (e.key === 'ArrowLeft') {
+            prevSlide();
+        } else if (e.key === 'ArrowRight') {
+            nextSlide();
+        }
+    });
+
+    // Touch/swipe support for mobile
+    let startX = 0;
+    let endX = 0;
+
+    sliderTrack.addEventListener('touchstart', (e) => {
+        startX = e.touches[0].clientX;
+    });
+
+    sliderTrack.addEventListener('touchend', (e) => {
+        endX = e.changedTouches[0].clientX;
+        const diff = startX - endX;
+
+        if (Math.abs(diff) > 50) { // Minimum swipe distance
+            if (diff > 0) {
+                nextSlide();
+            } else {
+                prevSlide();
+            }
+        }
+    });
+
+    // Initialize slider
+    updateSlider();
+});
@@ -0,0 +1,96 @@
+document.addEventListener('DOMContentLoaded', function() {
+    function pageUrl(url, cursor) {
+        return cursor ? url + '?cursor=' + encodeURIComponent(cursor) : url;
+    }
+
+    // Fill a cloned comment or reply template from the JSON API
+    function buildComment(templateId, comment) {
+        const node = document.getElementById(templateId).content.firstElementChild.cloneNode(true);
+        node.querySelector('[data-field="author"]').textContent = comment.author;
+        node.querySelector('[data-field="timestamp"]').textContent = comment.timestamp_display;
+        node.querySelector('[data-field="content"]').textContent = comment.content;
+        node.querySelector('[data-field="report"]').href = comment.report_url;
+
+        const loadReplies = node.querySelector('.load-replies');
+        if (comment.reply_count > 0) {
+            loadReplies.dataset.url = comment.replies_url;
+            loadReplies.textContent = 'Show replies (' + comment.reply_count + ')';
+        } else {
+            loadReplies.remove();
+        }
+
+        const replyButton = node.querySelector('.reply-btn');
+        if (replyButton) {
+            replyButton.dataset.commentId = comment.id;
+            node.querySelector('.cancel-reply').dataset.commentId = comment.id;
+            node.querySelector('.reply-form').id = 'reply-form-' + comment.id;
+            node.querySelector('.reply-form form').action = comment.reply_url;
+            if (comment.reply_count > 0) {
+                node.querySelector('[data-field="reply-count"]').textContent = '(' + comment.reply_count + ')';
+            }
+        }
+        return node;
+    }
+
+    // Fetch the next page from a "load" button and append it before the button
+    function loadPage(button, container, templateId, moreLabel) {
+        button.disabled = true;
+        fetch(pageUrl(button.dataset.url, button.dataset.cursor))
+            .then(function(response) { return response.json(); })
+            .then(function(data) {
+                data.comments.forEach(function(comment) {
+                    container.appendChild(buildComment(templateId, comment));
+                });
+                if (data.next_cursor) {
+                    button.dataset.cursor = data.next_cursor;
+                    button.textContent = moreLabel;
+                    button.disabled = false;
+                } else {
+                    button.remove();
+                }
+            })
+            .catch(function() {
+                button.disabled = false;
+            });
+    }
+
+    // Event delegation so comments added later get the same behaviour
+    document.addEventListener('click', function(event) {
+        const replyButton = event.target.closest('.reply-btn');
+        if (replyButton) {
+            const replyForm = document.getElementById('reply-form-' + replyButton.dataset.commentId);
+            const wasHidden = replyForm.style.display === 'none';
+
+            // Hide all other reply forms first
+            document.querySelectorAll('.reply-form').forEach(function(form) {
+                form.style.display = 'none';
+            });
+
+            // Toggle the clicked form
+            if (wasHidden) {
+                replyForm.style.display = 'block';
+                replyForm.querySelector('textarea').focus();
+            }
+            return;
+        }
+
+        // Handle cancel reply button clicks
+        const cancelButton = event.target.closest('.cancel-reply');
+        if (cancelButton) {
+            document.getElementById('reply-form-' + cancelButton.dataset.commentId).style.display = 'none';
+            return;
+        }
+
+        const loadReplies = event.target.closest('.load-replies');
+        if (loadReplies) {
+            loadPage(loadReplies, loadReplies.previousElementSibling, 'reply-template', 'Show more replies');
+            return;
+        }
+
+        const loadMore = event.target.closest('#load-more-comments');
+        if (loadMore) {
+            event.preventDefault();
+            loadPage(loadMore, document.getElementById('comment-list'), 'comment-template', 'Load more comments');
+        }
+    });
+});
@@ -56,9 +56,9 @@ def test_search():
             details='This is a test project for technology',
             total_target=1000.00,
             category=category,
-            tags='technology test python',
             status='active'
         )
+        project.set_tags(['technology', 'test', 'python'])
         print(f"Created test project: {project.title}")
     
     # Test search functionality
@@ -67,7 +67,7 @@ def test_search():
     
     results = Project.objects.filter(
         Q(title__icontains=search_query) |
-        Q(tags__icontains=search_query) |
+        Q(tags__name__icontains=search_query) |
         Q(details__icontains=search_query) |
         Q(category__name__icontains=search_query) |
         Q(owner__first_name__icontains=search_query) |
@@ -77,7 +77,7 @@ def test_search():
     print(f"Found {results.count()} projects:")
     for project in results:
         print(f"  - {project.title} (by {project.owner.first_name} {project.owner.last_name})")
-        print(f"    Tags: {project.tags}")
+        print(f"    Tags: {' '.join(tag.name for tag in project.tags.all())}")
         print(f"    Category: {project.category.name if project.category else 'None'}")
     
     # Test case-insensitive search
@@ -86,7 +86,7 @@ def test_search():
     
     results_upper = Project.objects.filter(
         Q(title__icontains=search_query_upper) |
-        Q(tags__icontains=search_query_upper) |
+        Q(tags__name__icontains=search_query_upper) |
         Q(details__icontains=search_query_upper) |
         Q(category__name__icontains=search_query_upper) |
         Q(owner__first_name__icontains=search_query_upper) |